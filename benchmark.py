@@ -0,0 +1,460 @@
+"""
+Benchmarks for the HTML to Typst translator.
+
+Run all benchmarks with ``python benchmark.py``, or pick some by name:
+``python benchmark.py debug_logging_off``.
+"""
+
+import logging
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from html2typst import (
+    translate_html_to_typst, translate_html_to_typst_incremental, translate_delta_to_typst, translate_many,
+    RenderContext, DebugLogSink, Translator, ResultCache, DiskCache, SubtreeCache, Limits,
+)
+from quill_fixtures import delta_to_html
+
+
+def sample_document(blocks: int = 2000) -> str:
+    """Build a Quill-style document exercising classes, styles and lists."""
+    parts = []
+    for i in range(blocks):
+        parts.append(
+            f'<p class="ql-align-center"><strong>Heading {i}</strong> with '
+            f'<span style="color: red; font-size: 14px">styled</span> text &amp; more</p>'
+            f'<ul><li class="ql-indent-1">first {i}</li><li><em>second</em><br></li></ul>'
+            f'<blockquote>quote {i}</blockquote><p><br></p>'
+        )
+    return ''.join(parts)
+
+
+def small_snippets(count: int = 2000) -> list:
+    """Build varied Quill snippets under 1KB, like single editor fields."""
+    templates = [
+        '<p>Comment {i}</p>',
+        '<p>Note with <strong>bold {i}</strong> and <em>italic</em> text.</p>',
+        '<p class="ql-align-center"><span style="color: rgb(230, 0, 0);">Title {i}</span></p>',
+        '<ul><li>first {i}</li><li class="ql-indent-1">second</li></ul><p><br></p>',
+        '<p>Price: $5 #{i} <a href="https://example.com/{i}">link</a></p>',
+        '<ol><li><u>step</u> {i}</li><li>step 2</li></ol><blockquote>quote</blockquote>',
+    ]
+    return [templates[i % len(templates)].format(i=i) for i in range(count)]
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Return the value at fraction (0..1) of an already sorted list."""
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def time_best(func, repeat: int = 5) -> float:
+    """Return the best wall-clock time of func() over repeat runs, in seconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_debug_logging_off():
+    """Verify that translation with debug off does no logging work."""
+    print("=" * 60)
+    print("BENCHMARK: Debug logging with debug=False")
+    print("=" * 60)
+
+    html = sample_document()
+
+    # Count every call into the logging surface while translating
+    with mock.patch.object(RenderContext, 'log', autospec=True) as log, \
+            mock.patch.object(logging.Logger, 'log', autospec=True) as logger_log:
+        translate_html_to_typst(html)
+    calls = log.call_count + logger_log.call_count
+
+    production = time_best(lambda: translate_html_to_typst(html))
+
+    with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.log') as f:
+        log_path = f.name
+    try:
+        debug = time_best(lambda: translate_html_to_typst(html, debug=True, debug_log_path=log_path))
+    finally:
+        os.unlink(log_path)
+
+    print(f"Input size:    {len(html)} characters")
+    print(f"Logging calls: {calls} (debug off)")
+    print(f"debug=False:   {production * 1000:.1f} ms")
+    print(f"debug=True:    {debug * 1000:.1f} ms")
+    print()
+    return calls == 0
+
+
+def bench_debug_sink():
+    """Compare per-request latency of debug logging to a shared sink."""
+    print("=" * 60)
+    print("BENCHMARK: Debug logging to a shared DebugLogSink")
+    print("=" * 60)
+
+    html = sample_document(20)
+    requests = 200
+
+    with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.log') as f:
+        log_path = f.name
+    try:
+        production = time_best(lambda: [translate_html_to_typst(html) for _ in range(requests)])
+        own_file = time_best(lambda: [
+            translate_html_to_typst(html, debug=True, debug_log_path=log_path) for _ in range(requests)
+        ])
+        with DebugLogSink(log_path, mode='w') as sink:
+            shared = time_best(lambda: [
+                translate_html_to_typst(html, debug=True, debug_sink=sink) for _ in range(requests)
+            ])
+    finally:
+        os.unlink(log_path)
+
+    print(f"Requests:           {requests} x {len(html)} characters")
+    print(f"debug=False:        {production / requests * 1000:.3f} ms/request")
+    print(f"debug_log_path:     {own_file / requests * 1000:.3f} ms/request")
+    print(f"shared debug_sink:  {shared / requests * 1000:.3f} ms/request")
+    print()
+
+
+def bench_translator_latency():
+    """Report p50/p99 latency for small inputs, function API vs Translator."""
+    print("=" * 60)
+    print("BENCHMARK: Small-snippet latency, function vs Translator")
+    print("=" * 60)
+
+    snippets = small_snippets()
+    assert all(len(html.encode('utf-8')) < 1024 for html in snippets)
+    translator = Translator()
+
+    def latencies(translate):
+        times = []
+        for _ in range(3):
+            for html in snippets:
+                start = time.perf_counter()
+                translate(html)
+                times.append(time.perf_counter() - start)
+        return sorted(times)
+
+    ok = all(translator.translate(html) == translate_html_to_typst(html) for html in snippets)
+    function_times = latencies(translate_html_to_typst)
+    translator_times = latencies(translator.translate)
+
+    print(f"Snippets:  {len(snippets)} x 3 runs, "
+          f"{min(map(len, snippets))}-{max(map(len, snippets))} characters")
+    print(f"{'':12}{'p50 (us)':>10}{'p99 (us)':>10}")
+    for name, times in (('function', function_times), ('Translator', translator_times)):
+        print(f"{name:12}{percentile(times, 0.5) * 1e6:>10.1f}{percentile(times, 0.99) * 1e6:>10.1f}")
+    print(f"Identical output: {ok}")
+    print()
+    return ok
+
+
+def bench_thread_scaling():
+    """Report translation throughput against thread count."""
+    print("=" * 60)
+    print("BENCHMARK: Throughput vs threads")
+    print("=" * 60)
+
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print(f"Interpreter: Python {sys.version.split()[0]}, "
+          f"{'GIL enabled' if gil else 'free-threaded (GIL disabled)'}")
+
+    snippets = small_snippets(4000)
+    expected = [translate_html_to_typst(html) for html in snippets]
+    counts = sorted({1, 2, 4, 8, os.cpu_count() or 1})
+    print(f"{'threads':>8}{'docs/s':>12}{'speedup':>10}")
+
+    def work(part):
+        translator = Translator()  # One per thread
+        return [translator.translate(html) for html in part]
+
+    ok = True
+    base = None
+    for threads in counts:
+        parts = [snippets[i::threads] for i in range(threads)]
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            start = time.perf_counter()
+            results = list(pool.map(work, parts))
+            elapsed = time.perf_counter() - start
+        ok = ok and all(results[i] == expected[i::threads] for i in range(threads))
+        rate = len(snippets) / elapsed
+        base = base or rate
+        print(f"{threads:>8}{rate:>12.0f}{rate / base:>10.2f}x")
+    print(f"Outputs correct: {ok}")
+    print()
+    return ok
+
+
+def bench_translate_many():
+    """Report translate_many throughput against worker processes."""
+    print("=" * 60)
+    print("BENCHMARK: translate_many throughput vs workers")
+    print("=" * 60)
+
+    # Archive-like mix: many snippets plus some large documents
+    documents = small_snippets(20000) + [sample_document(50) for _ in range(20)]
+    expected = [translate_html_to_typst(html) for html in documents]
+    counts = sorted({1, 2, 4, os.cpu_count() or 1})
+    print(f"Documents: {len(documents)}, {sum(map(len, documents))} characters, "
+          f"{os.cpu_count()} CPUs")
+    print(f"{'workers':>8}{'docs/s':>12}{'speedup':>10}")
+
+    ok = True
+    base = None
+    for workers in counts:
+        start = time.perf_counter()
+        results = list(translate_many(documents, workers=workers))
+        elapsed = time.perf_counter() - start
+        ok = ok and results == expected
+        rate = len(documents) / elapsed
+        base = base or rate
+        print(f"{workers:>8}{rate:>12.0f}{rate / base:>10.2f}x")
+    print(f"Outputs correct: {ok}")
+    print()
+    return ok
+
+
+def bench_result_cache():
+    """Compare cache hit latency with translation, exact and normalized."""
+    print("=" * 60)
+    print("BENCHMARK: ResultCache hits vs translation")
+    print("=" * 60)
+
+    documents = small_snippets(200) + [sample_document(50) for _ in range(5)]
+    # The same documents as re-saved with newlines between top-level blocks
+    variants = ['\n'.join(html.replace('</p>', '</p>\n').splitlines()) + '\n' for html in documents]
+    cache = ResultCache()
+
+    miss = time_best(lambda: [translate_html_to_typst(html) for html in documents], repeat=3)
+    for html in documents:
+        translate_html_to_typst(html, cache=cache)
+    exact = time_best(lambda: [translate_html_to_typst(html, cache=cache) for html in documents])
+    ok = all(translate_html_to_typst(html, cache=cache) == translate_html_to_typst(html) for html in variants)
+    cache.clear()
+    for html in documents:
+        translate_html_to_typst(html, cache=cache)
+    start = time.perf_counter()
+    for html in variants:
+        translate_html_to_typst(html, cache=cache)
+    normalized = time.perf_counter() - start
+
+    stats = cache.stats()
+    print(f"Documents:        {len(documents)}, {sum(map(len, documents))} characters")
+    print(f"translate:        {miss * 1000:.1f} ms")
+    print(f"exact hits:       {exact * 1000:.1f} ms")
+    print(f"normalized hits:  {normalized * 1000:.1f} ms")
+    print(f"Cache:            {stats}")
+    print(f"Outputs correct:  {ok}")
+    print()
+    return ok
+
+
+def bench_disk_cache():
+    """Compare a cold nightly export with a re-run over a mostly unchanged corpus."""
+    print("=" * 60)
+    print("BENCHMARK: DiskCache, re-running an export with 5% changed")
+    print("=" * 60)
+
+    documents = small_snippets(5000) + [sample_document(20) for _ in range(50)]
+    changed = [html + '<p>edited</p>' if i % 20 == 0 else html for i, html in enumerate(documents)]
+    workers = os.cpu_count() or 1
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = DiskCache(os.path.join(directory, 'cache.db'))
+        start = time.perf_counter()
+        uncached = list(translate_many(changed, workers=workers))
+        baseline = time.perf_counter() - start
+        start = time.perf_counter()
+        list(translate_many(documents, workers=workers, cache=cache))
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        rerun = list(translate_many(changed, workers=workers, cache=cache))
+        warm = time.perf_counter() - start
+        stats = cache.stats()
+        size = os.path.getsize(cache.path)
+        cache.close()
+
+    ok = rerun == uncached
+    print(f"Documents:        {len(documents)}, {sum(map(len, documents))} characters, {workers} workers")
+    print(f"no cache:         {baseline * 1000:.0f} ms")
+    print(f"cold cache:       {cold * 1000:.0f} ms")
+    print(f"re-run (5% new):  {warm * 1000:.0f} ms")
+    print(f"Cache:            {stats['entries']} entries, {stats['bytes']} bytes stored, {size} byte file")
+    print(f"Outputs correct:  {ok}")
+    print()
+    return ok
+
+
+def templated_documents(count: int = 500, seed: int = 1) -> list:
+    """Build documents from shared template blocks plus a few unique ones."""
+    import random
+    rng = random.Random(seed)
+    blocks = [
+        f'<h2>Section {i}</h2><p class="ql-align-center"><strong>Terms {i}</strong> apply to '
+        f'<span style="color: red">all</span> customers &amp; partners. {"Lorem ipsum dolor sit amet. " * 5}</p>'
+        f'<ul><li>clause one</li><li><em>clause</em> two</li><li>clause three</li></ul>'
+        for i in range(30)
+    ]
+    documents = []
+    for d in range(count):
+        parts = rng.sample(blocks, 10) + [f'<p>Unique text for document {d}, part {k}</p>' for k in range(3)]
+        rng.shuffle(parts)
+        documents.append(''.join(parts))
+    return documents
+
+
+def bench_subtree_cache():
+    """Compare Translator with and without a SubtreeCache."""
+    print("=" * 60)
+    print("BENCHMARK: SubtreeCache on templated and on unique documents")
+    print("=" * 60)
+
+    templated = templated_documents()
+    unique = [
+        ''.join(f'<p>Document {d}, paragraph {k} with <strong>bold</strong> text</p><ul><li>item {d}.{k}</li></ul>'
+                for k in range(20))
+        for d in range(300)
+    ]
+    ok = True
+    print(f"{'':12}{'plain (ms)':>12}{'memo (ms)':>12}{'hit rate':>10}")
+    for name, documents in (('templated', templated), ('unique', unique)):
+        expected = [Translator().translate(html) for html in documents]
+        plain = time_best(lambda: [Translator().translate(html) for html in documents], repeat=3)
+        best = float('inf')
+        for _ in range(3):
+            # A fresh cache each run: the templated documents warm it up
+            # themselves, the unique ones never hit
+            cache = SubtreeCache()
+            translator = Translator(subtree_cache=cache)
+            start = time.perf_counter()
+            outputs = [translator.translate(html) for html in documents]
+            best = min(best, time.perf_counter() - start)
+            ok = ok and outputs == expected
+        print(f"{name:12}{plain * 1000:>12.0f}{best * 1000:>12.0f}{cache.stats()['hit_rate']:>10.2f}")
+    print(f"Outputs correct: {ok}")
+    print()
+    return ok
+
+
+def bench_incremental():
+    """Compare re-translating an edited document whole and incrementally."""
+    print("=" * 60)
+    print("BENCHMARK: Incremental re-translation of a one-paragraph edit")
+    print("=" * 60)
+
+    paragraph = ('<p>Paragraph {} with <strong>bold</strong>, <em>italic</em> and '
+                 '<a href="https://example.com/{}">a link</a>.</p>')
+    ok = True
+    print(f"{'paragraphs':>12}{'full (ms)':>12}{'edit (ms)':>12}")
+    for count in (100, 1000, 10000):
+        html = ''.join(paragraph.format(i, i) for i in range(count))
+        middle = html.index(f'Paragraph {count // 2} ') + 10
+        # Typing into the middle paragraph, one character per version
+        versions = [html[:middle] + 'x' * k + html[middle:] for k in range(1, 21)]
+        full = time_best(lambda: translate_html_to_typst(versions[-1]), repeat=3)
+        best = float('inf')
+        for _ in range(3):
+            _, state = translate_html_to_typst_incremental(html)
+            start = time.perf_counter()
+            for version in versions:
+                output, state = translate_html_to_typst_incremental(version, state)
+            best = min(best, (time.perf_counter() - start) / len(versions))
+        ok = ok and output == translate_html_to_typst(versions[-1])
+        print(f"{count:>12}{full * 1000:>12.1f}{best * 1000:>12.2f}")
+    print(f"Outputs correct: {ok}")
+    print()
+    return ok
+
+
+def bench_delta():
+    """Compare translating a Quill Delta directly and through its HTML."""
+    print("=" * 60)
+    print("BENCHMARK: Quill Delta to Typst, direct and through HTML")
+    print("=" * 60)
+
+    ops = []
+    for i in range(2000):
+        ops += [
+            {'insert': f'Paragraph {i} with '}, {'insert': 'bold', 'attributes': {'bold': True}},
+            {'insert': ' and '}, {'insert': 'a link', 'attributes': {'link': f'https://example.com/{i}'}},
+            {'insert': '.\nFirst item'}, {'insert': '\n', 'attributes': {'list': 'bullet'}},
+            {'insert': 'Second', 'attributes': {'italic': True}}, {'insert': '\n', 'attributes': {'list': 'bullet', 'indent': 1}},
+            {'insert': f'Heading {i}'}, {'insert': '\n', 'attributes': {'header': 2, 'align': 'center'}},
+        ]
+    delta = {'ops': ops}
+    html = delta_to_html(ops)
+
+    through_html = time_best(lambda: translate_html_to_typst(delta_to_html(ops)), repeat=3)
+    html_only = time_best(lambda: translate_html_to_typst(html), repeat=3)
+    direct = time_best(lambda: translate_delta_to_typst(delta), repeat=3)
+    ok = translate_delta_to_typst(delta) == translate_html_to_typst(html)
+    print(f"Delta -> HTML -> Typst:  {through_html * 1000:8.1f} ms")
+    print(f"  HTML -> Typst alone:   {html_only * 1000:8.1f} ms")
+    print(f"Delta -> Typst:          {direct * 1000:8.1f} ms ({through_html / direct:.1f}x faster)")
+    print(f"Outputs identical: {ok}")
+    print()
+    return ok
+
+
+def bench_limits():
+    """Compare translating adversarial input with and without resource budgets."""
+    print("=" * 60)
+    print("BENCHMARK: Adversarial input with and without Limits")
+    print("=" * 60)
+
+    limits = Limits(input_chars=1 << 20, nodes=20000, depth=200, seconds=0.5)
+    documents = {
+        'nested spans': '<span>' * 100000 + 'deep' + '</span>' * 100000,
+        'many elements': '<p><strong>a</strong> <em>b</em></p>' * 100000,
+        'normal': sample_document(200),
+    }
+    ok = True
+    print(f"{'document':>16}{'unlimited (ms)':>16}{'limited (ms)':>14}  budget hit")
+    for name, html in documents.items():
+        unlimited = time_best(lambda: translate_html_to_typst(html), repeat=3)
+        limited = time_best(lambda: translate_html_to_typst(html, limits=limits), repeat=3)
+        output = translate_html_to_typst(html, limits=limits)
+        limit = getattr(output, 'limit', None)
+        if name == 'normal':
+            ok = ok and limit is None and output == translate_html_to_typst(html)
+        else:
+            ok = ok and limit is not None
+        print(f"{name:>16}{unlimited * 1000:>16.1f}{limited * 1000:>14.1f}  {limit or '-'}")
+    print(f"Outputs correct: {ok}")
+    print()
+    return ok
+
+
+BENCHMARKS = {
+    'debug_logging_off': bench_debug_logging_off,
+    'debug_sink': bench_debug_sink,
+    'translator_latency': bench_translator_latency,
+    'thread_scaling': bench_thread_scaling,
+    'translate_many': bench_translate_many,
+    'result_cache': bench_result_cache,
+    'disk_cache': bench_disk_cache,
+    'subtree_cache': bench_subtree_cache,
+    'incremental': bench_incremental,
+    'delta': bench_delta,
+    'limits': bench_limits,
+}
+
+
+def main(names=None):
+    """Run the named benchmarks (all by default)."""
+    ok = True
+    for name in names or BENCHMARKS:
+        if BENCHMARKS[name]() is False:
+            print(f"✗ FAILED: {name}")
+            ok = False
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
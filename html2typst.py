@@ -1,63 +1,378 @@
 """
 Production-quality HTML to Typst translator.
 Designed for HTML generated by Quill.js editor.
+
+Thread safety: translate_html_to_typst and translate_html_to_typst_stream
+can be called from any number of threads at once, including on
+free-threaded Python builds. Each call works on its own parser, context and
+renderer; the only shared state is immutable (handler tables, shared empty
+mappings) or internally synchronized (the style caches, DebugLogSink). A
+Translator object is the exception: use one per thread.
 """
 
+import os
 import re
+import json
+import asyncio
+import argparse
+import atexit
+import hashlib
+import signal
+import sqlite3
+import sys
+import zlib
+import queue
 import logging
+import time
+import functools
+import itertools
+import threading
+import weakref
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from html import unescape
 from html.parser import HTMLParser
-from typing import Optional, List, Dict, Any
+from types import MappingProxyType
+from typing import Optional, List, Dict, Any, Tuple, Iterable, Iterator, AsyncIterator, Mapping, NamedTuple
 from io import StringIO
 
 
+# Shared attribute mapping for elements that carry no (kept) attributes
+_NO_ATTRS = MappingProxyType({})
+
+# Shared style mapping passed to handlers that do not read class/style
+_NO_STYLES = MappingProxyType({})
+
+# RenderContext.log level names
+_LOG_LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+}
+
+# ']' directly followed by a character that would continue a Typst call
+_SYNTAX_AMBIGUITY_RE = re.compile(r'\]([({\[#])')
+
+# Three or more consecutive newlines
+_BLANK_LINES_RE = re.compile(r'\n{3,}')
+
+# Whitespace as HTML defines it (str.strip() would also take e.g. \xa0)
+_HTML_WHITESPACE = ' \t\n\r\f'
+
+# Splits HTML into alternating text and tag pieces (ResultCache.normalize)
+_TAG_SPLIT_RE = re.compile(r'(<[a-zA-Z/][^<>]*>)')
+
+# Tag name at the start of a tag, as html.parser reads it
+_TAG_NAME_RE = re.compile(r'[^\t\n\r\f />\x00]*')
+
+# Elements whose output always ends in a blank line
+_ROOT_BLOCK_TAGS = frozenset({'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'})
+
+# Elements whose text is followed by a blank line when output as plain text
+_PLAIN_BLOCK_TAGS = frozenset({'p', 'div', 'li', 'blockquote', 'pre', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'})
+
+# End tags of those elements, and <br>, in HTML output as plain text
+_PLAIN_BREAK_RE = re.compile(r'</(?:p|div|li|blockquote|pre|h[1-6])[ \t\n\r\f]*>|<br\b[^>]*>', re.IGNORECASE)
+
+# Tags, comments and declarations in HTML output as plain text
+_MARKUP_RE = re.compile(r'<[a-zA-Z/!?][^>]*>?')
+
+
+class Limits(NamedTuple):
+    """
+    Resource budgets of a translation; None leaves a resource unlimited.
+    
+    A budget that runs out never makes a translation fail or come out
+    empty. Input past input_chars is dropped. Parsing stops at the element
+    that exceeds the nodes or depth budget, or once time has run out, and
+    the rest of the input is output as escaped plain text, until time runs
+    out there too. If time runs out while rendering, the rest of the tree
+    is output as plain text. Once the output passes output_chars, the rest
+    of the document is dropped; the elements open at that point are still
+    closed.
+    
+    The nodes and depth budgets are checked at every element, the others
+    every CHECK_INTERVAL elements, so the output can overshoot output_chars
+    by what those elements write.
+    """
+    
+    input_chars: Optional[int] = None   # Characters of input parsed as HTML
+    nodes: Optional[int] = None         # Elements in the tree
+    depth: Optional[int] = None         # Nesting depth of elements
+    output_chars: Optional[int] = None  # Characters of output
+    seconds: Optional[float] = None     # Time to parse and render
+    
+    # Elements between checks of the clock and the output size
+    CHECK_INTERVAL = 256
+
+
+class DegradedOutput(str):
+    """
+    Output of a translation that ran out of a budget (see Limits).
+    
+    Used like any other output string; limit names the budget that ran
+    out: 'input_chars', 'nodes', 'depth', 'output_chars' or 'seconds'.
+    It is the first one, unless time also ran out while converting the
+    rest of the input, which then ends early ('seconds').
+    """
+    
+    def __new__(cls, output: str, limit: str):
+        self = super().__new__(cls, output)
+        self.limit = limit
+        return self
+    
+    def __reduce__(self):
+        return (DegradedOutput, (str(self), self.limit))
+
+
+def _cut_point(html: str, start: int, end: int) -> int:
+    """
+    Return where to cut html[start:end] short of end: before its last tag
+    if it has one after start, else before any character reference end
+    would split.
+    """
+    cut = html.rfind('<', start + 1, end)
+    if cut < 0:
+        cut = html.rfind('&', max(end - 32, start), end)
+        if cut <= start or html.find(';', cut, end) >= 0:
+            cut = end
+    return cut
+
+
+def _plain_text(html: str, start: int = 0, chunk_chars: int = 65536) -> Iterator[str]:
+    """
+    Yield the text of html[start:] as escaped Typst plain text.
+    
+    The input is converted chunk_chars at a time, so that a caller can stop
+    between chunks. Chunks end before a tag or a character reference.
+    """
+    while start < len(html):
+        end = start + chunk_chars
+        if end < len(html):
+            end = _cut_point(html, start, end)
+        text = _MARKUP_RE.sub('', _PLAIN_BREAK_RE.sub('\n\n', html[start:end]))
+        yield escape_typst_text(unescape(text))
+        start = end
+
+
+class _BudgetExceeded(Exception):
+    """Raised out of HTMLParser.feed() to stop parsing at a budget."""
+
+
+class _SinkLogger:
+    """Per-translation handle on a DebugLogSink, used as RenderContext.logger."""
+    
+    __slots__ = ('_put', 'request_id')
+    
+    def __init__(self, put, request_id):
+        self._put = put
+        self.request_id = request_id
+    
+    def log(self, level: int, message: str, *args):
+        # Only the raw values are queued; building and formatting the record
+        # happens on the sink's thread
+        self._put((time.time(), level, self.request_id, message, args))
+
+
+class DebugLogSink:
+    """
+    Debug log destination written by a background thread.
+    
+    Translations only put raw records on a queue; a writer thread formats
+    them and appends them to one open file. A sink can be shared by any
+    number of concurrent translations (pass it as ``debug_sink``), and each
+    record is tagged with the request id of the translation that logged it.
+    
+    Example:
+        sink = DebugLogSink('debug.log')
+        translate_html_to_typst(html, debug=True, debug_sink=sink, request_id='req-42')
+        ...
+        sink.close()
+    """
+    
+    FORMAT = '%(asctime)s - %(levelname)s - [%(request_id)s] %(message)s'
+    
+    def __init__(self, path: str, mode: str = 'a'):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self._ids = itertools.count(1)
+        self._ids_lock = threading.Lock()
+        self._file = open(path, mode, encoding='utf-8')
+        self._formatter = logging.Formatter(self.FORMAT)
+        self._thread = threading.Thread(target=self._run, name='html2typst-debug-log', daemon=True)
+        self._thread.start()
+    
+    def logger(self, request_id: Optional[Any] = None) -> _SinkLogger:
+        """Return a logger whose records carry request_id (numbered if None)."""
+        if request_id is None:
+            with self._ids_lock:
+                request_id = next(self._ids)
+        return _SinkLogger(self._queue.put, request_id)
+    
+    def flush(self):
+        """Block until every record logged so far has been written."""
+        if self._thread is not None:
+            done = threading.Event()
+            self._queue.put(done)
+            done.wait()
+    
+    def close(self):
+        """Write the remaining records, stop the thread and close the file."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._file.close()
+    
+    def __enter__(self) -> 'DebugLogSink':
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def _run(self):
+        """Write queued records until close() (None) is received."""
+        get, get_nowait = self._queue.get, self._queue.get_nowait
+        while True:
+            batch = [get()]
+            # Write everything queued meanwhile in one go
+            try:
+                while True:
+                    batch.append(get_nowait())
+            except queue.Empty:
+                pass
+            
+            lines = []
+            stop = False
+            for item in batch:
+                if item is None:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    self._write(lines)
+                    lines = []
+                    item.set()
+                else:
+                    lines.append(self._format(item))
+            self._write(lines)
+            if stop:
+                return
+    
+    def _format(self, item) -> str:
+        created, level, request_id, message, args = item
+        record = logging.LogRecord('html2typst', level, '', 0, message, args, None)
+        record.created = created
+        record.msecs = (created - int(created)) * 1000
+        record.request_id = request_id
+        try:
+            return self._formatter.format(record)
+        except Exception:
+            # A bad record must not stop the writer thread
+            return f"{message} {args!r}"
+    
+    def _write(self, lines: List[str]):
+        if lines:
+            self._file.write('\n'.join(lines) + '\n')
+        self._file.flush()
+
+
 class RenderContext:
     """Context for tracking state during HTML rendering."""
     
-    def __init__(self, debug: bool = False, debug_log_path: Optional[str] = None):
+    def __init__(
+        self,
+        debug: bool = False,
+        debug_log_path: Optional[str] = None,
+        debug_sink: Optional[DebugLogSink] = None,
+        request_id: Optional[Any] = None
+    ):
         self.debug = debug
         self.debug_log_path = debug_log_path
         self.logger = None
         self.style_stack = []  # Track open styles for safe delimiter management
         self.list_stack = []  # Track nested lists
         self.in_list_item = False
+        self._own_sink = None  # Sink opened for debug_log_path, closed by close()
         
-        if debug and debug_log_path:
-            self._setup_logger()
+        if debug and debug_sink is not None:
+            self.logger = debug_sink.logger(request_id)
+        elif debug and debug_log_path:
+            self._setup_logger(request_id)
     
-    def _setup_logger(self):
-        """Setup file logger for debug mode."""
-        self.logger = logging.getLogger('html2typst')
-        self.logger.setLevel(logging.DEBUG)
-        
-        # Clear any existing handlers
-        self.logger.handlers.clear()
-        
-        # File handler
-        fh = logging.FileHandler(self.debug_log_path, mode='w', encoding='utf-8')
-        fh.setLevel(logging.DEBUG)
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        fh.setFormatter(formatter)
-        self.logger.addHandler(fh)
+    def _setup_logger(self, request_id: Optional[Any] = None):
+        """Setup a log file of this translation's own for debug mode."""
+        self._own_sink = DebugLogSink(self.debug_log_path, mode='w')
+        self.logger = self._own_sink.logger(request_id)
+    
+    def reset(self):
+        """Clear per-document state so the context can render another document."""
+        self.style_stack.clear()
+        self.list_stack.clear()
+        self.in_list_item = False
+    
+    def close(self):
+        """Finish writing a log file opened for debug_log_path."""
+        if self._own_sink is not None:
+            self._own_sink.close()
+            self._own_sink = None
     
-    def log(self, message: str, level: str = 'info'):
-        """Log message if in debug mode."""
+    def log(self, message: str, level: str = 'info', *args):
+        """
+        Log message if in debug mode.
+        
+        message is a %-format string for args, formatted only if the record
+        is actually emitted. Callers on hot paths check ``context.logger``
+        first, so with debug off no logging work is done at all.
+        """
         if self.logger:
-            if level == 'debug':
-                self.logger.debug(message)
-            elif level == 'warning':
-                self.logger.warning(message)
-            elif level == 'error':
-                self.logger.error(message)
-            else:
-                self.logger.info(message)
+            self.logger.log(_LOG_LEVELS.get(level, logging.INFO), message, *args)
 
 
 class QuillStyleParser:
-    """Parser for Quill.js specific styles and classes."""
+    """
+    Parser for Quill.js specific styles and classes.
+    
+    Quill repeats a few dozen class and style strings throughout a document,
+    so parse results are memoized per raw attribute string in a bounded
+    cache shared by every translation in the process. Results are read-only
+    mappings. In debug mode the cache is bypassed so every parse is logged.
+    """
+    
+    # Maximum number of distinct class / style strings memoized (each)
+    CACHE_SIZE = 1024
     
     @staticmethod
-    def parse_quill_classes(class_str: str, context: RenderContext) -> Dict[str, Any]:
+    def parse_quill_classes(class_str: str, context: RenderContext) -> Mapping[str, Any]:
         """Parse Quill CSS classes and extract styling information."""
+        if context.logger:
+            return QuillStyleParser._parse_quill_classes(class_str, context)
+        return _cached_quill_classes(class_str)
+    
+    @staticmethod
+    def parse_inline_styles(style_str: str, context: RenderContext) -> Mapping[str, str]:
+        """Parse inline CSS styles."""
+        if context.logger:
+            return QuillStyleParser._parse_inline_styles(style_str, context)
+        return _cached_inline_styles(style_str)
+    
+    @staticmethod
+    def cache_info() -> Dict[str, Any]:
+        """Return hit/miss statistics of the class and style caches."""
+        return {
+            'classes': _cached_quill_classes.cache_info(),
+            'styles': _cached_inline_styles.cache_info(),
+        }
+    
+    @staticmethod
+    def cache_clear():
+        """Empty the class and style caches."""
+        _cached_quill_classes.cache_clear()
+        _cached_inline_styles.cache_clear()
+    
+    @staticmethod
+    def _parse_quill_classes(class_str: str, context: RenderContext) -> Mapping[str, Any]:
+        """Parse Quill CSS classes without caching."""
         result = {
             'indent': None,
             'align': None,
@@ -66,7 +381,7 @@ class QuillStyleParser:
         }
         
         if not class_str:
-            return result
+            return MappingProxyType(result)
         
         classes = class_str.split()
         
@@ -78,39 +393,45 @@ class QuillStyleParser:
                     try:
                         indent_level = int(indent_str)
                         result['indent'] = indent_level
-                        context.log(f"Parsed indent class: {cls} -> level {indent_level}", 'debug')
+                        if context.logger:
+                            context.log("Parsed indent class: %s -> level %s", 'debug', cls, indent_level)
                     except ValueError:
-                        context.log(f"Invalid indent class: {cls}", 'warning')
+                        if context.logger:
+                            context.log("Invalid indent class: %s", 'warning', cls)
                 else:
-                    context.log(f"Invalid indent class format: {cls}", 'warning')
+                    if context.logger:
+                        context.log("Invalid indent class format: %s", 'warning', cls)
             
             # Handle alignment: ql-align-center, ql-align-right, ql-align-justify
             elif cls.startswith('ql-align-'):
                 align = cls.replace('ql-align-', '')
                 result['align'] = align
-                context.log(f"Parsed align class: {cls} -> {align}", 'debug')
+                if context.logger:
+                    context.log("Parsed align class: %s -> %s", 'debug', cls, align)
             
             # Handle size: ql-size-small, ql-size-large, ql-size-huge
             elif cls.startswith('ql-size-'):
                 size = cls.replace('ql-size-', '')
                 result['size'] = size
-                context.log(f"Parsed size class: {cls} -> {size}", 'debug')
+                if context.logger:
+                    context.log("Parsed size class: %s -> %s", 'debug', cls, size)
             
             # Handle font: ql-font-serif, ql-font-monospace
             elif cls.startswith('ql-font-'):
                 font = cls.replace('ql-font-', '')
                 result['font'] = font
-                context.log(f"Parsed font class: {cls} -> {font}", 'debug')
+                if context.logger:
+                    context.log("Parsed font class: %s -> %s", 'debug', cls, font)
         
-        return result
+        return MappingProxyType(result)
     
     @staticmethod
-    def parse_inline_styles(style_str: str, context: RenderContext) -> Dict[str, str]:
-        """Parse inline CSS styles."""
+    def _parse_inline_styles(style_str: str, context: RenderContext) -> Mapping[str, str]:
+        """Parse inline CSS styles without caching."""
         result = {}
         
         if not style_str:
-            return result
+            return MappingProxyType(result)
         
         # Split by semicolon and parse each style
         styles = [s.strip() for s in style_str.split(';') if s.strip()]
@@ -121,14 +442,33 @@ class QuillStyleParser:
                 key = key.strip().lower()
                 value = value.strip()
                 result[key] = value
-                context.log(f"Parsed inline style: {key} = {value}", 'debug')
+                if context.logger:
+                    context.log("Parsed inline style: %s = %s", 'debug', key, value)
         
-        return result
+        return MappingProxyType(result)
+
+
+# Context without a logger for parses that go through the caches
+_QUIET_CONTEXT = RenderContext()
+
+
+@functools.lru_cache(maxsize=QuillStyleParser.CACHE_SIZE)
+def _cached_quill_classes(class_str: str) -> Mapping[str, Any]:
+    return QuillStyleParser._parse_quill_classes(class_str, _QUIET_CONTEXT)
+
+
+@functools.lru_cache(maxsize=QuillStyleParser.CACHE_SIZE)
+def _cached_inline_styles(style_str: str) -> Mapping[str, str]:
+    return QuillStyleParser._parse_inline_styles(style_str, _QUIET_CONTEXT)
 
 
 class HTMLNode:
     """Represents a parsed HTML node."""
     
+    # Slots keep per-node overhead to a handful of pointers instead of a
+    # full instance __dict__, which dominates memory on large documents.
+    __slots__ = ('tag', 'attrs', 'children', 'parent')
+    
     def __init__(self, tag: str, attrs: Dict[str, str], parent: Optional['HTMLNode'] = None):
         self.tag = tag
         self.attrs = attrs
@@ -142,11 +482,35 @@ class HTMLNode:
 
 
 class TextNode:
-    """Represents a text node."""
+    """
+    Represents a text node.
+    
+    The text is stored as an (offset, length) view into a source string,
+    usually the HTML buffer being parsed, so building the tree does not keep
+    a private copy of every text run. The string is only sliced out when
+    ``text`` is read.
+    """
+    
+    __slots__ = ('source', 'offset', 'length', 'parent')
     
-    def __init__(self, text: str, parent: Optional[HTMLNode] = None):
-        self.text = text
+    def __init__(self, text: str, parent: Optional[HTMLNode] = None,
+                 offset: int = 0, length: Optional[int] = None):
+        self.source = text
+        self.offset = offset
+        self.length = len(text) - offset if length is None else length
         self.parent = parent
+    
+    @property
+    def text(self) -> str:
+        """Text content of the node."""
+        # Slicing the whole source returns the source itself, not a copy
+        return self.source[self.offset:self.offset + self.length]
+    
+    @text.setter
+    def text(self, value: str):
+        self.source = value
+        self.offset = 0
+        self.length = len(value)
 
 
 class SimpleHTMLParser(HTMLParser):
@@ -155,16 +519,131 @@ class SimpleHTMLParser(HTMLParser):
     # Self-closing tags that should not have children
     VOID_TAGS = {'br', 'hr', 'img', 'input', 'meta', 'link', 'area', 'base', 'col', 'embed', 'param', 'source', 'track', 'wbr'}
     
-    def __init__(self):
-        super().__init__()
+    # Attributes read by TypstRenderer; anything else (Quill's data-*,
+    # spellcheck, contenteditable, ...) is dropped while parsing
+    KEPT_ATTRS = frozenset({'class', 'style', 'href', 'src', 'alt'})
+    
+    # Attributes whose values repeat across many elements and are interned
+    INTERNED_ATTRS = frozenset({'class', 'style'})
+    
+    # Budgets set with limit(), kept across reset()
+    max_nodes = sys.maxsize
+    max_depth = sys.maxsize
+    deadline = None
+    
+    def limit(self, nodes: Optional[int] = None, depth: Optional[int] = None, deadline: Optional[float] = None):
+        """
+        Stop parsing at the element past nodes elements or depth levels, or
+        at the first one seen after time.perf_counter() passes deadline.
+        
+        Where parsing stopped, and why, is left in stopped_at (an index into
+        the input) and limit_hit (see Limits).
+        """
+        self.max_nodes = sys.maxsize if nodes is None else nodes
+        self.max_depth = sys.maxsize if depth is None else depth
+        self.deadline = deadline
+    
+    def reset(self):
+        """Reset the parser to build a new tree (called by __init__ too)."""
+        super().reset()
         self.root = HTMLNode('root', {})
         self.current = self.root
         self.stack = [self.root]
+        self._buffer_pos = self.getpos()
+        self._line_starts = []
+        # id(element) -> (start, end) of the source of each closed top-level
+        # element (recorded by QuillHTMLScanner only)
+        self.block_spans = {}
+        # Fragments of the trailing text node that could not be merged as a
+        # view (joined once when the next tag or the end of the feed arrives)
+        self._text_parts = None
+        # Elements added, the count at which budgets are next checked, and
+        # where parsing stopped at a budget (see limit())
+        self.node_count = 0
+        self.next_check = 1
+        self.stopped_at = None
+        self.limit_hit = None
+    
+    def feed(self, data):
+        """Feed HTML to the parser."""
+        # HTMLParser scans self.rawdata (unconsumed input + data) and reports
+        # positions as (line, column). Remember where that buffer starts so
+        # handle_data can turn a position back into an index into it.
+        self._buffer_pos = self.getpos()
+        self._line_starts = []
+        try:
+            super().feed(data)
+        finally:
+            self._flush_text()
+    
+    def _flush_text(self):
+        """Materialize the pending fragments of the trailing text node."""
+        if self._text_parts is not None:
+            self.current.children[-1].text = ''.join(self._text_parts)
+            self._text_parts = None
+    
+    def _buffer_offset(self) -> int:
+        """Return the index in self.rawdata of the current parser position."""
+        line, column = self.getpos()
+        base_line, base_column = self._buffer_pos
+        if line == base_line:
+            return column - base_column
+        
+        # Index of the first character of each line after the first one,
+        # computed lazily and only as far as needed
+        line_starts = self._line_starts
+        rawdata = self.rawdata
+        while len(line_starts) < line - base_line:
+            start = line_starts[-1] if line_starts else 0
+            newline = rawdata.find('\n', start)
+            if newline < 0:
+                return -1
+            line_starts.append(newline + 1)
+        return line_starts[line - base_line - 1] + column
+    
+    def over_budget(self, count: int, depth: int) -> bool:
+        """
+        Check the budgets at the count-th element, depth levels deep.
+        
+        Records the budget exceeded in limit_hit, or else sets next_check.
+        """
+        if count > self.max_nodes:
+            self.limit_hit = 'nodes'
+        elif depth > self.max_depth:
+            self.limit_hit = 'depth'
+        elif self.deadline is not None and time.perf_counter() > self.deadline:
+            self.limit_hit = 'seconds'
+        else:
+            self.next_check = min(count + Limits.CHECK_INTERVAL, self.max_nodes + 1)
+            return False
+        return True
+    
+    def _count_element(self):
+        """Count an element about to be added, stopping the feed if it is over budget."""
+        self.node_count += 1
+        if self.node_count >= self.next_check or len(self.stack) > self.max_depth:
+            if self.over_budget(self.node_count, len(self.stack)):
+                self.stopped_at = self._buffer_offset()
+                raise _BudgetExceeded(self.limit_hit)
+    
+    def _make_attrs(self, attrs) -> Dict[str, str]:
+        """Keep only renderable attributes, sharing repeated values."""
+        kept = None
+        for name, value in attrs:
+            if name in self.KEPT_ATTRS:
+                if value is not None and name in self.INTERNED_ATTRS:
+                    value = sys.intern(value)
+                if kept is None:
+                    kept = {}
+                kept[name] = value
+        return kept if kept is not None else _NO_ATTRS
     
     def handle_starttag(self, tag, attrs):
         """Handle opening tag."""
-        attrs_dict = dict(attrs)
-        node = HTMLNode(tag, attrs_dict, self.current)
+        self._flush_text()
+        self._count_element()
+        tag = sys.intern(tag)
+        node = HTMLNode(tag, self._make_attrs(attrs), self.current)
         self.current.add_child(node)
         
         # Don't descend into void tags
@@ -174,316 +653,1125 @@ class SimpleHTMLParser(HTMLParser):
     
     def handle_endtag(self, tag):
         """Handle closing tag."""
+        self._flush_text()
         if len(self.stack) > 1:
             self.stack.pop()
             self.current = self.stack[-1]
     
     def handle_data(self, data):
         """Handle text data."""
-        if data:
-            text_node = TextNode(data, self.current)
-            self.current.add_child(text_node)
+        if not data:
+            return
+        
+        # Reference the input buffer instead of keeping the chunk when the
+        # data is a verbatim slice of it (i.e. no character references were
+        # decoded)
+        rawdata = self.rawdata
+        offset = self._buffer_offset()
+        if offset >= 0 and rawdata.startswith(data, offset):
+            self._append_text(rawdata, offset, len(data))
+        else:
+            self._append_text(data, 0, len(data))
+    
+    def _append_text(self, source: str, offset: int, length: int):
+        """Append a run of text, merging it into a preceding text node."""
+        # HTMLParser reports one run of text in several calls (around stray
+        # '<', comments, feed boundaries); merge them into a single node
+        children = self.current.children
+        tail = children[-1] if children else None
+        if isinstance(tail, TextNode):
+            if self._text_parts is None:
+                if tail.source is source and tail.offset + tail.length == offset:
+                    tail.length += length
+                    return
+                self._text_parts = [tail.text]
+            self._text_parts.append(source[offset:offset + length])
+            return
+        
+        self.current.add_child(TextNode(source, self.current, offset, length))
     
     def handle_startendtag(self, tag, attrs):
         """Handle self-closing tags like <br />."""
-        attrs_dict = dict(attrs)
-        node = HTMLNode(tag, attrs_dict, self.current)
+        self._flush_text()
+        self._count_element()
+        tag = sys.intern(tag)
+        node = HTMLNode(tag, self._make_attrs(attrs), self.current)
         self.current.add_child(node)
 
 
-class TypstRenderer:
-    """Renders HTML nodes to Typst format."""
+class QuillHTMLScanner:
+    """
+    Fast tokenizer for the HTML dialect Quill.js emits.
     
-    def __init__(self, context: RenderContext):
-        self.context = context
+    Quill output is regular: a fixed set of tags, double-quoted attributes,
+    no comments, declarations or CDATA. This scanner tokenizes that subset
+    with one precompiled regex and drives the same SimpleHTMLParser
+    callbacks, so it builds exactly the tree HTMLParser would. Anything
+    outside the dialect makes scan() return False and the caller falls back
+    to the general-purpose parser.
+    """
     
-    @staticmethod
-    def fix_syntax_ambiguities(text: str) -> str:
+    # Tags Quill produces (plus a few common in pasted content)
+    TAGS = frozenset({
+        'p', 'div', 'br', 'span', 'strong', 'b', 'em', 'i', 'u', 's', 'strike', 'del',
+        'sup', 'sub', 'ul', 'ol', 'li', 'blockquote', 'pre', 'code', 'a', 'img',
+        'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    })
+    
+    # Text up to the next tag, then the tag: (text, '/', name, attributes, '/')
+    _TOKEN_RE = re.compile(
+        r'([^<]*)<(/?)([a-zA-Z][a-zA-Z0-9]*)'
+        r'((?:[ \t\n\r\f]+[a-zA-Z][-a-zA-Z0-9_:.]*(?:[ \t\n\r\f]*=[ \t\n\r\f]*"[^"<>]*")?)*)'
+        r'[ \t\n\r\f]*(/?)>'
+    )
+    _ATTR_RE = re.compile(r'([a-zA-Z][-a-zA-Z0-9_:.]*)(?:[ \t\n\r\f]*=[ \t\n\r\f]*"([^"<>]*)")?')
+    
+    def __init__(self, builder: SimpleHTMLParser):
+        self.builder = builder
+    
+    def scan(self, html: str) -> bool:
         """
-        Fix patterns in Typst output that could be misinterpreted.
+        Tokenize html into the builder's tree.
         
-        Specifically handles:
-        - #command[...](  -> #command[...] (  (prevents interpretation as function call)
-        - #command[...]#  -> #command[...] # (adds space between adjacent commands)
+        Returns False (leaving a partial tree behind) as soon as the input
+        is found to be outside the supported dialect. At a budget set with
+        the builder's limit(), stops and returns True; the rest of the input
+        from builder.stopped_at on is then not part of the tree.
         """
-        # Pattern 1: After ] followed immediately by ( [ or {
-        # This prevents #strong[text]( from being interpreted as a function call
-        # Note: We match literal characters in the character class
-        text = re.sub(r'\]([({\[])', r'] \1', text)
-        
-        # Pattern 2: After ] followed immediately by #
-        # This prevents adjacent commands from running together
-        text = re.sub(r'\]#', r'] #', text)
-        
-        return text
-    
-    def render(self, node) -> str:
-        """Main render method."""
-        if isinstance(node, TextNode):
-            return self.render_text(node)
-        elif isinstance(node, HTMLNode):
-            return self.render_node(node)
-        return ''
-    
-    def render_text(self, node: TextNode) -> str:
-        """Render text node with proper escaping for Typst."""
-        text = node.text
-        
-        # Escape special Typst characters that could cause syntax errors
-        # Escape backslash first to avoid double-escaping
-        text = text.replace('\\', '\\\\')
-        # Escape other special characters that have meaning in Typst
-        text = text.replace('#', '\\#')
-        text = text.replace('$', '\\$')
-        text = text.replace('@', '\\@')
-        # Note: We don't escape [], (), {}, etc. as they're common in normal text
-        # and only problematic in specific contexts which we handle separately
+        builder = self.builder
+        void_tags = builder.VOID_TAGS
+        match_token = self._TOKEN_RE.match
+        # Quill repeats the same few tag spellings and attribute strings, so
+        # each is normalized once per document
+        tag_names = {}
+        attr_maps = {}
+        stack = builder.stack
+        current = builder.current
+        spans = builder.block_spans
+        block_start = 0
+        count = builder.node_count
+        next_check = builder.next_check
+        max_depth = builder.max_depth
+        pos = 0
         
-        return text
-    
-    def render_node(self, node: HTMLNode) -> str:
-        """Render HTML node to Typst."""
-        tag = node.tag.lower()
+        builder._flush_text()
+        while True:
+            match = match_token(html, pos)
+            if match is None:
+                break
+            
+            text_end = match.end(1)
+            if text_end > pos:
+                self._text(current, html, pos, text_end)
+            pos = match.end()
+            
+            closing, raw_tag, attr_str, self_closing = match.group(2, 3, 4, 5)
+            tag = tag_names.get(raw_tag)
+            if tag is None:
+                tag = raw_tag.lower()
+                if tag not in self.TAGS:
+                    builder.current = current
+                    return False
+                tag = tag_names[raw_tag] = sys.intern(tag)
+            
+            if closing:
+                if attr_str or self_closing:
+                    builder.current = current
+                    return False
+                if len(stack) > 1:
+                    if len(stack) == 2:
+                        spans[id(current)] = (block_start, pos)
+                    stack.pop()
+                    current = stack[-1]
+                continue
+            
+            attrs = attr_maps.get(attr_str)
+            if attrs is None:
+                attrs = attr_maps[attr_str] = self._attrs(attr_str)
+            count += 1
+            if count >= next_check or len(stack) > max_depth:
+                if builder.over_budget(count, len(stack)):
+                    # The rest of the input is left to the caller
+                    builder.node_count = count
+                    builder.stopped_at = text_end
+                    builder.current = current
+                    return True
+                next_check = builder.next_check
+            node = HTMLNode(tag, attrs, current)
+            current.children.append(node)
+            if not self_closing and tag not in void_tags:
+                if len(stack) == 1:
+                    block_start = text_end
+                stack.append(node)
+                current = node
         
-        self.context.log(f"Rendering node: <{tag}>", 'debug')
-        
-        # Get attributes
-        class_attr = node.attrs.get('class', '')
-        style_attr = node.attrs.get('style', '')
-        
-        # Parse Quill styles
-        quill_styles = QuillStyleParser.parse_quill_classes(class_attr, self.context)
-        inline_styles = QuillStyleParser.parse_inline_styles(style_attr, self.context)
-        
-        # Route to appropriate handler
-        handler_map = {
-            'root': self.render_root,
-            'p': self.render_paragraph,
-            'div': self.render_div,
-            'br': self.render_br,
-            'strong': self.render_strong,
-            'b': self.render_strong,
-            'em': self.render_em,
-            'i': self.render_em,
-            'u': self.render_underline,
-            'ul': self.render_ul,
-            'ol': self.render_ol,
-            'li': self.render_li,
-            'blockquote': self.render_blockquote,
-            'pre': self.render_pre,
-            'code': self.render_code,
-            'a': self.render_link,
-            'img': self.render_img,
-            'h1': self.render_heading,
-            'h2': self.render_heading,
-            'h3': self.render_heading,
-            'h4': self.render_heading,
-            'h5': self.render_heading,
-            'h6': self.render_heading,
-            'span': self.render_span,
-            's': self.render_strikethrough,
-            'strike': self.render_strikethrough,
-            'del': self.render_strikethrough,
-            'sup': self.render_sup,
-            'sub': self.render_sub,
-        }
+        builder.node_count = count
+        builder.current = current
         
-        handler = handler_map.get(tag, self.render_generic)
-        return handler(node, quill_styles, inline_styles)
+        # Trailing text. HTMLParser holds back text that may end in a split
+        # character reference, and a leftover '<' is not part of the dialect.
+        if pos < len(html):
+            if html.find('<', pos) >= 0 or html.find('&', pos) >= 0:
+                return False
+            self._text(current, html, pos, len(html))
+        return True
     
-    def render_children(self, node: HTMLNode) -> str:
-        """Render all children of a node."""
-        result = []
-        for child in node.children:
-            result.append(self.render(child))
-        return ''.join(result)
+    def _attrs(self, attr_str: str) -> Dict[str, str]:
+        """Parse an attribute string into the builder's attribute mapping."""
+        if not attr_str:
+            return _NO_ATTRS
+        attrs = []
+        for attr in self._ATTR_RE.finditer(attr_str):
+            name, value = attr.group(1, 2)
+            attrs.append((name.lower(), unescape(value) if value else value))
+        attrs = self.builder._make_attrs(attrs)
+        # The mapping is shared by every element with the same attribute
+        # string, so it must not be mutable
+        return MappingProxyType(attrs) if attrs else _NO_ATTRS
     
-    def render_root(self, node: HTMLNode, quill_styles: Dict, inline_styles: Dict) -> str:
-        """Render root node."""
-        return self.render_children(node)
-    
-    def render_paragraph(self, node: HTMLNode, quill_styles: Dict, inline_styles: Dict) -> str:
-        """Render paragraph."""
-        content = self.render_children(node)
-        
-        # Handle alignment from Quill
-        align = quill_styles.get('align') or inline_styles.get('text-align')
+    @staticmethod
+    def _text(parent: HTMLNode, html: str, start: int, end: int):
+        """Append the text html[start:end] to parent, decoding character references."""
+        if html.find('&', start, end) >= 0:
+            node = TextNode(unescape(html[start:end]), parent)
+        else:
+            node = TextNode(html, parent, start, end - start)
         
-        if align == 'center':
-            self.context.log(f"Applying center alignment to paragraph", 'debug')
-            return f"#align(center)[{content}]\n\n"
-        elif align == 'right':
-            self.context.log(f"Applying right alignment to paragraph", 'debug')
-            return f"#align(right)[{content}]\n\n"
-        elif align == 'justify':
-            self.context.log(f"Ignoring justify alignment (not mapping to Typst)", 'debug')
-            # Typst has justify as default for many contexts, or we skip it
-            return f"{content}\n\n"
+        children = parent.children
+        if children and isinstance(children[-1], TextNode):
+            # Only reachable when a stray end tag separated two runs of text
+            children[-1].text += node.text
         else:
-            return f"{content}\n\n"
+            children.append(node)
+
+
+def parse_html(
+    html: str,
+    context: Optional[RenderContext] = None,
+    parser: Optional[SimpleHTMLParser] = None,
+    limits: Optional[Limits] = None,
+    deadline: Optional[float] = None
+) -> Tuple[HTMLNode, str]:
+    """
+    Parse HTML into a node tree.
     
-    def render_div(self, node: HTMLNode, quill_styles: Dict, inline_styles: Dict) -> str:
-        """Render div as paragraph."""
-        return self.render_paragraph(node, quill_styles, inline_styles)
+    Input in the Quill dialect is tokenized by QuillHTMLScanner; anything
+    else transparently falls back to SimpleHTMLParser. Both build the same
+    tree. An existing parser can be passed to be reset and reused.
     
-    def render_br(self, node: HTMLNode, quill_styles: Dict, inline_styles: Dict) -> str:
-        """Render line break."""
-        return "\\\n"
+    Parsing stops early at the nodes and depth budgets of limits, or once
+    time.perf_counter() passes deadline; the parser's stopped_at and
+    limit_hit then tell where and why.
     
-    def render_strong(self, node: HTMLNode, quill_styles: Dict, inline_styles: Dict) -> str:
-        """Render bold text."""
-        content = self.render_children(node)
-        if not content:
-            return ''
-        # Use #strong[] instead of *...* to avoid creating block comment patterns
-        # when adjacent to slashes or asterisks (e.g., *text*/*text* creates */)
-        return f"#strong[{content}]"
+    Returns:
+        Tuple of (root node, engine that produced it: 'quill' or 'html.parser')
+    """
+    if parser is None:
+        parser = SimpleHTMLParser()
+    else:
+        parser.reset()
+    if limits is None:
+        parser.limit(deadline=deadline)
+    else:
+        parser.limit(limits.nodes, limits.depth, deadline)
+    try:
+        if QuillHTMLScanner(parser).scan(html):
+            return parser.root, 'quill'
+    except Exception:
+        pass  # Input html.parser cannot read either (not a str); reported below
     
-    def render_em(self, node: HTMLNode, quill_styles: Dict, inline_styles: Dict) -> str:
-        """Render italic text."""
-        content = self.render_children(node)
-        if not content:
-            return ''
-        # Use #emph[] instead of _..._ to avoid creating block comment patterns
-        # when adjacent to slashes, asterisks, or underscores (similar to #strong[])
-        return f"#emph[{content}]"
+    if context and context.logger:
+        context.log("Input is outside the Quill dialect, using html.parser", 'debug')
+    parser.reset()
+    try:
+        parser.feed(html)
+    except _BudgetExceeded:
+        pass
+    except Exception as e:
+        if context and context.logger:
+            context.log("HTML parsing error: %s", 'error', e)
+        # Even on error, continue with whatever was parsed
+    return parser.root, 'html.parser'
+
+
+class QuillDeltaBuilder:
+    """
+    Builds a node tree from a Quill Delta document.
     
-    def render_underline(self, node: HTMLNode, quill_styles: Dict, inline_styles: Dict) -> str:
-        """Render underlined text."""
-        content = self.render_children(node)
-        if not content:
-            return ''
-        # Typst uses #underline() function
-        return f"#underline[{content}]"
+    The tree is the one SimpleHTMLParser builds from the HTML Quill renders
+    for the same Delta, so TypstRenderer renders both the same way without
+    the Delta being serialized to HTML and parsed back. Each line becomes a
+    block: <p>, <h1>-<h6> for header, <blockquote> for blockquote, or <li>
+    for list, inside an <ol>/<ul> shared with the list items right before
+    it. Quill's ql-indent-* and ql-align-* classes go on the block, and an
+    empty line holds a <br>. Consecutive code-block lines share one
+    <pre class="ql-syntax">, holding their text one line each.
+    Inline formats nest in Quill's order, and consecutive runs that share
+    an outer format share its element, as in Quill's HTML.
     
-    def render_strikethrough(self, node: HTMLNode, quill_styles: Dict, inline_styles: Dict) -> str:
-        """Render strikethrough text."""
-        content = self.render_children(node)
-        if not content:
-            return ''
-        # Typst uses #strike() function
-        return f"#strike[{content}]"
+    Formats without a mapping here (color, font, ...) are dropped, and so
+    are embeds other than images; text is always kept.
+    """
     
-    def render_sup(self, node: HTMLNode, quill_styles: Dict, inline_styles: Dict) -> str:
-        """Render superscript text."""
-        content = self.render_children(node)
-        if not content:
-            return ''
-        # Typst uses #super() function for superscript
-        return f"#super[{content}]"
+    # Inline attribute -> (nesting order, tag), outermost first as Quill
+    # nests them: code, link, script, bold, italic, strike, underline
+    INLINE_TAGS = {
+        'code': (0, 'code'),
+        'link': (1, 'a'),
+        'script': (2, None),
+        'bold': (3, 'strong'),
+        'italic': (4, 'em'),
+        'strike': (5, 's'),
+        'underline': (6, 'u'),
+    }
+    SCRIPT_TAGS = {'sub': 'sub', 'super': 'sup'}
+    LIST_TAGS = {'ordered': 'ol', 'bullet': 'ul', 'checked': 'ul', 'unchecked': 'ul'}
+    ALIGNMENTS = frozenset({'center', 'right', 'justify'})
     
-    def render_sub(self, node: HTMLNode, quill_styles: Dict, inline_styles: Dict) -> str:
-        """Render subscript text."""
-        content = self.render_children(node)
-        if not content:
-            return ''
-        # Typst uses #sub() function for subscript
-        return f"#sub[{content}]"
+    def __init__(self):
+        self.root = HTMLNode('root', {})
+        # Block the current line is built in (its tag is only known at the
+        # newline ending the line), and the inline elements open in it as
+        # ((tag, href), element), outermost first
+        self._block = HTMLNode('p', _NO_ATTRS, self.root)
+        self._open = []
+        # Kind and element of the list the last line was added to
+        self._list_kind = None
+        self._list = None
+        # Text of the code block the last line was added to
+        self._code = None
     
-    def render_ul(self, node: HTMLNode, quill_styles: Dict, inline_styles: Dict) -> str:
-        """Render unordered list."""
-        self.context.list_stack.append('ul')
-        content = self.render_children(node)
-        self.context.list_stack.pop()
-        return f"{content}\n"
+    def build(self, ops: Iterable[Dict[str, Any]]) -> HTMLNode:
+        """Add the lines of ops to the tree and return its root."""
+        for op in ops:
+            # Deltas come from JSON, so plain dicts are all that is checked for
+            insert = op.get('insert') if isinstance(op, dict) else None
+            if insert is None:
+                # retain/delete only appear in change Deltas, not documents
+                continue
+            attributes = op.get('attributes') or _NO_ATTRS
+            if isinstance(insert, str):
+                if '\n' not in insert:
+                    self._add_text(insert, self._inline_formats(attributes))
+                    continue
+                formats = self._inline_formats(attributes) if insert != '\n' else ()
+                for index, text in enumerate(insert.split('\n')):
+                    if index:
+                        self._end_line(attributes)
+                    if text:
+                        self._add_text(text, formats)
+            elif isinstance(insert, dict):
+                src = insert.get('image')
+                if isinstance(src, str):
+                    parent = self._open_formats(self._inline_formats(attributes))
+                    parent.children.append(HTMLNode('img', {'src': src}, parent))
+        # A document ends with a newline; text after the last one is a line too
+        if self._block.children:
+            self._end_line(_NO_ATTRS)
+        return self.root
     
-    def render_ol(self, node: HTMLNode, quill_styles: Dict, inline_styles: Dict) -> str:
-        """Render ordered list."""
-        self.context.list_stack.append('ol')
-        content = self.render_children(node)
-        self.context.list_stack.pop()
-        return f"{content}\n"
+    def _inline_formats(self, attributes: Mapping[str, Any]) -> Tuple[Tuple[str, Optional[str]], ...]:
+        """Return the inline elements attributes call for, as (tag, href), outermost first."""
+        if not attributes:
+            return ()
+        formats = []
+        inline_tags = self.INLINE_TAGS
+        for name, value in attributes.items():
+            entry = inline_tags.get(name)
+            if entry is None or not value:
+                continue
+            order, tag = entry
+            if tag == 'a':
+                if isinstance(value, str):
+                    formats.append((order, tag, value))
+            elif tag is None:
+                tag = self.SCRIPT_TAGS.get(value)
+                if tag is not None:
+                    formats.append((order, tag, None))
+            else:
+                formats.append((order, tag, None))
+        if len(formats) > 1:
+            formats.sort()
+        return tuple([(tag, href) for _, tag, href in formats])
     
-    def render_li(self, node: HTMLNode, quill_styles: Dict, inline_styles: Dict) -> str:
-        """Render list item."""
-        content = self.render_children(node).strip()  # Strip whitespace
-        
-        # Determine list type
-        list_type = self.context.list_stack[-1] if self.context.list_stack else 'ul'
-        
-        # Handle indentation from Quill
-        indent_level = quill_styles.get('indent', 0)
+    def _open_formats(self, formats: Tuple[Tuple[str, Optional[str]], ...]) -> HTMLNode:
+        """Open the inline elements for formats and return the innermost."""
+        opened = self._open
+        depth = 0
+        while depth < len(opened) and depth < len(formats) and opened[depth][0] == formats[depth]:
+            depth += 1
+        del opened[depth:]
+        parent = opened[-1][1] if opened else self._block
+        for tag, href in formats[depth:]:
+            node = HTMLNode(tag, {'href': href} if href is not None else _NO_ATTRS, parent)
+            parent.children.append(node)
+            opened.append(((tag, href), node))
+            parent = node
+        return parent
+    
+    def _add_text(self, text: str, formats: Tuple[Tuple[str, Optional[str]], ...]):
+        """Append text with the given inline formats to the current line."""
+        parent = self._open_formats(formats)
+        children = parent.children
+        if children and isinstance(children[-1], TextNode):
+            # Runs split across ops are one text node in the HTML
+            children[-1].text += text
+        else:
+            children.append(TextNode(text, parent))
+    
+    def _end_line(self, attributes: Mapping[str, Any]):
+        """Finish the current line as a block with the line formats in attributes."""
+        block = self._block
+        if attributes.get('code-block'):
+            self._end_code_line()
+            return
+        self._code = None
+        classes = []
+        indent = attributes.get('indent')
+        if type(indent) is int and indent > 0:
+            classes.append(f'ql-indent-{indent}')
+        align = attributes.get('align')
+        if align in self.ALIGNMENTS:
+            classes.append(f'ql-align-{align}')
+        if classes:
+            block.attrs = {'class': sys.intern(' '.join(classes))}
+        if not block.children:
+            block.children.append(HTMLNode('br', _NO_ATTRS, block))
         
-        if indent_level and indent_level > 0:
-            self.context.log(f"List item with indent level {indent_level}", 'debug')
-            # For now, we'll ignore indent and just render as regular list item
-            # In a more sophisticated implementation, we could nest lists
-            self.context.log(f"Ignoring indent level (not fully supported), rendering as regular list item", 'debug')
+        list_kind = attributes.get('list')
+        header = attributes.get('header')
+        if list_kind in self.LIST_TAGS:
+            block.tag = 'li'
+            if self._list_kind != list_kind:
+                self._list_kind = list_kind
+                self._list = HTMLNode(self.LIST_TAGS[list_kind], _NO_ATTRS, self.root)
+                self.root.children.append(self._list)
+            block.parent = self._list
+            self._list.children.append(block)
+        else:
+            if type(header) is int and 1 <= header <= 6:
+                block.tag = f'h{header}'
+            elif attributes.get('blockquote'):
+                block.tag = 'blockquote'
+            self._list_kind = self._list = None
+            self.root.children.append(block)
         
-        # Handle alignment - for list items, we mostly ignore it but preserve content
-        align = quill_styles.get('align') or inline_styles.get('text-align')
-        if align:
-            self.context.log(f"List item has alignment: {align} (preserving content, ignoring alignment)", 'debug')
+        self._block = HTMLNode('p', _NO_ATTRS, self.root)
+        self._open = []
+    
+    def _end_code_line(self):
+        """Finish the current line as a line of a code block."""
+        # Code blocks hold plain text; any formats on it are dropped
+        texts = []
+        stack = list(reversed(self._block.children))
+        while stack:
+            node = stack.pop()
+            if isinstance(node, TextNode):
+                texts.append(node.text)
+            else:
+                stack.extend(reversed(node.children))
+        texts.append('\n')
         
-        if list_type == 'ol':
-            return f"+ {content}\n"
-        else:
-            return f"- {content}\n"
+        if self._code is None:
+            pre = HTMLNode('pre', {'class': 'ql-syntax'}, self.root)
+            self.root.children.append(pre)
+            self._code = TextNode('', pre)
+            pre.children.append(self._code)
+        self._code.text += ''.join(texts)
+        self._list_kind = self._list = None
+        self._block = HTMLNode('p', _NO_ATTRS, self.root)
+        self._open = []
+
+
+def parse_delta(delta: Any) -> HTMLNode:
+    """
+    Build the node tree of a Quill Delta document (see QuillDeltaBuilder).
     
-    def render_blockquote(self, node: HTMLNode, quill_styles: Dict, inline_styles: Dict) -> str:
-        """Render blockquote."""
-        content = self.render_children(node)
-        # In Typst, quotes can be done with various methods
-        # Using a simple indented style
-        lines = content.strip().split('\n')
-        quoted = '\n'.join(f"> {line}" if line else ">" for line in lines)
-        return f"{quoted}\n\n"
+    delta may be a Delta object ({"ops": [...]}), its list of ops, or
+    either one as a JSON string.
+    """
+    if isinstance(delta, (str, bytes)):
+        delta = json.loads(delta)
+    ops = delta.get('ops', ()) if isinstance(delta, dict) else delta
+    if not isinstance(ops, (list, tuple)):
+        raise TypeError(f'expected a Quill Delta or a list of ops, got {type(delta).__name__}')
+    return QuillDeltaBuilder().build(ops)
+
+
+def needs_typst_escaping(text: str) -> bool:
+    """Return True if text contains characters escape_typst_text changes."""
+    return '\\' in text or '#' in text or '$' in text or '@' in text
+
+
+def escape_typst_text(text: str) -> str:
+    """Escape special Typst characters in text that could cause syntax errors."""
+    # Escape backslash first to avoid double-escaping, then the other
+    # characters that have meaning in Typst. str.replace returns the string
+    # itself when there is nothing to replace, so clean text is not copied;
+    # this measures faster than a single regex or str.translate pass.
+    # Note: We don't escape [], (), {}, etc. as they're common in normal text
+    # and only problematic in specific contexts which we handle separately
+    return text.replace('\\', '\\\\').replace('#', '\\#').replace('$', '\\$').replace('@', '\\@')
+
+
+class TypstWriter:
+    """
+    Append-only buffer that TypstRenderer writes output into.
     
-    def render_pre(self, node: HTMLNode, quill_styles: Dict, inline_styles: Dict) -> str:
-        """Render preformatted text."""
-        # Check if it contains a <code> tag
-        has_code = any(isinstance(child, HTMLNode) and child.tag == 'code' for child in node.children)
-        
-        if has_code:
-            # Let the code tag handle it
-            return self.render_children(node)
-        else:
-            # Render as raw/monospace block
-            content = self.render_children(node)
-            return f"```\n{content}\n```\n\n"
+    Every piece of output is written once and joined once at the end,
+    instead of each element joining its children into a new string. Marks
+    (positions in the buffer) let a handler drop or strip what was written
+    since it opened.
     
-    def render_code(self, node: HTMLNode, quill_styles: Dict, inline_styles: Dict) -> str:
-        """Render code."""
-        content = self.render_children(node)
+    The output clean-up that used to run as whole-document passes after
+    rendering happens here as pieces are written, using only the end of
+    what is already in the buffer:
+    - a space is put between ']' and a following '(', '[', '{' or '#'
+      (see TypstRenderer.fix_syntax_ambiguities)
+    - runs of more than two newlines are cut to two
+    - leading and trailing whitespace of the whole output is dropped
+    so getvalue() is a single join.
+    """
+    
+    __slots__ = ('parts', 'verbatim', '_flushed_tail')
+    
+    def __init__(self, tail: str = ''):
+        self.parts = []
+        # While positive, newline runs are kept as written (content that a
+        # handler will take() back and rewrite line by line)
+        self.verbatim = 0
+        # Last character of output already returned by flush(), or of
+        # whatever precedes this writer's output ('' at the start)
+        self._flushed_tail = tail
+    
+    def write(self, text: str):
+        """Append text to the output."""
+        # Empty pieces are never stored, so "nothing written since a mark"
+        # is simply an unchanged mark
+        if not text:
+            return
+        parts = self.parts
         
-        # Check if parent is <pre> - then it's a code block
-        if node.parent and node.parent.tag == 'pre':
-            return f"```\n{content}\n```\n\n"
+        if parts:
+            tail = parts[-1][-1]
         else:
-            # Inline code
-            return f"`{content}`"
+            tail = self._flushed_tail
+            if not tail:
+                # Start of the output
+                text = text.lstrip()
+                if not text:
+                    return
+        if tail == ']':
+            if text[0] in '([{#':
+                text = ' ' + text
+        elif tail == '\n' and text[0] == '\n' and not self.verbatim:
+            text = self._limit_newlines(text)
+            if not text:
+                return
+        
+        # Same fixes inside the piece itself
+        if len(text) > 1:
+            if ']' in text and _SYNTAX_AMBIGUITY_RE.search(text):
+                text = _SYNTAX_AMBIGUITY_RE.sub(r'] \1', text)
+            if '\n\n\n' in text and not self.verbatim:
+                text = _BLANK_LINES_RE.sub('\n\n', text)
+        parts.append(text)
     
-    def render_link(self, node: HTMLNode, quill_styles: Dict, inline_styles: Dict) -> str:
-        """Render link."""
-        content = self.render_children(node)
-        href = node.attrs.get('href', '')
+    def _limit_newlines(self, text: str) -> str:
+        """Drop leading newlines of text that would extend a run past two."""
+        # Newlines already ending the output (never more than two)
+        trailing = 0
+        for part in reversed(self.parts):
+            stripped = part.rstrip('\n')
+            trailing += len(part) - len(stripped)
+            if stripped or trailing >= 2:
+                break
         
-        if href:
-            # Typst link syntax: #link("url")[text]
-            return f'#link("{href}")[{content}]'
-        else:
-            # No href, just render text
-            self.context.log(f"Link without href, rendering as plain text", 'debug')
-            return content
+        leading = len(text) - len(text.lstrip('\n'))
+        excess = trailing + leading - 2
+        return text[excess:] if excess > 0 else text
     
-    def render_img(self, node: HTMLNode, quill_styles: Dict, inline_styles: Dict) -> str:
-        """Render image."""
+    def mark(self) -> int:
+        """Return the current position in the buffer."""
+        return len(self.parts)
+    
+    def truncate(self, mark: int):
+        """Discard everything written since mark."""
+        del self.parts[mark:]
+    
+    def take(self, mark: int) -> str:
+        """Remove and return everything written since mark."""
+        text = ''.join(self.parts[mark:])
+        del self.parts[mark:]
+        return text
+    
+    def strip(self, mark: int):
+        """Strip leading and trailing whitespace from what was written since mark."""
+        parts = self.parts
+        while len(parts) > mark:
+            last = parts[-1].rstrip()
+            if last:
+                parts[-1] = last
+                break
+            parts.pop()
+        
+        index = mark
+        while index < len(parts):
+            first = parts[index].lstrip()
+            if first:
+                parts[index] = first
+                break
+            index += 1
+        del parts[mark:index]
+    
+    def flush(self) -> str:
+        """
+        Return the output written so far and remove it from the buffer.
+        
+        Trailing whitespace is held back, since it is only output if more
+        text follows. Must not be called while a mark is in use.
+        """
+        text = ''.join(self.parts)
+        body = text.rstrip()
+        self.parts = [text[len(body):]] if len(body) < len(text) else []
+        if body:
+            self._flushed_tail = body[-1]
+        return body
+    
+    def getvalue(self) -> str:
+        """Return the complete output."""
+        self.strip(0)
+        return ''.join(self.parts)
+
+
+class TypstRenderer:
+    """
+    Renders HTML nodes to Typst format.
+    
+    With a SubtreeCache, the top-level elements of a document (paragraphs,
+    headings, lists, ...) are memoized across documents, keyed by a hash
+    of their HTML. Identical HTML parses to an identical subtree, and at
+    the top level the render state it could depend on (enclosing lists,
+    blockquotes, <pre>) is always empty, so the key determines the output.
+    Each block is rendered into a writer of its own and copied into the
+    document; the writer's clean-up between it and its neighbours happens
+    as it is copied in. Debug renders bypass the cache so every node is
+    logged, and so do renders with a time or output budget (see limit()),
+    which are checked against the document's writer.
+    """
+    
+    # Tag -> (open handler, close handler, attributes the handlers read).
+    # Quill classes and inline styles are only parsed for tags that list
+    # 'class' / 'style'; other handlers receive empty mappings.
+    HANDLERS = {
+        'root': (None, None, ()),
+        'p': ('open_paragraph', 'close_paragraph', ('class', 'style')),
+        'div': ('open_paragraph', 'close_paragraph', ('class', 'style')),
+        'br': ('open_br', None, ()),
+        'strong': ('open_strong', 'close_inline', ()),
+        'b': ('open_strong', 'close_inline', ()),
+        'em': ('open_em', 'close_inline', ()),
+        'i': ('open_em', 'close_inline', ()),
+        'u': ('open_underline', 'close_inline', ()),
+        'ul': ('open_ul', 'close_list', ()),
+        'ol': ('open_ol', 'close_list', ()),
+        'li': ('open_li', 'close_li', ('class', 'style')),
+        'blockquote': ('open_blockquote', 'close_blockquote', ()),
+        'pre': ('open_pre', 'close_pre', ()),
+        'code': ('open_code', 'close_code', ()),
+        'a': ('open_link', 'close_link', ()),
+        'img': ('open_img', None, ()),
+        'h1': ('open_heading', 'close_heading', ()),
+        'h2': ('open_heading', 'close_heading', ()),
+        'h3': ('open_heading', 'close_heading', ()),
+        'h4': ('open_heading', 'close_heading', ()),
+        'h5': ('open_heading', 'close_heading', ()),
+        'h6': ('open_heading', 'close_heading', ()),
+        'span': ('open_span', None, ('style',)),
+        's': ('open_strikethrough', 'close_inline', ()),
+        'strike': ('open_strikethrough', 'close_inline', ()),
+        'del': ('open_strikethrough', 'close_inline', ()),
+        'sup': ('open_sup', 'close_inline', ()),
+        'sub': ('open_sub', 'close_inline', ()),
+    }
+    
+    # Handler for tags missing from HANDLERS
+    GENERIC_HANDLER = ('open_generic', None, ())
+    
+    # Top-level elements with less HTML than this render faster than they
+    # are looked up, so they are not memoized
+    MEMO_MIN_CHARS = 32
+    
+    def __init__(self, context: RenderContext, subtree_cache: Optional['SubtreeCache'] = None):
+        self.context = context
+        self.subtree_cache = subtree_cache
+        self._dispatch = type(self)._dispatch_table()
+        # Last text buffer seen by render_text and whether it needs escaping
+        self._text_source = None
+        self._text_source_clean = False
+        # Budgets (see limit()), the one render() ran out of, elements
+        # until they are next checked, output written so far (counted up
+        # to the first _output_counted parts), elements rendered by the
+        # next check and the interval between the last two checks
+        self.max_output = None
+        self.deadline = None
+        self.limit_hit = None
+        self._checks = sys.maxsize
+        self._output_size = 0
+        self._output_counted = 0
+        self._elements = self._interval = 0
+    
+    def limit(self, output_chars: Optional[int] = None, deadline: Optional[float] = None):
+        """
+        Make render() stop rendering once its output passes output_chars,
+        or output the rest of the tree as plain text once
+        time.perf_counter() passes deadline (see Limits).
+        """
+        self.max_output = output_chars
+        self.deadline = deadline
+    
+    @classmethod
+    def _dispatch_table(cls) -> Dict[str, tuple]:
+        """
+        Return the resolved dispatch table for this renderer class.
+        
+        Built on first use and cached on the class (each subclass gets its
+        own), mapping tag -> (open function, close function, needs class
+        parsing, needs style parsing). Entry None is the generic handler.
+        """
+        table = cls.__dict__.get('_DISPATCH')
+        if table is None:
+            def resolve(entry):
+                open_name, close_name, attrs = entry
+                return (
+                    getattr(cls, open_name) if open_name else None,
+                    getattr(cls, close_name) if close_name else None,
+                    'class' in attrs,
+                    'style' in attrs,
+                )
+            table = {tag: resolve(entry) for tag, entry in cls.HANDLERS.items()}
+            table[None] = resolve(cls.GENERIC_HANDLER)
+            # Published only when complete; threads racing here build equal
+            # tables and one of them wins
+            cls._DISPATCH = table
+        return table
+    
+    @staticmethod
+    def fix_syntax_ambiguities(text: str) -> str:
+        """
+        Fix patterns in Typst output that could be misinterpreted.
+        
+        Specifically handles:
+        - #command[...](  -> #command[...] (  (prevents interpretation as function call)
+        - #command[...]#  -> #command[...] # (adds space between adjacent commands)
+        """
+        # After ] followed immediately by ( [ or {, this prevents #strong[text]( from
+        # being interpreted as a function call; followed by # it prevents adjacent
+        # commands from running together
+        return _SYNTAX_AMBIGUITY_RE.sub(r'] \1', text)
+    
+    def render(self, node, source: Optional[str] = None, spans: Optional[Mapping[int, Tuple[int, int]]] = None) -> str:
+        """
+        Main render method.
+        
+        When node is a document root parsed from source, spans (see
+        SimpleHTMLParser.block_spans) locate its top-level elements in
+        source; with a subtree_cache, those are then memoized.
+        """
+        writer = TypstWriter()
+        self.render_document(node, writer, source, spans)
+        return writer.getvalue()
+    
+    def render_document(self, node, writer: 'TypstWriter', source: Optional[str] = None,
+                        spans: Optional[Mapping[int, Tuple[int, int]]] = None):
+        """Render a document into writer, as render() does."""
+        budgeted = self.max_output is not None or self.deadline is not None
+        self.limit_hit = None
+        self._checks = 1 if budgeted else sys.maxsize
+        self._output_size = self._output_counted = 0
+        self._elements = self._interval = 1
+        if spans and self.subtree_cache is not None and not self.context.logger and not budgeted:
+            min_chars = self.MEMO_MIN_CHARS
+            for child in node.children:
+                span = spans.get(id(child))
+                if span is None or span[1] - span[0] < min_chars:
+                    self.render_into(child, writer)
+                else:
+                    writer.write(self._render_block(child, source[span[0]:span[1]]))
+        else:
+            self.render_into(node, writer)
+    
+    def render_into(self, node, writer: 'TypstWriter'):
+        """
+        Render a node into writer.
+        
+        The tree is walked with an explicit stack rather than recursion, so
+        arbitrarily deep nesting renders in linear time without hitting the
+        interpreter's recursion limit. Handlers come in pairs: open_* writes
+        what precedes an element's children and close_* what follows them,
+        so all output goes straight into the one writer.
+        
+        Once a budget has run out, the elements not yet opened are output
+        as plain text (time) or dropped along with text (output size); the
+        ones already open are closed as usual.
+        """
+        if isinstance(node, TextNode):
+            writer.write(self.render_text(node))
+            return
+        elif not isinstance(node, HTMLNode):
+            return
+        
+        checks = self._checks
+        stopped = self.limit_hit
+        keep_text = stopped != 'output_chars'
+        # Frames are [node, close handler, quill_styles, inline_styles, next child index, open state]
+        stack = [self.open_node(node, writer)]
+        while stack:
+            frame = stack[-1]
+            children = frame[0].children
+            index = frame[4]
+            while index < len(children):
+                child = children[index]
+                index += 1
+                if isinstance(child, TextNode):
+                    if keep_text:
+                        writer.write(self.render_text(child))
+                elif stopped is None:
+                    checks -= 1
+                    if not checks:
+                        checks = self._check_budget(writer)
+                        stopped = self.limit_hit
+                        if stopped is not None:
+                            keep_text = stopped != 'output_chars'
+                            index -= 1
+                            continue
+                    frame[4] = index
+                    stack.append(self.open_node(child, writer))
+                    break
+                elif keep_text:
+                    writer.write(self.plain_text(child))
+            else:
+                stack.pop()
+                node, close, quill_styles, inline_styles, _, state = frame
+                if close is not None:
+                    close(self, node, writer, quill_styles, inline_styles, state)
+        self._checks = checks
+    
+    def _check_budget(self, writer: 'TypstWriter') -> int:
+        """Check the time and output budgets, returning the elements until the next check."""
+        parts = writer.parts
+        if len(parts) > self._output_counted:
+            # Parts taken back and rewritten by a handler count twice,
+            # erring on the side of stopping early
+            self._output_size += sum(map(len, parts[self._output_counted:]))
+        self._output_counted = len(parts)
+        interval = Limits.CHECK_INTERVAL
+        if self.max_output is not None:
+            if self._output_size > self.max_output:
+                self.limit_hit = 'output_chars'
+                return interval
+            # Checked sooner as the output nears its budget, going by the
+            # output per element so far; until that is known, intervals
+            # start at one element and at most double
+            interval = min(interval, 2 * self._interval)
+            if self._output_size:
+                left = (self.max_output - self._output_size) * self._elements // self._output_size
+                interval = max(1, min(interval, left // 2))
+            else:
+                interval = 1
+            self._interval = interval
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            self.limit_hit = 'seconds'
+        self._elements += interval
+        return interval
+    
+    def plain_text(self, node) -> str:
+        """Return the text under node as escaped plain text."""
+        texts = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                texts.append('\n\n')
+            elif isinstance(node, TextNode):
+                texts.append(node.text)
+            elif node.tag == 'br':
+                texts.append('\n')
+            else:
+                if node.tag in _PLAIN_BLOCK_TAGS:
+                    stack.append(None)
+                stack.extend(reversed(node.children))
+        return escape_typst_text(''.join(texts))
+    
+    def _render_block(self, node: HTMLNode, source: str) -> str:
+        """Return the output of top-level element node, whose HTML is source."""
+        key = hashlib.blake2b(source.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+        memo = self.subtree_cache
+        output = memo.fetch(key)
+        if output is None:
+            output = self.render_block(node)
+            memo.store([key], output)
+        return output
+    
+    def render_block(self, node) -> str:
+        """
+        Return the output of top-level node on its own.
+        
+        The node is rendered as if preceded by plain text, so that the
+        output depends on the node alone; writing it into the document's
+        writer then applies the clean-up at its boundaries, giving what
+        render_into would have written there.
+        """
+        writer = TypstWriter(tail=' ')
+        self.render_into(node, writer)
+        return ''.join(writer.parts)
+    
+    def render_text(self, node: TextNode) -> str:
+        """Render text node with proper escaping for Typst."""
+        source = node.source
+        if node.length == len(source):
+            # A buffer of its own (decoded text): checking it is no cheaper
+            # than escaping it, and it must not evict the shared buffer
+            return escape_typst_text(source)
+        if source is not self._text_source:
+            # Other text nodes are views into a handful of buffers (usually
+            # the whole input), so one scan per buffer decides for all of them
+            self._text_source = source
+            self._text_source_clean = not needs_typst_escaping(source)
+        if self._text_source_clean:
+            return node.text
+        return escape_typst_text(node.text)
+    
+    def open_node(self, node: HTMLNode, writer: 'TypstWriter') -> list:
+        """Start rendering an HTML node, returning its render frame."""
+        # Route to appropriate (open, close) handler pair
+        dispatch = self._dispatch
+        entry = dispatch.get(node.tag)
+        if entry is None:
+            entry = dispatch.get(node.tag.lower()) or dispatch[None]
+        open_handler, close_handler, needs_class, needs_style = entry
+        
+        if self.context.logger:
+            self.context.log("Rendering node: <%s>", 'debug', node.tag.lower())
+        
+        # Parse Quill classes and inline styles only for handlers that use them
+        if needs_class:
+            quill_styles = QuillStyleParser.parse_quill_classes(node.attrs.get('class', ''), self.context)
+        else:
+            quill_styles = _NO_STYLES
+        if needs_style:
+            inline_styles = QuillStyleParser.parse_inline_styles(node.attrs.get('style', ''), self.context)
+        else:
+            inline_styles = _NO_STYLES
+        
+        state = None
+        if open_handler is not None:
+            state = open_handler(self, node, writer, quill_styles, inline_styles)
+        return [node, close_handler, quill_styles, inline_styles, 0, state]
+    
+    def close_inline(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict, mark: int):
+        """Close an inline #func[...] wrapper, dropping it if it has no content."""
+        if writer.mark() == mark + 1:
+            # Only the opening "#func[" was written
+            writer.truncate(mark)
+        else:
+            writer.write(']')
+    
+    def open_paragraph(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict):
+        """Render paragraph (and div, rendered as a paragraph)."""
+        # Handle alignment from Quill
+        align = quill_styles.get('align') or inline_styles.get('text-align')
+        
+        if align == 'center':
+            if self.context.logger:
+                self.context.log("Applying center alignment to paragraph", 'debug')
+            writer.write("#align(center)[")
+            return True
+        elif align == 'right':
+            if self.context.logger:
+                self.context.log("Applying right alignment to paragraph", 'debug')
+            writer.write("#align(right)[")
+            return True
+        elif align == 'justify':
+            if self.context.logger:
+                self.context.log("Ignoring justify alignment (not mapping to Typst)", 'debug')
+            # Typst has justify as default for many contexts, or we skip it
+        return False
+    
+    def close_paragraph(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict, aligned: bool):
+        """Finish paragraph."""
+        writer.write("]\n\n" if aligned else "\n\n")
+    
+    def open_br(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict):
+        """Render line break."""
+        writer.write("\\\n")
+    
+    def open_strong(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict) -> int:
+        """Render bold text."""
+        mark = writer.mark()
+        # Use #strong[] instead of *...* to avoid creating block comment patterns
+        # when adjacent to slashes or asterisks (e.g., *text*/*text* creates */)
+        writer.write("#strong[")
+        return mark
+    
+    def open_em(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict) -> int:
+        """Render italic text."""
+        mark = writer.mark()
+        # Use #emph[] instead of _..._ to avoid creating block comment patterns
+        # when adjacent to slashes, asterisks, or underscores (similar to #strong[])
+        writer.write("#emph[")
+        return mark
+    
+    def open_underline(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict) -> int:
+        """Render underlined text."""
+        mark = writer.mark()
+        # Typst uses #underline() function
+        writer.write("#underline[")
+        return mark
+    
+    def open_strikethrough(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict) -> int:
+        """Render strikethrough text."""
+        mark = writer.mark()
+        # Typst uses #strike() function
+        writer.write("#strike[")
+        return mark
+    
+    def open_sup(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict) -> int:
+        """Render superscript text."""
+        mark = writer.mark()
+        # Typst uses #super() function for superscript
+        writer.write("#super[")
+        return mark
+    
+    def open_sub(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict) -> int:
+        """Render subscript text."""
+        mark = writer.mark()
+        # Typst uses #sub() function for subscript
+        writer.write("#sub[")
+        return mark
+    
+    def open_ul(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict):
+        """Render unordered list."""
+        self.context.list_stack.append('ul')
+    
+    def open_ol(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict):
+        """Render ordered list."""
+        self.context.list_stack.append('ol')
+    
+    def close_list(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict, state):
+        """Finish ordered or unordered list."""
+        self.context.list_stack.pop()
+        writer.write("\n")
+    
+    def open_li(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict) -> int:
+        """Render list item."""
+        # Determine list type
+        list_type = self.context.list_stack[-1] if self.context.list_stack else 'ul'
+        writer.write("+ " if list_type == 'ol' else "- ")
+        return writer.mark()
+    
+    def close_li(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict, mark: int):
+        """Finish list item."""
+        writer.strip(mark)  # Strip whitespace
+        
+        # Handle indentation from Quill
+        indent_level = quill_styles.get('indent', 0)
+        
+        if indent_level and indent_level > 0:
+            if self.context.logger:
+                self.context.log("List item with indent level %s", 'debug', indent_level)
+            # For now, we'll ignore indent and just render as regular list item
+            # In a more sophisticated implementation, we could nest lists
+            if self.context.logger:
+                self.context.log("Ignoring indent level (not fully supported), rendering as regular list item", 'debug')
+        
+        # Handle alignment - for list items, we mostly ignore it but preserve content
+        align = quill_styles.get('align') or inline_styles.get('text-align')
+        if align:
+            if self.context.logger:
+                self.context.log("List item has alignment: %s (preserving content, ignoring alignment)", 'debug', align)
+        
+        writer.write("\n")
+    
+    def open_blockquote(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict) -> int:
+        """Render blockquote."""
+        writer.verbatim += 1
+        return writer.mark()
+    
+    def close_blockquote(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict, mark: int):
+        """Finish blockquote."""
+        # Quoting rewrites every line of the content, so this is the one
+        # handler that takes its rendered content back out of the writer
+        content = writer.take(mark)
+        writer.verbatim -= 1
+        # In Typst, quotes can be done with various methods
+        # Using a simple indented style
+        lines = content.strip().split('\n')
+        quoted = '\n'.join(f"> {line}" if line else ">" for line in lines)
+        writer.write(quoted)
+        writer.write("\n\n")
+    
+    def open_pre(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict) -> bool:
+        """Render preformatted text."""
+        # Check if it contains a <code> tag
+        has_code = any(isinstance(child, HTMLNode) and child.tag == 'code' for child in node.children)
+        
+        if not has_code:
+            # Render as raw/monospace block
+            writer.write("```\n")
+        # Otherwise let the code tag handle it
+        return has_code
+    
+    def close_pre(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict, has_code: bool):
+        """Finish preformatted text."""
+        if not has_code:
+            writer.write("\n```\n\n")
+    
+    def open_code(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict) -> bool:
+        """Render code."""
+        # Check if parent is <pre> - then it's a code block
+        is_block = bool(node.parent and node.parent.tag == 'pre')
+        writer.write("```\n" if is_block else "`")
+        return is_block
+    
+    def close_code(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict, is_block: bool):
+        """Finish code."""
+        writer.write("\n```\n\n" if is_block else "`")
+    
+    def open_link(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict) -> bool:
+        """Render link."""
+        href = node.attrs.get('href', '')
+        
+        if href:
+            # Typst link syntax: #link("url")[text]
+            writer.write(f'#link("{href}")[')
+            return True
+        else:
+            # No href, just render text
+            if self.context.logger:
+                self.context.log("Link without href, rendering as plain text", 'debug')
+            return False
+    
+    def close_link(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict, has_href: bool):
+        """Finish link."""
+        if has_href:
+            writer.write("]")
+    
+    def open_img(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict):
+        """Render image."""
         alt = node.attrs.get('alt', '')
         src = node.attrs.get('src', '')
         
-        self.context.log(f"Image encountered: src={src}, alt={alt}", 'debug')
+        if self.context.logger:
+            self.context.log("Image encountered: src=%s, alt=%s", 'debug', src, alt)
         
         # For HTML to Typst, we can't easily embed images without file paths
         # Fallback: use alt text or empty
         if alt:
-            return f"[Image: {alt}]"
-        else:
-            return ""
+            writer.write(f"[Image: {alt}]")
     
-    def render_heading(self, node: HTMLNode, quill_styles: Dict, inline_styles: Dict) -> str:
+    def open_heading(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict):
         """Render heading."""
-        content = self.render_children(node)
-        
         # Validate tag format and extract level
         tag = node.tag.lower()
         if len(tag) == 2 and tag[0] == 'h' and tag[1].isdigit():
@@ -491,53 +1779,589 @@ class TypstRenderer:
             level = max(1, min(level, 6))  # Clamp to 1-6
         else:
             # Fallback for unexpected format
-            self.context.log(f"Unexpected heading tag format: {tag}, using h1", 'warning')
+            if self.context.logger:
+                self.context.log("Unexpected heading tag format: %s, using h1", 'warning', tag)
             level = 1
         
         # Typst headings use = for h1, == for h2, etc.
         heading_marker = '=' * level
-        return f"{heading_marker} {content}\n\n"
+        writer.write(f"{heading_marker} ")
     
-    def render_span(self, node: HTMLNode, quill_styles: Dict, inline_styles: Dict) -> str:
+    def close_heading(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict, state):
+        """Finish heading."""
+        writer.write("\n\n")
+    
+    def open_span(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict):
         """Render span - usually for inline styling."""
-        content = self.render_children(node)
-        
         # Check for color styling
         color = inline_styles.get('color', '')
         
         if color:
             # Some colors like "windowtext" are system colors, we ignore them
             if color.lower() in ['windowtext', 'inherit', 'initial']:
-                self.context.log(f"Ignoring system color: {color}", 'debug')
-                return content
+                if self.context.logger:
+                    self.context.log("Ignoring system color: %s", 'debug', color)
+                return
             
             # For actual colors, we could use Typst's #text(fill: color)[content]
             # But for simplicity and safety, we'll ignore color styling
-            self.context.log(f"Ignoring color styling: {color} (not mapped)", 'debug')
+            if self.context.logger:
+                self.context.log("Ignoring color styling: %s (not mapped)", 'debug', color)
         
         # Background color
         bg_color = inline_styles.get('background-color', '')
         if bg_color:
-            self.context.log(f"Ignoring background-color: {bg_color} (not mapped)", 'debug')
+            if self.context.logger:
+                self.context.log("Ignoring background-color: %s (not mapped)", 'debug', bg_color)
         
         # Font size
         font_size = inline_styles.get('font-size', '')
         if font_size:
-            self.context.log(f"Ignoring font-size: {font_size} (not mapped)", 'debug')
+            if self.context.logger:
+                self.context.log("Ignoring font-size: %s (not mapped)", 'debug', font_size)
         
         # For spans, we just render the content
-        return content
     
-    def render_generic(self, node: HTMLNode, quill_styles: Dict, inline_styles: Dict) -> str:
+    def open_generic(self, node: HTMLNode, writer: 'TypstWriter', quill_styles: Dict, inline_styles: Dict):
         """Fallback renderer for unknown tags."""
-        self.context.log(f"Unknown tag <{node.tag}>, degrading to plain text", 'warning')
-        return self.render_children(node)
+        if self.context.logger:
+            self.context.log("Unknown tag <%s>, degrading to plain text", 'warning', node.tag)
+
+
+class _LRUCache:
+    """
+    Thread-safe LRU mapping of keys to output strings, bounded in bytes.
+    
+    Storage shared by ResultCache and SubtreeCache; subclasses decide what
+    the keys are and count hits and misses.
+    """
+    
+    # Rough per-entry overhead (key, dict and list slots) added to the output size
+    ENTRY_OVERHEAD = 200
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (output, size), least recent first
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def _fetch(self, key: bytes) -> Optional[str]:
+        """Return the output stored under key, marking it recently used."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+    
+    def store(self, keys: List[bytes], output: str):
+        """Store output under keys, evicting least recently used entries."""
+        size = sys.getsizeof(output) + self.ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            entries = self._entries
+            for key in keys:
+                old = entries.pop(key, None)
+                if old is not None:
+                    self.bytes -= old[1]
+                entries[key] = (output, size)
+                self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+    
+    def clear(self):
+        """Remove all entries (counters are kept)."""
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+    
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss/eviction counters and current size."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+class ResultCache(_LRUCache):
+    """
+    In-memory LRU cache of translation results, bounded in bytes.
+    
+    Results are keyed by a 128-bit BLAKE2b hash of the input plus the
+    translation options, so the cache holds outputs only, never inputs.
+    Looking up an input seen before costs one hash and one dict lookup.
+    
+    On a miss, the input is also looked up in a normalized form, so that
+    documents differing only in insignificant whitespace share an entry:
+    leading and trailing whitespace, and runs of newlines between top-level
+    paragraphs and headings. Normalization only applies when it provably
+    leaves the output unchanged (see normalize()).
+    
+    Safe to share between threads. Pass it as ``cache`` to
+    translate_html_to_typst or Translator.
+    """
+    
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, normalize: bool = True):
+        super().__init__(max_bytes)
+        self.normalize_input = normalize
+    
+    @staticmethod
+    def key(html: str, options: Tuple = ()) -> bytes:
+        """Return the cache key of html translated with options."""
+        digest = hashlib.blake2b(html.encode('utf-8', 'surrogatepass'), digest_size=16)
+        if options:
+            digest.update(repr(options).encode('utf-8'))
+        return digest.digest()
+    
+    @staticmethod
+    def normalize(html: str) -> str:
+        """
+        Return html with whitespace removed where it cannot affect the output.
+        
+        Applies only to documents whose top level is a sequence of balanced
+        <p>/<h1>-<h6> elements separated by whitespace; those end their
+        output in a blank line, so newlines between them and whitespace
+        around the document are dropped by the writer anyway. Anything else
+        (other top-level content, stray '<', unbalanced tags, script/style)
+        is returned unchanged.
+        """
+        if '\n<' not in html and html[:1] == '<' and html[-1:] == '>':
+            return html
+        # Alternating text and tag pieces: text, tag, text, ..., text
+        pieces = _TAG_SPLIT_RE.split(html)
+        if '<' in pieces[0]:
+            return html
+        name_of = _TAG_NAME_RE.match
+        depth = 0  # Element depth, counted as SimpleHTMLParser builds it
+        for i in range(1, len(pieces), 2):
+            tag = pieces[i]
+            if tag[1] == '/':
+                if not depth:
+                    return html
+                depth -= 1
+            elif tag[-2] == '/':
+                # HTMLParser reads the '/' of an unquoted attribute value
+                # (<span class=a/>) as part of the value, leaving the element
+                # open; only an unambiguous '/>' is taken as self-closing
+                if not depth or not (tag[-3] in _HTML_WHITESPACE or tag[-3] in '"\'' or
+                                     name_of(tag, 1).end() == len(tag) - 2):
+                    return html
+            else:
+                name = name_of(tag, 1).group().lower()
+                if not depth:
+                    text = pieces[i - 1]
+                    if name not in _ROOT_BLOCK_TAGS or text.strip(_HTML_WHITESPACE):
+                        return html
+                    # Leading whitespace, or only newlines after a block
+                    if i == 1 or not text.strip('\n'):
+                        pieces[i - 1] = ''
+                    depth = 1
+                elif name not in SimpleHTMLParser.VOID_TAGS:
+                    if name == 'script' or name == 'style':
+                        return html
+                    depth += 1
+            if '<' in pieces[i + 1]:
+                return html
+        if depth or pieces[-1].strip(_HTML_WHITESPACE):
+            return html
+        pieces[-1] = ''
+        normalized = ''.join(pieces)
+        # Only whitespace is ever removed, so equal length means unchanged
+        return normalized if len(normalized) != len(html) else html
+    
+    def lookup(self, html: str, options: Tuple = ()) -> Tuple[Optional[str], List[bytes]]:
+        """
+        Look html up, returning (output or None, keys to store a result under).
+        
+        On a hit through the normalized form, the exact input's key is
+        added so the next lookup of it is direct.
+        """
+        key = self.key(html, options)
+        keys = [key]
+        output = self._fetch(key)
+        if output is None and self.normalize_input:
+            normalized = self.normalize(html)
+            if normalized is not html:
+                normalized_key = self.key(normalized, options)
+                keys.append(normalized_key)
+                output = self._fetch(normalized_key)
+                if output is not None:
+                    self.store([key], output)
+        
+        with self._lock:
+            if output is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return output, keys
+    
+    def get(self, html: str, options: Tuple = ()) -> Optional[str]:
+        """Return the cached output for html, or None."""
+        return self.lookup(html, options)[0]
+    
+    def put(self, html: str, output: str, options: Tuple = ()):
+        """Cache output as the translation of html."""
+        keys = [self.key(html, options)]
+        if self.normalize_input:
+            normalized = self.normalize(html)
+            if normalized is not html:
+                keys.append(self.key(normalized, options))
+        self.store(keys, output)
+    
+    def flush(self):
+        """Write out pending entries (nothing to do in memory)."""
+
+
+class SubtreeCache(_LRUCache):
+    """
+    In-memory LRU cache of rendered subtrees, bounded in bytes.
+    
+    Documents built from shared templates repeat the same paragraphs,
+    headings and lists verbatim. Given to a TypstRenderer (through
+    Translator or translate_html_to_typst), it lets each repeated block be
+    rendered once and then copied from the cache in every later document.
+    Keys are hashes of each block's HTML (see TypstRenderer).
+    
+    Safe to share between threads.
+    """
+    
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024):
+        super().__init__(max_bytes)
+    
+    def fetch(self, key: bytes) -> Optional[str]:
+        """Return the output stored under key, or None, counting the hit or miss."""
+        output = self._fetch(key)
+        with self._lock:
+            if output is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return output
+    
+    def stats(self) -> Dict[str, Any]:
+        """Return counters, current size and the hit rate (0 to 1)."""
+        stats = super().stats()
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+@functools.lru_cache(maxsize=None)
+def translator_version() -> str:
+    """
+    Return an id of this translator's rendering logic.
+    
+    It is a hash of this module's source, so it changes whenever the code
+    does; DiskCache includes it in every key so that stored outputs from
+    another version are never returned.
+    """
+    try:
+        with open(__file__, 'rb') as f:
+            return hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+    except (OSError, NameError):
+        return 'unknown'
+
+
+# DiskCache objects opened in this process, by their settings (see
+# DiskCache.__reduce__)
+_disk_caches = {}
+_disk_caches_lock = threading.Lock()
+
+# Every live DiskCache, to write out pending entries at exit
+_open_disk_caches = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_disk_caches():
+    for cache in list(_open_disk_caches):
+        cache.flush()
+
+
+def _open_disk_cache(path: str, max_bytes: int, normalize: bool, version: str) -> 'DiskCache':
+    """Return this process's DiskCache for the given settings, opening it once."""
+    settings = (path, max_bytes, normalize, version)
+    with _disk_caches_lock:
+        cache = _disk_caches.get(settings)
+        if cache is None:
+            cache = _disk_caches[settings] = DiskCache(path, max_bytes, normalize, version)
+        return cache
+
+
+class DiskCache(ResultCache):
+    """
+    Persistent translation result cache in an SQLite file.
+    
+    A drop-in alternative to ResultCache whose entries survive restarts and
+    are shared by every process using the same file. Keys are as in
+    ResultCache plus translator_version(), so outputs cached by a different
+    version of the translator are never returned (and age out through
+    eviction). Outputs are stored zlib-compressed, except short ones that
+    compression would not shrink.
+    
+    New entries are written in transactions of up to WRITE_BATCH entries,
+    since committing each one would cost more than many translations; they
+    are visible to this process at once and to others after flush(), which
+    also happens after each translate_many batch, on close(), when the
+    object is garbage collected and at exit.
+    
+    The file is bounded by max_bytes of compressed entries: when a write
+    takes it past that, the least recently used entries are deleted down to
+    LOW_WATER of the limit. The database runs in WAL mode, so any number of
+    processes and threads can read and write it concurrently.
+    
+    Cache errors (a locked or full disk, a damaged entry) never fail a
+    translation: a failed lookup is a miss and a failed store is skipped,
+    and both are counted as errors in stats().
+    
+    Objects are picklable, and unpickle to one shared DiskCache per process,
+    so one can be passed to translate_many's worker processes.
+    """
+    
+    # Rough per-row overhead (key, index entries) added to the compressed size
+    ENTRY_OVERHEAD = 64
+    
+    # Eviction deletes down to this fraction of max_bytes
+    LOW_WATER = 0.9
+    
+    # A hit refreshes an entry's last-used time at most this often (seconds),
+    # so hot entries do not turn every read into a write
+    TOUCH_INTERVAL = 60
+    
+    # Seconds to wait for another process's write to finish
+    TIMEOUT = 30.0
+    
+    COMPRESS_LEVEL = 6
+    
+    # Outputs shorter than this (in bytes) are stored uncompressed
+    COMPRESS_MIN = 256
+    
+    # Entries stored before they are written out in one transaction
+    WRITE_BATCH = 100
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            key BLOB PRIMARY KEY,
+            value BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            used INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS entries_used ON entries (used);
+        CREATE TABLE IF NOT EXISTS totals (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        INSERT OR IGNORE INTO totals VALUES ('bytes', 0);
+        CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+            UPDATE totals SET value = value + NEW.size WHERE name = 'bytes';
+        END;
+        CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF size ON entries BEGIN
+            UPDATE totals SET value = value + NEW.size - OLD.size WHERE name = 'bytes';
+        END;
+        CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+            UPDATE totals SET value = value - OLD.size WHERE name = 'bytes';
+        END;
+    """
+    
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 256 * 1024 * 1024,
+        normalize: bool = True,
+        version: Optional[str] = None
+    ):
+        super().__init__(max_bytes, normalize)
+        self.path = path
+        self.version = version if version is not None else translator_version()
+        self.errors = 0
+        self._pending = {}  # key -> (value, size, used) not yet written
+        self._connection = None
+        self._pid = None
+        self._connect()
+        _open_disk_caches.add(self)
+    
+    def __del__(self):
+        try:
+            self.flush()
+        except Exception:
+            pass
+    
+    def __reduce__(self):
+        return _open_disk_cache, (self.path, self.max_bytes, self.normalize_input, self.version)
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Return this process's connection, opening it if needed."""
+        # A connection must not be used across fork(); reopen in the child
+        if self._pid != os.getpid():
+            connection = sqlite3.connect(
+                self.path, timeout=self.TIMEOUT, isolation_level=None, check_same_thread=False
+            )
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(self.SCHEMA)
+            self._connection = connection
+            self._pid = os.getpid()
+            self._pending.clear()  # The parent process writes those
+        return self._connection
+    
+    def lookup(self, html: str, options: Tuple = ()) -> Tuple[Optional[str], List[bytes]]:
+        return super().lookup(html, (self.version,) + tuple(options))
+    
+    def put(self, html: str, output: str, options: Tuple = ()):
+        super().put(html, output, (self.version,) + tuple(options))
+    
+    def _fetch(self, key: bytes) -> Optional[str]:
+        now = int(time.time())
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is not None and self._pid == os.getpid():
+                return self._decode(pending[0])
+            try:
+                connection = self._connect()
+                row = connection.execute(
+                    'SELECT value, used FROM entries WHERE key = ?', (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                output = self._decode(row[0])
+                if now - row[1] >= self.TOUCH_INTERVAL:
+                    connection.execute('UPDATE entries SET used = ? WHERE key = ?', (now, key))
+                return output
+            except (sqlite3.Error, zlib.error, UnicodeDecodeError):
+                self.errors += 1
+                return None
+    
+    def store(self, keys: List[bytes], output: str):
+        value = self._encode(output)
+        size = len(value) + self.ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        now = int(time.time())
+        with self._lock:
+            self._connect()
+            for key in keys:
+                self._pending[key] = (value, size, now)
+            if len(self._pending) >= self.WRITE_BATCH:
+                self._write_pending()
+    
+    def _encode(self, output: str) -> bytes:
+        """Return the stored form of output: zlib data, or raw after a 0 byte."""
+        data = output.encode('utf-8', 'surrogatepass')
+        if len(data) < self.COMPRESS_MIN:
+            return b'\0' + data  # zlib data never starts with 0
+        return zlib.compress(data, self.COMPRESS_LEVEL)
+    
+    @staticmethod
+    def _decode(value: bytes) -> str:
+        if value[:1] == b'\0':
+            return value[1:].decode('utf-8', 'surrogatepass')
+        return zlib.decompress(value).decode('utf-8', 'surrogatepass')
+    
+    def flush(self):
+        """Write out pending entries, making them visible to other processes."""
+        with self._lock:
+            if self._pending and self._pid == os.getpid():
+                self._write_pending()
+    
+    def _write_pending(self):
+        """Write pending entries in one transaction (called holding the lock)."""
+        rows = [(key, value, size, used) for key, (value, size, used) in self._pending.items()]
+        self._pending.clear()
+        try:
+            connection = self._connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.executemany(
+                    'INSERT INTO entries VALUES (?, ?, ?, ?) ON CONFLICT (key) DO UPDATE '
+                    'SET value = excluded.value, size = excluded.size, used = excluded.used',
+                    rows
+                )
+                self._evict(connection)
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+        except sqlite3.Error:
+            self.errors += 1
+    
+    def _evict(self, connection: sqlite3.Connection):
+        """Delete least recently used entries if the store is over max_bytes."""
+        total = self._total(connection)
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes * self.LOW_WATER
+        while excess > 0:
+            rows = connection.execute('SELECT key, size FROM entries ORDER BY used LIMIT 64').fetchall()
+            if not rows:
+                break
+            evicted = []
+            for key, size in rows:
+                evicted.append((key,))
+                excess -= size
+                if excess <= 0:
+                    break
+            connection.executemany('DELETE FROM entries WHERE key = ?', evicted)
+            self.evictions += len(evicted)
+    
+    @staticmethod
+    def _total(connection: sqlite3.Connection) -> int:
+        return connection.execute("SELECT value FROM totals WHERE name = 'bytes'").fetchone()[0]
+    
+    def clear(self):
+        """Remove all entries (counters are kept)."""
+        with self._lock:
+            self._pending.clear()
+            self._connect().execute('DELETE FROM entries')
+    
+    def close(self):
+        """Write out pending entries and close this process's connection (reopened on next use)."""
+        with self._lock:
+            if self._connection is not None and self._pid == os.getpid():
+                if self._pending:
+                    self._write_pending()
+                self._connection.close()
+            self._connection = None
+            self._pid = None
+    
+    def stats(self) -> Dict[str, int]:
+        """
+        Return counters and size.
+        
+        hits, misses, evictions and errors count this process's operations
+        on this object; entries and bytes describe the shared file, after
+        writing out this object's pending entries.
+        """
+        with self._lock:
+            connection = self._connect()
+            if self._pending:
+                self._write_pending()
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'errors': self.errors,
+                'entries': connection.execute('SELECT count(*) FROM entries').fetchone()[0],
+                'bytes': self._total(connection),
+                'max_bytes': self.max_bytes,
+            }
 
 
 def translate_html_to_typst(
     html: str,
     debug: bool = False,
-    debug_log_path: Optional[str] = None
+    debug_log_path: Optional[str] = None,
+    debug_sink: Optional[DebugLogSink] = None,
+    request_id: Optional[Any] = None,
+    cache: Optional[ResultCache] = None,
+    subtree_cache: Optional[SubtreeCache] = None,
+    limits: Optional[Limits] = None
 ) -> str:
     """
     Translate HTML (generated by Quill.js) to Typst code.
@@ -546,9 +2370,18 @@ def translate_html_to_typst(
         html: HTML string to convert
         debug: Enable debug mode
         debug_log_path: Path to debug log file (required if debug=True)
+        debug_sink: Shared DebugLogSink to log to instead of debug_log_path
+        request_id: Id tagging this translation's log records (numbered by
+            the sink if None)
+        cache: ResultCache to look the result up in and store it to (not
+            used in debug mode)
+        subtree_cache: SubtreeCache memoizing rendered blocks across
+            documents (not used in debug mode)
+        limits: Resource budgets (see Limits)
     
     Returns:
-        Typst formatted string
+        Typst formatted string; a DegradedOutput naming the budget if one
+        ran out
     
     Modes:
         PRODUCTION (debug=False):
@@ -561,7 +2394,8 @@ def translate_html_to_typst(
             - Output Typst MUST STILL BE CLEAN (like production)
             - ALL diagnostic info written ONLY to log file
             - Must not add any debug info to Typst output
-            - debug_log_path specifies the log file
+            - debug_log_path specifies the log file, or debug_sink a log
+              shared with other translations
     
     Principles:
         - text > style
@@ -569,43 +2403,1276 @@ def translate_html_to_typst(
         - No text can be omitted
         - Every HTML node is either mapped or degraded to plain text
     """
-    # Create rendering context
-    context = RenderContext(debug=debug, debug_log_path=debug_log_path)
+    if cache is not None and not debug:
+        # A hit costs a hash and a lookup, before any translator is built
+        output, keys = cache.lookup(html, Translator.options(limits))
+        if output is not None:
+            return output
+        output = Translator(subtree_cache=subtree_cache, limits=limits).translate(html)
+        if not isinstance(output, DegradedOutput):
+            cache.store(keys, output)
+        return output
+    return Translator(
+        debug, debug_log_path, debug_sink, subtree_cache=subtree_cache, limits=limits
+    ).translate(html, request_id)
+
+
+class Translator:
+    """
+    Reusable HTML to Typst translator.
     
-    if debug:
-        context.log("=== HTML to Typst Translation Started ===", 'info')
-        context.log(f"Input HTML length: {len(html)} characters", 'info')
+    Configured once, then translate() can be called any number of times
+    with output identical to translate_html_to_typst. The parser (reset
+    between documents), render context and renderer are created once and
+    reused, which matters when translating many small snippets.
     
-    # Parse HTML
-    parser = SimpleHTMLParser()
+    A Translator keeps per-document state while translating, so it must not
+    be used by several threads at once; give each thread its own. A
+    ResultCache passed as cache or a SubtreeCache passed as subtree_cache,
+    however, can be shared by all of them.
     
-    try:
-        parser.feed(html)
-    except Exception as e:
+    With limits, each translation is held to those budgets (see Limits).
+    Output degraded by a budget is not cached: it may depend on timing.
+    
+    Example:
+        translator = Translator()
+        for html in snippets:
+            typst = translator.translate(html)
+    """
+    
+    # Settings that change the output, part of every cache key (none yet:
+    # all translations of an input are currently identical); see options()
+    OPTIONS = ()
+    
+    def __init__(
+        self,
+        debug: bool = False,
+        debug_log_path: Optional[str] = None,
+        debug_sink: Optional[DebugLogSink] = None,
+        cache: Optional[ResultCache] = None,
+        subtree_cache: Optional[SubtreeCache] = None,
+        limits: Optional[Limits] = None
+    ):
+        self.debug = debug
+        self.debug_log_path = debug_log_path
+        self.debug_sink = debug_sink
+        self.cache = cache
+        self.limits = limits
+        self._parser = SimpleHTMLParser()
+        self._context = RenderContext()
+        self._renderer = TypstRenderer(self._context, subtree_cache)
+    
+    @classmethod
+    def options(cls, limits: Optional[Limits] = None) -> Tuple:
+        """Return the cache key options of translations with limits."""
+        return cls.OPTIONS if limits is None else cls.OPTIONS + (limits,)
+    
+    def translate(self, html: str, request_id: Optional[Any] = None) -> str:
+        """
+        Translate HTML to Typst, as translate_html_to_typst does.
+        
+        Args:
+            html: HTML string to convert
+            request_id: Id tagging this translation's log records (debug only)
+        
+        Returns:
+            Typst formatted string
+        """
+        debug = self.debug
+        limits = self.limits
+        cache = None if debug else self.cache
+        if cache is not None:
+            output, keys = cache.lookup(html, self.options(limits))
+            if output is not None:
+                return output
+        
+        if debug:
+            # Debug logs are per translation (own file or request id)
+            context = RenderContext(
+                debug=True, debug_log_path=self.debug_log_path,
+                debug_sink=self.debug_sink, request_id=request_id
+            )
+        else:
+            context = self._context
+            context.reset()
+        renderer = self._renderer
+        renderer.context = context
+        
+        if debug:
+            context.log("=== HTML to Typst Translation Started ===", 'info')
+            context.log("Input HTML length: %s characters", 'info', len(html))
+        
+        if limits is None:
+            # Parse HTML
+            root, engine = parse_html(html, context, self._parser)
+            
+            if debug:
+                context.log("Parser engine: %s", 'info', engine)
+            
+            # Render to Typst
+            try:
+                typst_output = renderer.render(root, html, self._parser.block_spans)
+            except Exception as e:
+                if debug:
+                    context.log("Rendering error: %s", 'error', e)
+                typst_output = ""
+        else:
+            typst_output = self._translate_limited(html, context)
+        
+        if debug:
+            context.log("Output Typst length: %s characters", 'info', len(typst_output))
+            context.log("=== HTML to Typst Translation Completed ===", 'info')
+            context.close()
+        if cache is not None and not isinstance(typst_output, DegradedOutput):
+            cache.store(keys, typst_output)
+        
+        return typst_output
+    
+    def _translate_limited(self, html: str, context: RenderContext) -> str:
+        """Parse and render html within self.limits (see Limits)."""
+        limits = self.limits
+        renderer = self._renderer
+        parser = self._parser
+        deadline = None if limits.seconds is None else time.perf_counter() + limits.seconds
+        
+        # Input past the budget is cut off at the start of a tag, so that
+        # no tag is split, or within text if the budget holds no tag
+        source = html
+        limit = None
+        if limits.input_chars is not None and len(html) > limits.input_chars:
+            source = html[:_cut_point(html, 0, limits.input_chars)]
+            limit = 'input_chars'
+        
+        root, engine = parse_html(source, context, parser, limits, deadline)
+        if context.logger:
+            context.log("Parser engine: %s", 'info', engine)
+        stopped_at = len(source)
+        if parser.limit_hit is not None:
+            stopped_at = parser.stopped_at
+            limit = parser.limit_hit
+        
+        writer = TypstWriter()
+        renderer.limit(limits.output_chars, deadline)
+        try:
+            renderer.render_document(root, writer, source, parser.block_spans)
+        except Exception as e:
+            if context.logger:
+                context.log("Rendering error: %s", 'error', e)
+            writer = TypstWriter()
+        finally:
+            renderer.limit()
+        limit = limit or renderer.limit_hit
+        
+        # The input not parsed follows as plain text, within what is left
+        # of the output budget and of the time
+        if stopped_at < len(source) and renderer.limit_hit != 'output_chars':
+            left = None
+            if limits.output_chars is not None:
+                left = limits.output_chars - sum(map(len, writer.parts))
+            for text in _plain_text(source, stopped_at):
+                if left is not None:
+                    if len(text) >= left:
+                        writer.write(text[:max(left, 0)])
+                        break
+                    left -= len(text)
+                writer.write(text)
+                if deadline is not None and time.perf_counter() > deadline:
+                    limit = 'seconds'
+                    break
+        typst_output = writer.getvalue()
+        
+        if limit is None:
+            return typst_output
+        if context.logger:
+            context.log("Budget %s ran out, output degraded", 'warning', limit)
+        return DegradedOutput(typst_output, limit)
+    
+    def translate_delta(self, delta: Any, request_id: Optional[Any] = None) -> str:
+        """
+        Translate a Quill Delta document, as translate_delta_to_typst does.
+        
+        Args:
+            delta: Delta object, list of ops, or either as a JSON string
+            request_id: Id tagging this translation's log records (debug only)
+        
+        Returns:
+            Typst formatted string
+        """
+        debug = self.debug
         if debug:
-            context.log(f"HTML parsing error: {str(e)}", 'error')
-        # Even on error, try to continue with whatever was parsed
+            context = RenderContext(
+                debug=True, debug_log_path=self.debug_log_path,
+                debug_sink=self.debug_sink, request_id=request_id
+            )
+            context.log("=== Quill Delta to Typst Translation Started ===", 'info')
+        else:
+            context = self._context
+            context.reset()
+        renderer = self._renderer
+        renderer.context = context
+        
+        try:
+            # Malformed Deltas are the caller's error, reported as such
+            root = parse_delta(delta)
+            try:
+                typst_output = renderer.render(root)
+            except Exception as e:
+                if debug:
+                    context.log("Rendering error: %s", 'error', e)
+                typst_output = ""
+            if debug:
+                context.log("Output Typst length: %s characters", 'info', len(typst_output))
+                context.log("=== Quill Delta to Typst Translation Completed ===", 'info')
+        finally:
+            if debug:
+                context.close()
+        return typst_output
+
+
+def translate_delta_to_typst(
+    delta: Any,
+    debug: bool = False,
+    debug_log_path: Optional[str] = None,
+    debug_sink: Optional[DebugLogSink] = None,
+    request_id: Optional[Any] = None
+) -> str:
+    """
+    Translate a Quill Delta document to Typst.
+    
+    The output is what translate_html_to_typst returns for the HTML Quill
+    renders for the Delta; the node tree is built from the ops directly
+    (see QuillDeltaBuilder), with no HTML in between.
+    
+    Args:
+        delta: Delta object ({"ops": [...]}), its list of ops, or either
+            one as a JSON string
+        debug: Enable debug mode
+        debug_log_path: Path to debug log file (required if debug=True)
+        debug_sink: Shared DebugLogSink to log to instead of debug_log_path
+        request_id: Id tagging this translation's log records (numbered by
+            the sink if None)
     
-    # Render to Typst
-    renderer = TypstRenderer(context)
+    Returns:
+        Typst formatted string
+    
+    Raises:
+        ValueError: delta is a string that is not valid JSON
+        TypeError: delta is not a Delta or a list of ops
+    """
+    return Translator(debug, debug_log_path, debug_sink).translate_delta(delta, request_id)
+
+
+# Start of what HTMLParser reads as a tag, comment or declaration
+_TAG_START_RE = re.compile(r'<[a-zA-Z/!?]')
+
+
+def _holds_tag_start(held: List[str], chunk: str) -> bool:
+    """Return True if the input held back (in pieces), then chunk, starts with a tag."""
+    if not held:
+        return False
+    start = held[0]
+    index = 1
+    while len(start) < 2 and index <= len(held):
+        start += (held[index] if index < len(held) else chunk)[:1]
+        index += 1
+    return _TAG_START_RE.match(start) is not None
+
+
+def translate_html_to_typst_stream(
+    chunks: Iterable[str],
+    debug: bool = False,
+    debug_log_path: Optional[str] = None,
+    debug_sink: Optional[DebugLogSink] = None,
+    request_id: Optional[Any] = None
+) -> Iterator[str]:
+    """
+    Translate HTML fed in chunks, yielding Typst as blocks complete.
+    
+    Each top-level element is rendered as soon as its end tag has been
+    parsed and is then discarded, so memory is bounded by the largest block
+    rather than the whole document. Joining the yielded pieces gives exactly
+    what translate_html_to_typst returns for the concatenated input.
+    
+    Args:
+        chunks: Iterable of HTML strings, e.g. ``iter(lambda: f.read(65536), '')``
+        debug: Enable debug mode
+        debug_log_path: Path to debug log file (required if debug=True)
+        debug_sink: Shared DebugLogSink to log to instead of debug_log_path
+        request_id: Id tagging this translation's log records (numbered by
+            the sink if None)
+    
+    Yields:
+        Pieces of Typst output
+    """
+    context = RenderContext(
+        debug=debug, debug_log_path=debug_log_path, debug_sink=debug_sink, request_id=request_id
+    )
     
     try:
-        typst_output = renderer.render(parser.root)
-    except Exception as e:
         if debug:
-            context.log(f"Rendering error: {str(e)}", 'error')
-        typst_output = ""
+            context.log("=== HTML to Typst Streaming Translation Started ===", 'info')
+        
+        parser = SimpleHTMLParser()
+        renderer = TypstRenderer(context)
+        writer = TypstWriter()
+        root = parser.root
+        input_length = 0
+        output_length = 0
+        
+        def render_blocks(count: int) -> str:
+            """Render and discard the first count top-level nodes."""
+            for node in root.children[:count]:
+                mark = writer.mark()
+                try:
+                    renderer.render_into(node, writer)
+                except Exception as e:
+                    if debug:
+                        context.log("Rendering error: %s", 'error', e)
+                    writer.truncate(mark)
+                    writer.verbatim = 0
+            del root.children[:count]
+            return writer.flush()
+        
+        def feed(data: str) -> bool:
+            try:
+                parser.feed(data)
+            except Exception as e:
+                if debug:
+                    context.log("HTML parsing error: %s", 'error', e)
+                # Continue with whatever was parsed, as the batch API does
+                return False
+            return True
+        
+        # Input is handed to the parser up to the '>' that ends the last tag
+        # seen, or up to its '<' while that tag is incomplete, so every run
+        # of text reaches it whole. HTMLParser drops a trailing run that
+        # ends in a partial character reference when input ends without
+        # close(); feeding runs piecemeal would let part of it through. A
+        # '<' that starts no tag is text, but HTMLParser splits text there
+        # anyway.
+        held = []
+        parsing = True
+        for chunk in chunks:
+            input_length += len(chunk)
+            cut = chunk.rfind('<')
+            if cut < 0:
+                # The '>' may end a tag held back from earlier chunks
+                end = chunk.find('>') if _holds_tag_start(held, chunk) else -1
+                if end < 0:
+                    held.append(chunk)
+                    continue
+                cut = end + 1
+            elif _TAG_START_RE.match(chunk, cut):
+                end = chunk.find('>', cut)
+                if end >= 0:
+                    cut = end + 1
+            held.append(chunk[:cut])
+            data = ''.join(held)
+            held = [chunk[cut:]]
+            if not feed(data):
+                parsing = False
+                break
+            
+            # Everything but the last top-level node is complete. The last one is
+            # complete too if it is an element and no element is still open; a
+            # trailing text node may still grow with the next chunk.
+            complete = len(root.children) - 1
+            if complete >= 0 and len(parser.stack) == 1 and isinstance(root.children[-1], HTMLNode):
+                complete += 1
+            if complete > 0:
+                output = render_blocks(complete)
+                if output:
+                    output_length += len(output)
+                    yield output
+        
+        if parsing:
+            feed(''.join(held))
+        output = render_blocks(len(root.children))
+        if output:
+            output_length += len(output)
+            yield output
+        
+        if debug:
+            context.log("Input HTML length: %s characters", 'info', input_length)
+            context.log("Output Typst length: %s characters", 'info', output_length)
+            context.log("=== HTML to Typst Streaming Translation Completed ===", 'info')
+    finally:
+        context.close()
+
+
+class IncrementalState:
+    """
+    What translate_html_to_typst_incremental keeps of a translated document.
+    
+    Opaque to callers. A state is never modified once returned, so an
+    older one may be passed again (after an undo, say) or shared between
+    threads.
+    
+    The document is kept as segments, each running up to the end tag of a
+    top-level element (the last one also takes whatever follows the last
+    such element). A segment starts with nothing open, and no text node
+    runs across its start, so it parses the same on its own as within the
+    document. Per segment, the state holds the output of its top-level
+    nodes (see TypstRenderer.render_block) and where writing them ended in
+    the writer's parts.
+    """
+    
+    __slots__ = ('html', 'output', 'ends', 'pieces', 'parts', 'marks')
+    
+    def __init__(
+        self,
+        html: str,
+        output: str,
+        ends: Optional[List[int]] = None,
+        pieces: Optional[List[Tuple[str, ...]]] = None,
+        parts: Optional[List[str]] = None,
+        marks: Optional[List[int]] = None
+    ):
+        self.html = html
+        self.output = output
+        # End offset of each segment in html; None if html is outside the
+        # Quill dialect and has to be translated whole every time
+        self.ends = ends
+        # Output of each segment's top-level nodes
+        self.pieces = pieces
+        # Writer parts the output was joined from, and the number of them
+        # written by the end of each segment
+        self.parts = parts
+        self.marks = marks
+
+
+# Block size of the first pass of _common_prefix_length/_common_suffix_length
+_AFFIX_STEP = 4096
+
+
+def _common_prefix_length(a: str, b: str) -> int:
+    """Return the length of the longest common prefix of a and b."""
+    # Compared a block at a time, then bisected within the first block
+    # that differs, so the characters are all compared in C
+    size = min(len(a), len(b))
+    low = 0
+    while low < size:
+        high = min(low + _AFFIX_STEP, size)
+        if a[low:high] != b[low:high]:
+            break
+        low = high
+    else:
+        return size
+    while high - low > 1:
+        middle = (low + high) // 2
+        if a[low:middle] == b[low:middle]:
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+def _common_suffix_length(a: str, b: str, limit: int) -> int:
+    """Return the length of the longest common suffix of a and b, at most limit."""
+    end_a = len(a)
+    end_b = len(b)
+    low = 0
+    while low < limit:
+        high = min(low + _AFFIX_STEP, limit)
+        if a[end_a - high:end_a - low] != b[end_b - high:end_b - low]:
+            break
+        low = high
+    else:
+        return limit
+    while high - low > 1:
+        middle = (low + high) // 2
+        if a[end_a - middle:end_a - low] == b[end_b - middle:end_b - low]:
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+def _tail(parts: List[str], count: int) -> str:
+    """Return the last two characters of the first count parts joined."""
+    # Parts are never empty, so two of them hold at least two characters
+    return ''.join(parts[max(count - 2, 0):count])[-2:]
+
+
+def _retranslate(html: str, state: IncrementalState) -> Optional[IncrementalState]:
+    """
+    Translate html, a new version of the document state was made from.
+    
+    Returns None if html is outside the Quill dialect.
+    """
+    old = state.html
+    ends = state.ends
+    prefix = _common_prefix_length(old, html)
+    suffix = _common_suffix_length(old, html, min(len(old), len(html)) - prefix)
+    delta = len(html) - len(old)
+    
+    # Segments ending before the first change are kept, except the last
+    # one: it may end in text or open elements that what follows continues.
+    # The ones from there to the end of the change are parsed again, with
+    # more following until the new text ends in the end tag of a top-level
+    # element with nothing left open, after which the old segments parse as
+    # they did.
+    first = min(bisect_right(ends, prefix), max(len(ends) - 1, 0))
+    last = max(bisect_left(ends, len(old) - suffix), first)
+    start = ends[first - 1] if first else 0
+    while True:
+        end = ends[last] + delta if last < len(ends) else len(html)
+        parser = SimpleHTMLParser()
+        scanned = QuillHTMLScanner(parser).scan(html[start:end] if start or end < len(html) else html)
+        if end == len(html):
+            if not scanned:
+                return None
+            break
+        if not scanned or len(parser.stack) > 1:
+            # Whatever follows may parse differently now; parse up to the end
+            last = len(ends)
+            continue
+        children = parser.root.children
+        if children and parser.block_spans.get(id(children[-1]), (0, 0))[1] == end - start:
+            break
+        last += 1
+    stop = min(last + 1, len(ends))
     
-    # Fix syntax ambiguities that could cause Typst compilation errors
-    typst_output = TypstRenderer.fix_syntax_ambiguities(typst_output)
+    renderer = TypstRenderer(RenderContext())
+    spans = parser.block_spans
+    new_ends = ends[:first]
+    new_pieces = state.pieces[:first]
+    pending = []
+    for child in parser.root.children:
+        if isinstance(child, TextNode):
+            pending.append(renderer.render_text(child))
+            continue
+        pending.append(renderer.render_block(child))
+        span = spans.get(id(child))
+        if span is not None:
+            new_ends.append(start + span[1])
+            new_pieces.append(tuple(pending))
+            pending = []
+    if pending:
+        new_ends.append(len(html))
+        new_pieces.append(tuple(pending))
     
-    # Clean up output
-    # Remove excessive blank lines
-    typst_output = re.sub(r'\n{3,}', '\n\n', typst_output)
-    typst_output = typst_output.strip()
+    # The output is what writing every piece in order into one writer
+    # gives. Up to the first new segment it is unchanged. After the last
+    # one, the old segments are written until the output before one ends
+    # like it did before that segment; writing depends on no more than
+    # that, so from there on the old parts carry over as they are.
+    old_parts = state.parts
+    old_marks = state.marks
+    writer = TypstWriter()
+    parts = writer.parts = old_parts[:old_marks[first - 1]] if first else []
+    marks = old_marks[:first]
+    for pieces in new_pieces[first:]:
+        for piece in pieces:
+            writer.write(piece)
+        marks.append(len(parts))
+    for index in range(stop, len(ends)):
+        mark = old_marks[index - 1]
+        if _tail(parts, len(parts)) == _tail(old_parts, mark):
+            shift = len(parts) - mark
+            parts.extend(old_parts[mark:])
+            marks.extend([position + shift for position in old_marks[index:]])
+            break
+        for piece in state.pieces[index]:
+            writer.write(piece)
+        marks.append(len(parts))
+    new_ends.extend([position + delta for position in ends[stop:]])
+    new_pieces.extend(state.pieces[stop:])
     
-    if debug:
-        context.log(f"Output Typst length: {len(typst_output)} characters", 'info')
-        context.log("=== HTML to Typst Translation Completed ===", 'info')
+    # As TypstWriter.getvalue(); the start of the output is already stripped
+    output = ''.join(parts).rstrip()
+    return IncrementalState(html, output, new_ends, new_pieces, parts, marks)
+
+
+_EMPTY_STATE = IncrementalState('', '', [], [], [], [])
+
+
+def translate_html_to_typst_incremental(
+    html: str,
+    state: Optional[IncrementalState] = None
+) -> Tuple[str, IncrementalState]:
+    """
+    Translate a new version of a document, reusing the previous translation.
+    
+    Only the top-level elements (paragraphs, headings, lists, ...) the edit
+    touched are parsed and rendered again, and their output is spliced into
+    the previous output, so the time taken depends on the size of the edit
+    rather than of the document. The output is exactly what
+    translate_html_to_typst returns for html.
+    
+    Input outside the Quill dialect is translated whole every time.
+    
+    Args:
+        html: HTML string to convert
+        state: State returned with the translation of an earlier version of
+            the document (None for the first)
+    
+    Returns:
+        Tuple of (Typst formatted string, state to pass with the next version)
+    
+    Example:
+        typst, state = translate_html_to_typst_incremental(html)
+        ...
+        typst, state = translate_html_to_typst_incremental(edited_html, state)
+    """
+    if state is None or state.ends is None:
+        state = _EMPTY_STATE
+    elif html == state.html:
+        return state.output, state
+    try:
+        new_state = _retranslate(html, state)
+    except Exception:
+        # Left to Translator, which handles rendering errors
+        new_state = None
+    if new_state is None:
+        new_state = IncrementalState(html, Translator().translate(html))
+    return new_state.output, new_state
+
+
+class TranslationError(Exception):
+    """
+    A document in a batch that could not be translated.
+    
+    translate_many yields this in place of the document's output instead of
+    raising, so one bad document does not abort the rest of the batch.
+    """
+    
+    def __init__(self, index: int, message: str):
+        super().__init__(f"document {index}: {message}")
+        self.index = index
+        self.message = message
+
+
+# Translator of each translate_many or TranslationServer worker thread
+# (created on first use). Worker processes have one thread each, but
+# executor= may be a thread pool, whose threads must not share one.
+_worker = threading.local()
+
+
+def _translate_batch(
+    documents: List[str],
+    cache: Optional[ResultCache] = None,
+    limits: Optional[Limits] = None
+) -> List[Tuple[bool, str]]:
+    """Translate documents in a worker, returning (ok, output or error) pairs."""
+    translator = getattr(_worker, 'translator', None)
+    if translator is None:
+        translator = _worker.translator = Translator()
+    # Only this thread uses its translator, so each call can set its own
+    translator.cache = cache
+    translator.limits = limits
+    results = []
+    for html in documents:
+        try:
+            results.append((True, translator.translate(html)))
+        except Exception as e:
+            results.append((False, f"{type(e).__name__}: {e}"))
+    if cache is not None:
+        cache.flush()
+    return results
+
+
+def translate_many(
+    documents: Iterable[str],
+    workers: Optional[int] = None,
+    max_in_flight: int = 1024,
+    batch_chars: int = 65536,
+    executor: Optional[Executor] = None,
+    cache: Optional[ResultCache] = None,
+    limits: Optional[Limits] = None
+) -> Iterator[Any]:
+    """
+    Translate many documents in parallel over a process pool.
+    
+    Documents are read lazily, at most max_in_flight at a time, and results
+    are yielded in input order as soon as they are ready. Within each group
+    read, the largest documents are started first so they do not finish
+    last; documents smaller than batch_chars are packed into batches of up
+    to batch_chars characters to cut per-message pickling overhead.
+    
+    A document that fails yields a TranslationError instead of its output;
+    the rest of the batch carries on.
+    
+    Args:
+        documents: Iterable of HTML strings
+        workers: Number of worker processes (default: os.cpu_count()); with 1,
+            documents are translated in this process
+        max_in_flight: Maximum number of documents read but not yet yielded
+        batch_chars: Size under which documents are sent in batches, and the
+            size of a batch
+        executor: Existing executor to submit to instead of creating (and
+            shutting down) a process pool
+        cache: Cache to look results up in and store them to; with worker
+            processes it must be a DiskCache, which they share
+        limits: Budgets each document is translated within (see Limits)
+    
+    Yields:
+        Typst output (str, a DegradedOutput where a budget ran out) or
+        TranslationError, one per document, in order
+    """
+    if max_in_flight < 1:
+        raise ValueError("max_in_flight must be at least 1")
+    if workers is None:
+        workers = os.cpu_count() or 1
+    documents = iter(documents)
+    
+    if executor is None and workers <= 1:
+        translator = Translator(cache=cache, limits=limits)
+        try:
+            for index, html in enumerate(documents):
+                try:
+                    yield translator.translate(html)
+                except Exception as e:
+                    yield TranslationError(index, f"{type(e).__name__}: {e}")
+        finally:
+            if cache is not None:
+                cache.flush()
+        return
+    
+    own_executor = executor is None
+    if cache is not None and not isinstance(cache, DiskCache) and \
+            (own_executor or isinstance(executor, ProcessPoolExecutor)):
+        raise TypeError("worker processes cannot share a ResultCache; use a DiskCache")
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    
+    results = {}  # index -> output or TranslationError, until yielded
+    pending = {}  # future -> indexes of its documents
+    sources = {}  # index -> document, until its result arrives
+    next_read = 0
+    next_yield = 0
+    exhausted = False
+    
+    def submit(indexes: List[int]):
+        try:
+            future = executor.submit(_translate_batch, [sources[i] for i in indexes], cache, limits)
+        except Exception as e:
+            for i in indexes:
+                results[i] = TranslationError(i, f"{type(e).__name__}: {e}")
+                del sources[i]
+        else:
+            pending[future] = indexes
+    
+    def read_more():
+        """Read documents up to max_in_flight and submit them, largest first."""
+        nonlocal next_read, exhausted
+        indexes = []
+        while next_read - next_yield < max_in_flight:
+            try:
+                html = next(documents)
+            except StopIteration:
+                exhausted = True
+                break
+            sources[next_read] = html
+            indexes.append(next_read)
+            next_read += 1
+        
+        indexes.sort(key=lambda i: _document_size(sources[i]), reverse=True)
+        batch = []
+        batch_size = 0
+        for i in indexes:
+            size = _document_size(sources[i])
+            if size >= batch_chars:
+                submit([i])
+                continue
+            if batch and batch_size + size > batch_chars:
+                submit(batch)
+                batch, batch_size = [], 0
+            batch.append(i)
+            batch_size += size
+        if batch:
+            submit(batch)
+    
+    def collect(future):
+        indexes = pending.pop(future)
+        try:
+            outputs = future.result()
+        except Exception as e:
+            if len(indexes) > 1:
+                # Retry one by one so only the offending document fails
+                for i in indexes:
+                    submit([i])
+                return
+            outputs = [(False, f"{type(e).__name__}: {e}")]
+        for i, (ok, output) in zip(indexes, outputs):
+            results[i] = output if ok else TranslationError(i, output)
+            del sources[i]
+    
+    try:
+        read_more()
+        while next_yield < next_read:
+            while next_yield not in results:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future)
+            while next_yield in results:
+                yield results.pop(next_yield)
+                next_yield += 1
+            # Refill once half the window has drained, so new documents
+            # arrive in groups worth sorting and batching
+            if not exhausted and next_read - next_yield <= max_in_flight // 2:
+                read_more()
+    finally:
+        if own_executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+        else:
+            for future in pending:
+                future.cancel()
+
+
+def _document_size(html: Any) -> int:
+    """Size used to order and batch documents (0 for non-strings)."""
+    return len(html) if isinstance(html, str) else 0
+
+
+async def translate_html_to_typst_async(
+    html: str,
+    debug: bool = False,
+    debug_log_path: Optional[str] = None,
+    debug_sink: Optional[DebugLogSink] = None,
+    request_id: Optional[Any] = None,
+    executor: Optional[Executor] = None
+) -> str:
+    """
+    Translate HTML to Typst without blocking the event loop.
+    
+    The translation runs on executor (a thread or process pool; the loop's
+    default executor if None). Every call has its own render context, so
+    concurrent tasks never share per-document state.
+    
+    Cancelling the awaiting task returns control immediately. Work that has
+    not started yet is dropped; a translation already running in a thread
+    finishes in the background and its result is discarded.
+    
+    Args:
+        html: HTML string to convert
+        debug, debug_log_path, debug_sink, request_id: As for
+            translate_html_to_typst (a debug_sink only works with threads)
+        executor: Executor to run the translation on
+    
+    Returns:
+        Typst formatted string
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(
+        translate_html_to_typst, html, debug, debug_log_path, debug_sink, request_id
+    ))
+
+
+async def translate_html_to_typst_stream_async(
+    html: Any,
+    debug: bool = False,
+    debug_log_path: Optional[str] = None,
+    debug_sink: Optional[DebugLogSink] = None,
+    request_id: Optional[Any] = None,
+    executor: Optional[Executor] = None,
+    chunk_size: int = 65536
+) -> AsyncIterator[str]:
+    """
+    Translate a large input, asynchronously yielding Typst blocks as they are produced.
+    
+    The streaming translator (translate_html_to_typst_stream) is advanced
+    on executor one step at a time, so the event loop is only ever blocked
+    for handing over a block. Joining the yielded pieces gives exactly what
+    translate_html_to_typst returns.
+    
+    Stopping iteration early or cancelling the consuming task stops the
+    translation after the step in progress.
+    
+    Args:
+        html: HTML string (read in chunk_size pieces) or an iterable of
+            HTML chunks (read on the executor)
+        debug, debug_log_path, debug_sink, request_id: As for
+            translate_html_to_typst
+        executor: Thread pool to run on (the loop's default executor if None);
+            the translator's state cannot move between processes
+        chunk_size: Size of the pieces a string input is fed in
+    
+    Yields:
+        Pieces of Typst output
+    """
+    if isinstance(executor, ProcessPoolExecutor):
+        raise TypeError("streaming translation needs a thread executor, not a process pool")
+    if isinstance(html, str):
+        text = html
+        html = (text[i:i + chunk_size] for i in range(0, len(text), chunk_size))
+    blocks = translate_html_to_typst_stream(html, debug, debug_log_path, debug_sink, request_id)
+    
+    # Steps run on executor threads; the lock keeps close() from running
+    # while a cancelled step is still executing
+    lock = threading.Lock()
+    done = object()
+    
+    def step():
+        with lock:
+            return next(blocks, done)
+    
+    def close():
+        with lock:
+            blocks.close()
+    
+    loop = asyncio.get_running_loop()
+    finished = False
+    try:
+        while True:
+            block = await loop.run_in_executor(executor, step)
+            if block is done:
+                finished = True
+                break
+            yield block
+    finally:
+        if not finished:
+            try:
+                loop.run_in_executor(executor, close)
+            except RuntimeError:
+                # Loop or executor already shut down (generator finalized late)
+                pass
+
+
+def _warm_worker() -> int:
+    """Create a worker's Translator and fill its caches with a sample document."""
+    _translate_batch(['<p class="ql-align-center"><strong>warm</strong> <span style="color: red">up</span></p>'])
+    return os.getpid()
+
+
+class TranslationServer:
+    """
+    Local HTTP translation service backed by a warm worker pool.
+    
+    Endpoints:
+        POST /translate  HTML request body -> Typst response body
+        GET  /stats      JSON counters
+    
+    Worker processes are started and warmed up before the server accepts
+    connections, and each keeps one Translator (and its caches) for its
+    lifetime. At most queue_size requests are accepted at once (queued or
+    running); further requests get 503 immediately instead of piling up.
+    A request taking longer than timeout seconds gets 504; the worker
+    finishes that translation in the background, and the request keeps its
+    place in queue_size (counted as abandoned in stats()) until it does. With limits, translations
+    are held to those budgets instead (see Limits), so that they finish in
+    time; a degraded response names the budget that ran out in its
+    X-Translation-Limit header.
+    
+    Run it with ``python -m html2typst serve``, or embed it:
+    
+        server = TranslationServer(workers=4)
+        await server.start(path='/run/html2typst.sock')
+        await server.serve_forever()
+    """
+    
+    MAX_BODY = 64 * 1024 * 1024
+    
+    REASONS = {
+        200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+        413: 'Payload Too Large', 422: 'Unprocessable Entity', 501: 'Not Implemented',
+        503: 'Service Unavailable', 504: 'Gateway Timeout',
+    }
+    
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        queue_size: int = 256,
+        timeout: float = 30.0,
+        executor: Optional[Executor] = None,
+        limits: Optional[Limits] = None
+    ):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.limits = limits
+        self._own_executor = executor is None
+        self._executor = executor
+        self._server = None
+        self._path = None
+        self._active = 0
+        self._abandoned = 0
+        self._started = None
+        self.counters = {
+            'requests': 0,
+            'translated': 0,
+            'degraded': 0,
+            'failed': 0,
+            'rejected': 0,
+            'timeouts': 0,
+            'bad_requests': 0,
+        }
+        self._busy_seconds = 0.0
     
-    return typst_output
+    async def start(self, host: str = '127.0.0.1', port: int = 0, path: Optional[str] = None):
+        """Warm up the workers, then listen on a Unix socket (path) or TCP."""
+        loop = asyncio.get_running_loop()
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        # One warm-up task per worker; submitted together, they make the
+        # pool start every process now rather than on first requests
+        await asyncio.gather(*(
+            loop.run_in_executor(self._executor, _warm_worker) for _ in range(self.workers)
+        ))
+        
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._handle, path=path)
+            self._path = path
+        else:
+            self._server = await asyncio.start_server(self._handle, host=host, port=port)
+        self._started = time.monotonic()
+    
+    @property
+    def address(self) -> Any:
+        """Socket path or (host, port) the server listens on."""
+        return self._server.sockets[0].getsockname()
+    
+    async def serve_forever(self):
+        """Serve until cancelled."""
+        await self._server.serve_forever()
+    
+    async def close(self):
+        """Stop listening and shut down the worker pool."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._path is not None:
+            if os.path.exists(self._path):
+                os.unlink(self._path)
+            self._path = None
+        if self._own_executor and self._executor is not None:
+            # Waits for translations already running, off the event loop
+            shutdown = functools.partial(self._executor.shutdown, wait=True, cancel_futures=True)
+            await asyncio.get_running_loop().run_in_executor(None, shutdown)
+            self._executor = None
+    
+    def stats(self) -> Dict[str, Any]:
+        """Return request counters and current load."""
+        translated = self.counters['translated']
+        stats = dict(self.counters)
+        stats.update({
+            'workers': self.workers,
+            'queue_size': self.queue_size,
+            'active': self._active,
+            'abandoned': self._abandoned,
+            'mean_seconds': self._busy_seconds / translated if translated else 0.0,
+            'uptime_seconds': time.monotonic() - self._started if self._started else 0.0,
+        })
+        return stats
+    
+    async def translate(self, html: str) -> Tuple[int, str]:
+        """Translate one request body, returning (HTTP status, response text)."""
+        if self._active >= self.queue_size:
+            self.counters['rejected'] += 1
+            return 503, "queue full, retry later\n"
+        
+        loop = asyncio.get_running_loop()
+        self._active += 1
+        start = time.perf_counter()
+        try:
+            job = self._executor.submit(_translate_batch, [html], None, self.limits)
+        except Exception as e:
+            self._active -= 1
+            self.counters['failed'] += 1
+            return 422, f"{type(e).__name__}: {e}\n"
+        abandoned = False
+        
+        def release():
+            self._active -= 1
+            if abandoned:
+                self._abandoned -= 1
+        
+        def finished(_):
+            # A timed out translation holds its place until the worker is
+            # actually done with it (called in the worker's thread)
+            try:
+                loop.call_soon_threadsafe(release)
+            except RuntimeError:
+                pass  # Loop already closed
+        
+        job.add_done_callback(finished)
+        try:
+            [(ok, output)] = await asyncio.wait_for(asyncio.wrap_future(job), self.timeout)
+        except asyncio.TimeoutError:
+            self.counters['timeouts'] += 1
+            if not job.done():
+                abandoned = True
+                self._abandoned += 1
+            return 504, f"translation exceeded {self.timeout}s\n"
+        except Exception as e:
+            self.counters['failed'] += 1
+            return 422, f"{type(e).__name__}: {e}\n"
+        
+        if not ok:
+            self.counters['failed'] += 1
+            return 422, output + "\n"
+        self.counters['translated'] += 1
+        if isinstance(output, DegradedOutput):
+            self.counters['degraded'] += 1
+        self._busy_seconds += time.perf_counter() - start
+        return 200, output
+    
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve the HTTP/1.1 requests of one connection."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                parts = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                status, body, content_type = await self._respond(parts, headers, reader)
+                if status in (400, 413, 501):
+                    keep_alive = False  # Request body may not have been consumed
+                
+                payload = body.encode('utf-8')
+                # Budget that degraded a translation (see Limits)
+                limit = getattr(body, 'limit', None)
+                extra = f"X-Translation-Limit: {limit}\r\n" if limit else ""
+                writer.write(
+                    f"HTTP/1.1 {status} {self.REASONS[status]}\r\n"
+                    f"Content-Type: {content_type}; charset=utf-8\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    f"{extra}"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                    "\r\n".encode('latin-1') + payload
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    
+    async def _read_chunked(self, reader: asyncio.StreamReader) -> Optional[bytes]:
+        """
+        Read a chunked request body.
+        
+        Returns None, leaving the rest unread, once it is over MAX_BODY;
+        raises ValueError if it is malformed.
+        """
+        chunks = []
+        size = 0
+        while True:
+            line = await reader.readline()
+            try:
+                length = int(line.split(b';', 1)[0], 16)
+            except ValueError:
+                raise ValueError("bad chunk size") from None
+            if length < 0:
+                raise ValueError("bad chunk size")
+            if length == 0:
+                break
+            size += length
+            if size > self.MAX_BODY:
+                return None
+            chunks.append(await reader.readexactly(length))
+            if await reader.readline() not in (b'\r\n', b'\n'):
+                raise ValueError("missing chunk end")
+        # Trailer fields, up to the blank line that ends the request
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                return b''.join(chunks)
+    
+    async def _respond(self, parts: List[str], headers: Dict[str, str], reader: asyncio.StreamReader) -> Tuple[int, str, str]:
+        """Dispatch one parsed request, returning (status, body, content type)."""
+        self.counters['requests'] += 1
+        if len(parts) != 3:
+            self.counters['bad_requests'] += 1
+            return 400, "malformed request line\n", 'text/plain'
+        method, target, _ = parts
+        path = target.split('?', 1)[0]
+        
+        encoding = headers.get('transfer-encoding', '').lower()
+        if encoding == 'chunked':
+            try:
+                body = await self._read_chunked(reader)
+            except ValueError as e:
+                self.counters['bad_requests'] += 1
+                return 400, f"invalid chunked body: {e}\n", 'text/plain'
+            if body is None:
+                self.counters['bad_requests'] += 1
+                return 413, "request body too large\n", 'text/plain'
+        elif encoding:
+            self.counters['bad_requests'] += 1
+            return 501, "unsupported Transfer-Encoding\n", 'text/plain'
+        else:
+            try:
+                length = int(headers.get('content-length', '0'))
+            except ValueError:
+                self.counters['bad_requests'] += 1
+                return 400, "invalid Content-Length\n", 'text/plain'
+            if length > self.MAX_BODY:
+                self.counters['bad_requests'] += 1
+                return 413, "request body too large\n", 'text/plain'
+            body = await reader.readexactly(length) if length else b''
+        
+        if path == '/stats':
+            if method != 'GET':
+                return 405, "use GET\n", 'text/plain'
+            return 200, json.dumps(self.stats()) + "\n", 'application/json'
+        if path == '/translate':
+            if method != 'POST':
+                return 405, "use POST\n", 'text/plain'
+            try:
+                html = body.decode('utf-8')
+            except UnicodeDecodeError:
+                self.counters['bad_requests'] += 1
+                return 400, "body must be UTF-8\n", 'text/plain'
+            status, text = await self.translate(html)
+            return status, text, 'text/plain'
+        return 404, "unknown path\n", 'text/plain'
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point (``python -m html2typst``)."""
+    parser = argparse.ArgumentParser(prog='python -m html2typst', description='HTML to Typst translator')
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    serve = commands.add_parser('serve', help='run a local translation server')
+    serve.add_argument('--socket', help='listen on this Unix socket path')
+    serve.add_argument('--host', default='127.0.0.1', help='TCP host (default: 127.0.0.1)')
+    serve.add_argument('--port', type=int, default=8765, help='TCP port (default: 8765)')
+    serve.add_argument('--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    serve.add_argument('--queue-size', type=int, default=256, help='requests accepted at once before 503')
+    serve.add_argument('--timeout', type=float, default=30.0, help='per-request time limit in seconds')
+    serve.add_argument('--max-input', type=int, help='input characters translated as HTML')
+    serve.add_argument('--max-nodes', type=int, help='elements parsed per request')
+    serve.add_argument('--max-depth', type=int, help='element nesting depth parsed')
+    serve.add_argument('--max-output', type=int, help='output characters per request')
+    serve.add_argument('--max-seconds', type=float, help='translation time budget per request')
+    
+    args = parser.parse_args(argv)
+    limits = Limits(args.max_input, args.max_nodes, args.max_depth, args.max_output, args.max_seconds)
+    if limits == Limits():
+        limits = None
+    
+    async def run():
+        server = TranslationServer(
+            workers=args.workers, queue_size=args.queue_size, timeout=args.timeout, limits=limits
+        )
+        await server.start(host=args.host, port=args.port, path=args.socket)
+        print(f"html2typst serving on {server.address} with {server.workers} workers", file=sys.stderr)
+        # Stop cleanly (closing the socket and pool) on SIGTERM as on Ctrl-C
+        main_task = asyncio.current_task()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, main_task.cancel)
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+    
+    try:
+        asyncio.run(run())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Quill fixtures shared by the tests and benchmarks.
+"""
+
+from html import escape
+
+
+def delta_to_html(ops):
+    """Render Delta ops to HTML as Quill does, for the formats the Delta path maps."""
+    inline_tags = [('code', 'code'), ('link', 'a'), ('script', None), ('bold', 'strong'),
+                   ('italic', 'em'), ('strike', 's'), ('underline', 'u')]
+    
+    def wrappers(attributes):
+        """Return the (start tag, end tag) pairs of attributes, outermost first."""
+        result = []
+        for name, tag in inline_tags:
+            value = attributes.get(name)
+            if name == 'link' and isinstance(value, str) and value:
+                result.append((f'<a href="{escape(value)}">', '</a>'))
+            elif name == 'script':
+                tag = {'sub': 'sub', 'super': 'sup'}.get(value)
+                if tag:
+                    result.append((f'<{tag}>', f'</{tag}>'))
+            elif name != 'link' and value:
+                result.append((f'<{tag}>', f'</{tag}>'))
+        return result
+    
+    lines, runs = [], []
+    for op in ops:
+        insert, attributes = op['insert'], op.get('attributes', {})
+        if isinstance(insert, dict):
+            if 'image' in insert:
+                runs.append((f'<img src="{escape(insert["image"])}">', wrappers(attributes)))
+            continue
+        for index, text in enumerate(insert.split('\n')):
+            if index:
+                lines.append((runs, attributes))
+                runs = []
+            if text:
+                runs.append((escape(text, quote=False), wrappers(attributes)))
+    if runs:
+        lines.append((runs, {}))
+    
+    html, open_list, code = [], None, None
+    for runs, attributes in lines:
+        if attributes.get('code-block'):
+            # Lines share one <pre>, as plain text
+            if open_list:
+                html.append(open_list[1])
+                open_list = None
+            if code is None:
+                code = []
+                html.append(code)
+            code.append(''.join(content for content, _ in runs if not content.startswith('<img')) + '\n')
+            continue
+        code = None
+        
+        # Runs sharing outer formats share their elements
+        inner, stack = [], []
+        for content, formats in runs:
+            depth = 0
+            while depth < min(len(stack), len(formats)) and stack[depth] == formats[depth]:
+                depth += 1
+            inner.extend(end for _, end in reversed(stack[depth:]))
+            inner.extend(start for start, _ in formats[depth:])
+            stack = formats
+            inner.append(content)
+        inner.extend(end for _, end in reversed(stack))
+        inner = ''.join(inner) or '<br>'
+        
+        classes = []
+        indent = attributes.get('indent')
+        if type(indent) is int and indent > 0:
+            classes.append(f'ql-indent-{indent}')
+        if attributes.get('align') in ('center', 'right', 'justify'):
+            classes.append(f'ql-align-{attributes["align"]}')
+        class_attr = f' class="{" ".join(classes)}"' if classes else ''
+        
+        kind = attributes.get('list')
+        if kind not in ('ordered', 'bullet', 'checked', 'unchecked'):
+            kind = None
+        if open_list and kind != open_list[0]:
+            html.append(open_list[1])
+            open_list = None
+        if kind:
+            if not open_list:
+                tag = 'ol' if kind == 'ordered' else 'ul'
+                checked = f' data-checked="{str(kind == "checked").lower()}"' if kind in ('checked', 'unchecked') else ''
+                html.append(f'<{tag}{checked}>')
+                open_list = (kind, f'</{tag}>')
+            html.append(f'<li{class_attr}>{inner}</li>')
+        else:
+            header = attributes.get('header')
+            tag = f'h{header}' if type(header) is int and 1 <= header <= 6 else 'p'
+            if tag == 'p' and attributes.get('blockquote'):
+                tag = 'blockquote'
+            html.append(f'<{tag}{class_attr}>{inner}</{tag}>')
+    if open_list:
+        html.append(open_list[1])
+    return ''.join(
+        f'<pre class="ql-syntax" spellcheck="false">{"".join(piece)}</pre>' if isinstance(piece, list) else piece
+        for piece in html
+    )
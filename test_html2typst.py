@@ -2,10 +2,29 @@
 Test suite for HTML to Typst translator.
 """
 
+import asyncio
+import json
 import os
+import pickle
+import random
+import sqlite3
+import sys
 import tempfile
+import threading
+import time
 import unittest
-from html2typst import translate_html_to_typst
+import html2typst
+from html2typst import (
+    translate_html_to_typst, translate_html_to_typst_stream, parse_html, SimpleHTMLParser, QuillHTMLScanner, HTMLNode, TextNode,
+    TypstWriter, TypstRenderer, RenderContext, QuillStyleParser, escape_typst_text, needs_typst_escaping,
+    DebugLogSink, Translator, TranslationError, translate_many,
+    translate_html_to_typst_async, translate_html_to_typst_stream_async, TranslationServer,
+    ResultCache, DiskCache, translator_version, SubtreeCache, translate_html_to_typst_incremental,
+    translate_delta_to_typst, parse_delta, Limits, DegradedOutput,
+)
+from quill_fixtures import delta_to_html
+from unittest import mock
+from concurrent.futures import Future, Executor, ProcessPoolExecutor, ThreadPoolExecutor
 
 
 class TestBasicElements(unittest.TestCase):
@@ -193,6 +212,21 @@ class TestEdgeCases(unittest.TestCase):
         self.assertIn("List item 1", result)
         self.assertIn("List item 2", result)
 
+    
+    def test_deep_nesting(self):
+        """Test that deeply nested markup renders instead of overflowing the stack."""
+        depth = 5000
+        html = '<div>' * depth + '<span>' * depth + 'Deep text' + '</span>' * depth + '</div>' * depth
+        result = translate_html_to_typst(html)
+        self.assertEqual(result, "Deep text")
+    
+    def test_deep_nested_formatting(self):
+        """Test that deeply nested formatting keeps every wrapper."""
+        depth = 2000
+        html = '<p>' + '<strong>' * depth + 'x' + '</strong>' * depth + '</p>'
+        result = translate_html_to_typst(html)
+        self.assertEqual(result, '#strong[' * depth + 'x' + ']' * depth)
+
 
 class TestCodeElements(unittest.TestCase):
     """Test code and pre elements."""
@@ -314,6 +348,30 @@ class TestDebugMode(unittest.TestCase):
         
         # Should be clean output
         self.assertIn("Test", result)
+    
+    def test_production_mode_does_no_logging_work(self):
+        """Test that with debug off no log call is made, even on hot paths."""
+        html = '<p class="ql-align-center ql-indent-1"><span style="color: red">a</span><x-tag>b</x-tag></p><img src="i.png">'
+        QuillStyleParser.cache_clear()
+        with mock.patch.object(RenderContext, 'log') as log:
+            translate_html_to_typst(html)
+            list(translate_html_to_typst_stream([html]))
+        log.assert_not_called()
+    
+    def test_log_arguments_formatted_lazily(self):
+        """Test that log arguments are formatted into the record only when emitted."""
+        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.log') as f:
+            log_path = f.name
+        
+        try:
+            translate_html_to_typst('<p style="color: red">Test</p>', debug=True, debug_log_path=log_path)
+            with open(log_path, 'r') as f:
+                log_content = f.read()
+            self.assertIn("Parsed inline style: color = red", log_content)
+            self.assertIn("Rendering node: <p>", log_content)
+        finally:
+            if os.path.exists(log_path):
+                os.unlink(log_path)
 
 
 class TestTextPreservation(unittest.TestCase):
@@ -460,5 +518,1506 @@ class TestRealWorldQuill(unittest.TestCase):
         self.assertIn("Right aligned", result)
 
 
+class TestNodeStorage(unittest.TestCase):
+    """Test the compact parsed-tree representation."""
+    
+    def test_nodes_have_no_instance_dict(self):
+        """Test that tree nodes use slots instead of a per-instance __dict__."""
+        parser = SimpleHTMLParser()
+        parser.feed('<p class="ql-align-center">Text<br></p>')
+        paragraph = parser.root.children[0]
+        self.assertIsInstance(paragraph, HTMLNode)
+        self.assertIsInstance(paragraph.children[0], TextNode)
+        self.assertFalse(hasattr(paragraph, '__dict__'))
+        self.assertFalse(hasattr(paragraph.children[0], '__dict__'))
+    
+    def test_tree_structure_preserved(self):
+        """Test that parent and child links are still available to the renderer."""
+        parser = SimpleHTMLParser()
+        parser.feed('<pre><code>x</code></pre>')
+        code = parser.root.children[0].children[0]
+        self.assertEqual(code.tag, 'code')
+        self.assertIs(code.parent, parser.root.children[0])
+    
+    def test_text_references_source_buffer(self):
+        """Test that text nodes are views into the parsed HTML, not copies."""
+        html = '<p>First\nline</p><p><strong>Second</strong></p>'
+        parser = SimpleHTMLParser()
+        parser.feed(html)
+        first = parser.root.children[0].children[0]
+        second = parser.root.children[1].children[0].children[0]
+        self.assertIs(first.source, html)
+        self.assertEqual(first.text, 'First\nline')
+        self.assertIs(second.source, html)
+        self.assertEqual(second.text, 'Second')
+    
+    def test_decoded_text_keeps_own_string(self):
+        """Test that text with character references holds the decoded string."""
+        parser = SimpleHTMLParser()
+        parser.feed('<p>a &amp; b</p>')
+        node = parser.root.children[0].children[0]
+        self.assertEqual(node.text, 'a & b')
+    
+    def test_unrendered_attributes_dropped(self):
+        """Test that only attributes the renderer reads are kept."""
+        parser = SimpleHTMLParser()
+        parser.feed('<p class="ql-align-center" data-list="bullet" spellcheck="false">x</p>'
+                    '<a href="https://example.com" contenteditable="true">y</a>')
+        paragraph, link = parser.root.children
+        self.assertEqual(dict(paragraph.attrs), {'class': 'ql-align-center'})
+        self.assertEqual(dict(link.attrs), {'href': 'https://example.com'})
+    
+    def test_repeated_attribute_values_shared(self):
+        """Test that identical class values and tag names share one string."""
+        parser = SimpleHTMLParser()
+        parser.feed('<span class="ql-size-large">a</span><span class="ql-size-large">b</span><em>c</em>')
+        first, second, em = parser.root.children
+        self.assertIs(first.attrs['class'], second.attrs['class'])
+        self.assertIs(first.tag, second.tag)
+        self.assertEqual(len(em.attrs), 0)
+    
+    def test_adjacent_text_fragments_merged(self):
+        """Test that one run of text becomes a single text node."""
+        parser = SimpleHTMLParser()
+        parser.feed('<p>a < b <!-- note --> &sect;1 &nbsp;c</p>')
+        children = parser.root.children[0].children
+        self.assertEqual(len(children), 1)
+        self.assertEqual(children[0].text, 'a < b  \xa71 \xa0c')
+    
+    def test_text_merged_across_feed_chunks(self):
+        """Test that text split across feed() calls is merged."""
+        html = '<p>Some longer paragraph text</p>'
+        parser = SimpleHTMLParser()
+        for i in range(0, len(html), 4):
+            parser.feed(html[i:i + 4])
+        children = parser.root.children[0].children
+        self.assertEqual(len(children), 1)
+        self.assertEqual(children[0].text, 'Some longer paragraph text')
+
+
+def dump_tree(node):
+    """Return a comparable representation of a parsed tree."""
+    if isinstance(node, TextNode):
+        return node.text
+    return (node.tag, dict(node.attrs), [dump_tree(child) for child in node.children])
+
+
+class TestParserEngines(unittest.TestCase):
+    """Test the fast Quill scanner and its html.parser fallback."""
+    
+    QUILL_HTML = (
+        '<h1>Title</h1><p class="ql-align-center">A &amp; B<br></p>'
+        '<ol><li data-list="bullet" class="ql-indent-1">One <strong>two</strong></li></ol>'
+        '<p><a href="https://example.com/?a=1&amp;b=2" rel="noopener" target="_blank">link</a>'
+        '<img src="x.png" alt="Alt"/></p><P CLASS="ql-align-right">tail</P>'
+    )
+    
+    def test_quill_dialect_uses_fast_path(self):
+        """Test that Quill output is handled by the dedicated scanner."""
+        root, engine = parse_html(self.QUILL_HTML)
+        self.assertEqual(engine, 'quill')
+        
+        parser = SimpleHTMLParser()
+        parser.feed(self.QUILL_HTML)
+        self.assertEqual(dump_tree(root), dump_tree(parser.root))
+    
+    def test_fallback_outside_dialect(self):
+        """Test that non-Quill input falls back to html.parser."""
+        for html in ['<!-- note --><p>x</p>', '<p>a < b</p>', '<table><tr><td>x</td></tr></table>',
+                     '<p class=unquoted>x</p>', '<script>if (a<b) {}</script>', '<p>tail &amp']:
+            root, engine = parse_html(html)
+            self.assertEqual(engine, 'html.parser', html)
+            parser = SimpleHTMLParser()
+            parser.feed(html)
+            self.assertEqual(dump_tree(root), dump_tree(parser.root))
+    
+    def test_non_string_input(self):
+        """Test that input neither parser can read gives empty output, as before the scanner."""
+        for html in [None, b'<p>a</p>', 5]:
+            self.assertEqual(parse_html(html)[1], 'html.parser')
+            self.assertEqual(translate_html_to_typst(html), '')
+    
+    def test_scanner_reports_unsupported_input(self):
+        """Test that the scanner itself rejects input outside the dialect."""
+        self.assertTrue(QuillHTMLScanner(SimpleHTMLParser()).scan('<p>ok</p>'))
+        self.assertFalse(QuillHTMLScanner(SimpleHTMLParser()).scan('<p>ok</p><!-- no -->'))
+    
+    def test_engine_reported_in_debug_log(self):
+        """Test that the engine that ran is written to the debug log."""
+        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.log') as f:
+            log_path = f.name
+        try:
+            translate_html_to_typst('<p>Test</p>', debug=True, debug_log_path=log_path)
+            with open(log_path, 'r') as f:
+                self.assertIn('Parser engine: quill', f.read())
+        finally:
+            os.unlink(log_path)
+
+
+class TestTypstWriter(unittest.TestCase):
+    """Test the shared output buffer used by the renderer."""
+    
+    def test_write_and_getvalue(self):
+        """Test that pieces are joined in order and empty pieces ignored."""
+        writer = TypstWriter()
+        writer.write('#strong[')
+        writer.write('')
+        writer.write('text')
+        writer.write(']')
+        self.assertEqual(writer.mark(), 3)
+        self.assertEqual(writer.getvalue(), '#strong[text]')
+    
+    def test_truncate_and_take(self):
+        """Test discarding and extracting output written since a mark."""
+        writer = TypstWriter()
+        writer.write('keep')
+        mark = writer.mark()
+        writer.write('drop')
+        writer.truncate(mark)
+        self.assertEqual(writer.getvalue(), 'keep')
+        writer.write('a')
+        writer.write('b')
+        self.assertEqual(writer.take(mark), 'ab')
+        self.assertEqual(writer.getvalue(), 'keep')
+    
+    def test_strip_since_mark(self):
+        """Test stripping whitespace spread over several pieces."""
+        writer = TypstWriter()
+        writer.write('- ')
+        mark = writer.mark()
+        for piece in ['\n ', '  item', ' text ', '\n', '  ']:
+            writer.write(piece)
+        writer.strip(mark)
+        self.assertEqual(writer.getvalue(), '- item text')
+        
+        writer.write(' \n ')
+        writer.strip(writer.mark() - 1)
+        self.assertEqual(writer.getvalue(), '- item text')
+
+    
+    def test_fixes_applied_as_written(self):
+        """Test that output clean-up happens at write time, not in a later pass."""
+        writer = TypstWriter()
+        for piece in ['\n  ', '#strong[a]', '(b)', '#emph[c]', '#x', '\n\n', '\n\n\nd]#e', ' \n\n']:
+            writer.write(piece)
+        self.assertEqual(writer.parts, ['#strong[a]', ' (b)', '#emph[c]', ' #x', '\n\n', 'd] #e', ' \n\n'])
+        self.assertEqual(writer.getvalue(), '#strong[a] (b)#emph[c] #x\n\nd] #e')
+    
+    def test_verbatim_keeps_newline_runs(self):
+        """Test that newline runs are left alone while verbatim is set."""
+        writer = TypstWriter()
+        writer.write('a\n\n')
+        writer.verbatim += 1
+        writer.write('\n\nb\n\n\n')
+        writer.verbatim -= 1
+        self.assertEqual(writer.getvalue(), 'a\n\n\n\nb')
+    
+    def test_flush_holds_back_trailing_whitespace(self):
+        """Test that flushed pieces join to the same output as getvalue."""
+        writer = TypstWriter()
+        writer.write('  a]')
+        writer.write('\n\n')
+        self.assertEqual(writer.flush(), 'a]')
+        writer.write('\n(b)')
+        self.assertEqual(writer.flush(), '\n\n(b)')
+        writer.write(']')
+        self.assertEqual(writer.flush(), ']')
+        writer.write('#c \n')
+        self.assertEqual(writer.flush(), ' #c')
+        self.assertEqual(writer.getvalue(), '')
+
+class TestRendererDispatch(unittest.TestCase):
+    """Test the renderer's dispatch table and lazy style parsing."""
+    
+    def test_dispatch_table_built_once_per_class(self):
+        """Test that renderers of one class share a single dispatch table."""
+        first = TypstRenderer(RenderContext())
+        second = TypstRenderer(RenderContext())
+        self.assertIs(first._dispatch, second._dispatch)
+        
+        class CustomRenderer(TypstRenderer):
+            HANDLERS = dict(TypstRenderer.HANDLERS, mark=('open_strong', 'close_inline', ()))
+        
+        custom = CustomRenderer(RenderContext())
+        self.assertIsNot(custom._dispatch, first._dispatch)
+        root, _ = parse_html('<p><mark>hi</mark></p>')
+        self.assertEqual(custom.render(root), '#strong[hi]')
+        self.assertEqual(first.render(root), 'hi')
+    
+    def test_styles_parsed_only_when_used(self):
+        """Test that inline formatting tags skip class and style parsing."""
+        html = '<strong class="ql-size-large" style="color: red">a</strong><em style="color: red">b</em><br>'
+        with mock.patch.object(QuillStyleParser, 'parse_quill_classes', wraps=QuillStyleParser.parse_quill_classes) as classes, \
+                mock.patch.object(QuillStyleParser, 'parse_inline_styles', wraps=QuillStyleParser.parse_inline_styles) as styles:
+            result = translate_html_to_typst(html)
+        self.assertEqual(result, '#strong[a] #emph[b]\\')
+        classes.assert_not_called()
+        styles.assert_not_called()
+    
+    def test_styles_parsed_for_paragraphs(self):
+        """Test that handlers declaring class/style still receive them."""
+        html = '<p style="text-align: right;">x</p>'
+        with mock.patch.object(QuillStyleParser, 'parse_inline_styles', wraps=QuillStyleParser.parse_inline_styles) as styles:
+            result = translate_html_to_typst(html)
+        self.assertEqual(result, '#align(right)[x]')
+        styles.assert_called_once()
+
+
+class TestStyleCache(unittest.TestCase):
+    """Test memoized parsing of Quill classes and inline styles."""
+    
+    def setUp(self):
+        QuillStyleParser.cache_clear()
+    
+    def test_repeated_values_hit_cache(self):
+        """Test that repeated class/style strings are parsed once."""
+        html = ''.join('<p class="ql-align-center" style="color: red;">x</p>' for _ in range(10))
+        translate_html_to_typst(html)
+        info = QuillStyleParser.cache_info()
+        self.assertEqual(info['classes'].misses, 1)
+        self.assertEqual(info['classes'].hits, 9)
+        self.assertEqual(info['styles'].misses, 1)
+        self.assertEqual(info['styles'].hits, 9)
+    
+    def test_cache_shared_across_calls(self):
+        """Test that the cache persists between translations."""
+        translate_html_to_typst('<p class="ql-align-right">a</p>')
+        translate_html_to_typst('<p class="ql-align-right">b</p>')
+        self.assertEqual(QuillStyleParser.cache_info()['classes'].hits, 1)
+    
+    def test_results_are_immutable(self):
+        """Test that cached parse results cannot be modified by callers."""
+        result = QuillStyleParser.parse_quill_classes('ql-indent-2', RenderContext())
+        self.assertEqual(result['indent'], 2)
+        with self.assertRaises(TypeError):
+            result['indent'] = 5
+        self.assertEqual(QuillStyleParser.parse_quill_classes('ql-indent-2', RenderContext())['indent'], 2)
+
+
+class TestTextEscaping(unittest.TestCase):
+    """Test escaping of Typst special characters in text."""
+    
+    def test_escape_special_characters(self):
+        """Test that every special character is escaped exactly once."""
+        self.assertEqual(escape_typst_text('a\\b #c $d @e'), 'a\\\\b \\#c \\$d \\@e')
+        self.assertTrue(needs_typst_escaping('cost $5'))
+        self.assertFalse(needs_typst_escaping('plain [text] (ok)'))
+    
+    def test_clean_text_not_copied(self):
+        """Test that text without special characters is returned as is."""
+        text = 'Nothing to escape in this sentence.'
+        self.assertIs(escape_typst_text(text), text)
+    
+    def test_document_without_special_characters(self):
+        """Test the document-wide fast path renders text unchanged."""
+        result = translate_html_to_typst('<p>Plain <strong>text</strong> only</p><p>Second</p>')
+        self.assertEqual(result, 'Plain #strong[text] only\n\nSecond')
+    
+    def test_decoded_references_escaped(self):
+        """Test that special characters produced by entities are escaped."""
+        result = translate_html_to_typst('<p>Issue &num;12 costs &dollar;5 &commat;team</p>')
+        self.assertEqual(result, 'Issue \\#12 costs \\$5 \\@team')
+    
+    def test_mixed_sources_escaped(self):
+        """Test escaping when only some text nodes contain special characters."""
+        result = translate_html_to_typst('<p>clean</p><p>#tag</p><p>also clean</p>')
+        self.assertEqual(result, 'clean\n\n\\#tag\n\nalso clean')
+    
+    def test_alternating_buffers_scanned_once(self):
+        """Test that decoded text between views does not rescan the input."""
+        paragraph = '<p><strong>Art.</strong> 5&nbsp;&sect; text</p>'
+        scanned = []
+        
+        def counting(text):
+            scanned.append(len(text))
+            return needs_typst_escaping(text)
+        
+        for count in (100, 1000):
+            html = paragraph * count
+            scanned.clear()
+            with mock.patch('html2typst.needs_typst_escaping', side_effect=counting):
+                output = translate_html_to_typst(html)
+            self.assertEqual(output, translate_html_to_typst(html))
+            # Linear in the input, not in input times text nodes
+            self.assertLessEqual(sum(scanned), 2 * len(html))
+
+
+class TestStreaming(unittest.TestCase):
+    """Test chunked input with incremental output."""
+    
+    HTML = (
+        '<h1>Title</h1>\n<p class="ql-align-center">Centered <strong>bold</strong></p>'
+        '<ul><li>One</li><li>Two &amp; three</li></ul><p>Szczecinie<strong>x</strong>(dalej)</p>'
+        '<blockquote>Quote\n\n\n\nmore</blockquote><!-- note --><pre>a\n\n\nb</pre>'
+        'trailing text &sect;1 &am'
+    )
+    
+    def test_matches_batch_for_any_chunking(self):
+        """Test that joined stream output equals the batch output."""
+        expected = translate_html_to_typst(self.HTML)
+        for size in (1, 2, 7, 64, len(self.HTML)):
+            chunks = [self.HTML[i:i + size] for i in range(0, len(self.HTML), size)]
+            self.assertEqual(''.join(translate_html_to_typst_stream(chunks)), expected, size)
+    
+    def test_blocks_yielded_before_input_ends(self):
+        """Test that completed blocks are emitted without waiting for the rest."""
+        consumed = []
+        
+        def chunks():
+            for chunk in ['<p>First</p>', '<p>Sec', 'ond</p>', '<p>Third</p>']:
+                consumed.append(chunk)
+                yield chunk
+        
+        stream = translate_html_to_typst_stream(chunks())
+        self.assertEqual(next(stream), 'First')
+        self.assertEqual(len(consumed), 1)
+        self.assertEqual(next(stream), '\n\nSecond')
+        self.assertEqual(len(consumed), 3)
+        self.assertEqual(''.join(stream), '\n\nThird')
+    
+    def test_tags_split_across_chunks(self):
+        """Test input whose '>' characters are not all tag ends, in any chunking."""
+        html = ('<p title="a>b">x &gt; y > z</p><p>a &amp</p><p>b</p'
+                '><!-- c > d --><p>q > &sect;</p>tail > &am')
+        expected = translate_html_to_typst(html)
+        for size in range(1, 12):
+            chunks = [html[i:i + size] for i in range(0, len(html), size)]
+            self.assertEqual(''.join(translate_html_to_typst_stream(chunks)), expected, size)
+    
+    def test_empty_input(self):
+        """Test that empty input yields nothing."""
+        self.assertEqual(list(translate_html_to_typst_stream([])), [])
+        self.assertEqual(list(translate_html_to_typst_stream(['', '  '])), [])
+
+
+class TestDebugLogSink(unittest.TestCase):
+    """Test the shared, queue-backed debug log sink."""
+    
+    def setUp(self):
+        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.log') as f:
+            self.log_path = f.name
+    
+    def tearDown(self):
+        if os.path.exists(self.log_path):
+            os.unlink(self.log_path)
+    
+    def read_log(self):
+        with open(self.log_path, 'r', encoding='utf-8') as f:
+            return f.read()
+    
+    def test_concurrent_translations_share_one_file(self):
+        """Test that records from concurrent translations all land, tagged by request."""
+        html = '<p class="ql-align-center">Test <strong>bold</strong></p>'
+        expected = translate_html_to_typst(html)
+        results = {}
+        
+        with DebugLogSink(self.log_path) as sink:
+            def worker(n):
+                for i in range(10):
+                    request_id = f'req-{n}-{i}'
+                    results[request_id] = translate_html_to_typst(
+                        html, debug=True, debug_sink=sink, request_id=request_id
+                    )
+            threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        
+        self.assertEqual(set(results.values()), {expected})
+        log_content = self.read_log()
+        for request_id in results:
+            self.assertEqual(log_content.count(f'[{request_id}] === HTML to Typst Translation Started'), 1)
+            self.assertEqual(log_content.count(f'[{request_id}] === HTML to Typst Translation Completed'), 1)
+    
+    def test_request_ids_numbered_by_default(self):
+        """Test that translations without a request id get consecutive numbers."""
+        with DebugLogSink(self.log_path) as sink:
+            translate_html_to_typst('<p>a</p>', debug=True, debug_sink=sink)
+            list(translate_html_to_typst_stream(['<p>b</p>'], debug=True, debug_sink=sink))
+            sink.flush()
+            log_content = self.read_log()
+        self.assertIn('[1] === HTML to Typst Translation Started', log_content)
+        self.assertIn('[2] === HTML to Typst Streaming Translation Started', log_content)
+    
+    def test_log_path_translations_do_not_clobber_each_other(self):
+        """Test that a debug_log_path translation leaves other log files alone."""
+        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.log') as f:
+            other_path = f.name
+        
+        try:
+            with DebugLogSink(self.log_path) as sink:
+                translate_html_to_typst('<p>shared</p>', debug=True, debug_sink=sink, request_id='shared')
+                translate_html_to_typst('<p>own</p>', debug=True, debug_log_path=other_path)
+                translate_html_to_typst('<p>shared</p>', debug=True, debug_sink=sink, request_id='again')
+            with open(other_path, 'r', encoding='utf-8') as f:
+                other_content = f.read()
+        finally:
+            os.unlink(other_path)
+        
+        log_content = self.read_log()
+        self.assertIn('[shared]', log_content)
+        self.assertIn('[again]', log_content)
+        self.assertNotIn('[shared]', other_content)
+        self.assertIn('Translation Completed', other_content)
+
+
+class TestTranslator(unittest.TestCase):
+    """Test the reusable Translator object."""
+    
+    def test_output_identical_to_function(self):
+        """Test that one Translator reproduces the function API across documents."""
+        documents = [
+            '<ol><li>one<ul><li>nested</li></ul></li></ol>',
+            '<p class="ql-align-center">Centered <strong>bold</strong></p>',
+            '<div><custom>unknown</custom> tag &amp; <em>text</em></div>',
+            '<blockquote>quote</blockquote><pre><code>x = 1</code></pre>',
+            'plain text with # and $',
+            '<p>unclosed <strong>bold',
+            '',
+        ]
+        translator = Translator()
+        for html in documents + documents[::-1]:
+            self.assertEqual(translator.translate(html), translate_html_to_typst(html))
+    
+    def test_state_reset_after_render_error(self):
+        """Test that a failed render does not leak list state into the next document."""
+        translator = Translator()
+        with mock.patch.object(TypstWriter, 'strip', side_effect=RuntimeError('boom')):
+            self.assertEqual(translator.translate('<ol><li>a</li></ol>'), '')
+        self.assertEqual(translator.translate('<li>b</li>'), '- b')
+    
+    def test_parser_reused(self):
+        """Test that the parser is reset rather than recreated per call."""
+        translator = Translator()
+        with mock.patch('html2typst.SimpleHTMLParser', side_effect=AssertionError('new parser')):
+            self.assertEqual(translator.translate('<p>a</p>'), 'a')
+            self.assertEqual(translator.translate('<unknown-tag>b</unknown-tag>'), 'b')
+    
+    def test_debug_log_per_translation(self):
+        """Test that a debug Translator logs each call under its own request id."""
+        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.log') as f:
+            log_path = f.name
+        
+        try:
+            with DebugLogSink(log_path) as sink:
+                translator = Translator(debug=True, debug_sink=sink)
+                self.assertEqual(translator.translate('<p>a</p>', request_id='first'), 'a')
+                self.assertEqual(translator.translate('<p>b</p>', request_id='second'), 'b')
+            with open(log_path, 'r', encoding='utf-8') as f:
+                log_content = f.read()
+        finally:
+            os.unlink(log_path)
+        
+        self.assertIn('[first] === HTML to Typst Translation Completed', log_content)
+        self.assertIn('[second] === HTML to Typst Translation Completed', log_content)
+
+
+class TestThreadSafety(unittest.TestCase):
+    """Stress test concurrent translations from many threads."""
+    
+    DOCUMENTS = [
+        '<p class="ql-align-center">Centered <strong>bold {i}</strong></p>',
+        '<ol><li>one {i}<ul><li class="ql-indent-1">nested</li></ul></li></ol>',
+        '<p><span style="color: red; font-size: 12px">styled {i}</span> #tag $x$</p>',
+        '<blockquote>quote {i}</blockquote><pre><code>x = {i}</code></pre>',
+        '<div><custom-tag>unknown {i}</custom-tag> &amp; <em>text</em></div>',
+        '<p>unclosed <strong>bold {i}',
+    ]
+    
+    def setUp(self):
+        # Switch threads as often as possible to provoke interleaving
+        self._switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+    
+    def tearDown(self):
+        sys.setswitchinterval(self._switch_interval)
+    
+    def test_concurrent_translations(self):
+        """Test that every concurrent translation produces its sequential output."""
+        documents = [template.format(i=i) for i in range(50) for template in self.DOCUMENTS]
+        QuillStyleParser.cache_clear()
+        expected = [translate_html_to_typst(html) for html in documents]
+        QuillStyleParser.cache_clear()
+        
+        def work(offset):
+            results = []
+            translator = Translator()
+            for n in range(len(documents)):
+                index = (n + offset) % len(documents)
+                html = documents[index]
+                results.append((index, translate_html_to_typst(html)))
+                results.append((index, translator.translate(html)))
+                results.append((index, ''.join(translate_html_to_typst_stream([html[:7], html[7:]]))))
+            return results
+        
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            for results in pool.map(work, range(0, 8 * 37, 37)):
+                for index, result in results:
+                    self.assertEqual(result, expected[index])
+    
+    def test_concurrent_debug_translations(self):
+        """Test concurrent debug translations, each with its own log file."""
+        html = '<p class="ql-align-right"><em>logged</em></p>'
+        expected = translate_html_to_typst(html)
+        log_dir = tempfile.mkdtemp()
+        
+        def work(n):
+            log_path = os.path.join(log_dir, f'{n}.log')
+            result = translate_html_to_typst(html, debug=True, debug_log_path=log_path)
+            with open(log_path, 'r', encoding='utf-8') as f:
+                return result, f.read()
+        
+        try:
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                for result, log_content in pool.map(work, range(32)):
+                    self.assertEqual(result, expected)
+                    self.assertEqual(log_content.count('Translation Started'), 1)
+                    self.assertEqual(log_content.count('Translation Completed'), 1)
+        finally:
+            for name in os.listdir(log_dir):
+                os.unlink(os.path.join(log_dir, name))
+            os.rmdir(log_dir)
+
+
+class RecordingExecutor(Executor):
+    """Executor that runs submissions inline and records their documents."""
+    
+    def __init__(self):
+        self.batches = []
+    
+    def submit(self, fn, *args, **kwargs):
+        self.batches.append(list(args[0]))
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class TestTranslateMany(unittest.TestCase):
+    """Test batch translation over a process pool."""
+    
+    DOCUMENTS = [
+        '<p>Paragraph {i}</p>',
+        '<ul><li>item {i}</li></ul>',
+        '<p class="ql-align-center"><strong>bold {i}</strong></p>',
+        '<div><custom>unknown {i}</custom></div>',
+    ]
+    
+    def documents(self, count):
+        return [self.DOCUMENTS[i % len(self.DOCUMENTS)].format(i=i) for i in range(count)]
+    
+    def test_results_in_input_order(self):
+        """Test that pooled results match the function API, in order."""
+        documents = self.documents(200) + ['<p>' + 'long ' * 2000 + '</p>']
+        expected = [translate_html_to_typst(html) for html in documents]
+        result = list(translate_many(iter(documents), workers=2, max_in_flight=32, batch_chars=256))
+        self.assertEqual(result, expected)
+    
+    def test_thread_executor(self):
+        """Test that worker threads do not share a translator."""
+        documents = self.documents(400)
+        expected = [translate_html_to_typst(html) for html in documents]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for _ in range(3):
+                self.assertEqual(list(translate_many(documents, executor=executor, batch_chars=10)), expected)
+    
+    def test_single_worker_runs_inline(self):
+        """Test that workers=1 translates in this process."""
+        documents = self.documents(20)
+        with mock.patch('html2typst.ProcessPoolExecutor', side_effect=AssertionError('pool created')):
+            result = list(translate_many(documents, workers=1))
+        self.assertEqual(result, [translate_html_to_typst(html) for html in documents])
+    
+    def test_error_isolated_to_document(self):
+        """Test that a failing document yields an error and the rest still translate."""
+        documents = ['<p>a</p>', '<p>fail</p>', '<p>b</p>']
+        real_translate = Translator.translate
+        
+        def failing(translator, html, *args):
+            if html == '<p>fail</p>':
+                raise RuntimeError('broken document')
+            return real_translate(translator, html, *args)
+        
+        with mock.patch.object(Translator, 'translate', failing), \
+                ThreadPoolExecutor(max_workers=2) as executor:
+            results = [list(translate_many(documents, workers=1)),
+                       list(translate_many(documents, executor=executor, batch_chars=10))]
+        for result in results:
+            self.assertEqual(result[0], 'a')
+            self.assertIsInstance(result[1], TranslationError)
+            self.assertEqual(result[1].index, 1)
+            self.assertEqual(result[2], 'b')
+    
+    def test_failed_batch_retried_per_document(self):
+        """Test that a batch failing as a whole is retried document by document."""
+        executor = RecordingExecutor()
+        documents = ['<p>a</p>', '<p>b</p>', '<p>c</p>']
+        real_batch = html2typst._translate_batch
+        
+        def flaky(batch, cache=None, limits=None):
+            if len(batch) > 1:
+                raise RuntimeError('lost message')
+            return real_batch(batch, cache, limits)
+        
+        with mock.patch('html2typst._translate_batch', side_effect=flaky):
+            result = list(translate_many(documents, executor=executor))
+        self.assertEqual(result, ['a', 'b', 'c'])
+        self.assertEqual(executor.batches[0], documents)
+        self.assertEqual(sorted(map(tuple, executor.batches[1:])), [(html,) for html in documents])
+    
+    def test_large_documents_first_and_small_batched(self):
+        """Test submission order and batching within the window."""
+        executor = RecordingExecutor()
+        large = ['<p>' + 'x' * 300 + '</p>', '<p>' + 'y' * 500 + '</p>']
+        documents = ['<p>1</p>', large[0], '<p>2</p>', large[1], '<p>3</p>']
+        result = list(translate_many(documents, executor=executor, batch_chars=100))
+        self.assertEqual(result, [translate_html_to_typst(html) for html in documents])
+        self.assertEqual(executor.batches, [[large[1]], [large[0]], ['<p>1</p>', '<p>2</p>', '<p>3</p>']])
+    
+    def test_bounded_documents_in_flight(self):
+        """Test that input is read lazily, at most max_in_flight ahead of output."""
+        read = []
+        
+        def source():
+            for i, html in enumerate(self.documents(100)):
+                read.append(i)
+                yield html
+        
+        results = translate_many(source(), executor=RecordingExecutor(), max_in_flight=10)
+        next(results)
+        self.assertLessEqual(len(read), 10)
+        self.assertEqual(len(list(results)), 99)
+
+
+class TestAsyncAPI(unittest.IsolatedAsyncioTestCase):
+    """Test the asyncio entry points."""
+    
+    async def test_concurrent_tasks_keep_own_state(self):
+        """Test that concurrent tasks each get the output of a sequential call."""
+        documents = [
+            f'<ol><li>one {i}<ul><li>nested</li></ul></li></ol><li>bare</li>' if i % 2 else
+            f'<ul><li>item {i}</li></ul><blockquote>quote</blockquote>'
+            for i in range(40)
+        ]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = await asyncio.gather(*(
+                translate_html_to_typst_async(html, executor=executor) for html in documents
+            ))
+        self.assertEqual(results, [translate_html_to_typst(html) for html in documents])
+    
+    async def test_process_executor(self):
+        """Test offloading to a process pool."""
+        html = '<p class="ql-align-center"><strong>bold</strong></p>'
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            result = await translate_html_to_typst_async(html, executor=executor)
+        self.assertEqual(result, translate_html_to_typst(html))
+    
+    async def test_cancellation(self):
+        """Test that a cancelled call returns control without waiting for the work."""
+        release = threading.Event()
+        
+        def blocking(*args):
+            release.wait(5)
+            return 'late'
+        
+        with mock.patch('html2typst.translate_html_to_typst', side_effect=blocking):
+            task = asyncio.ensure_future(translate_html_to_typst_async('<p>a</p>'))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        release.set()
+    
+    async def test_stream_yields_blocks(self):
+        """Test that the async stream yields several blocks joining to the batch output."""
+        html = ''.join(f'<p>Paragraph <strong>{i}</strong></p><ul><li>item</li></ul>' for i in range(300))
+        blocks = [block async for block in translate_html_to_typst_stream_async(html, chunk_size=1000)]
+        self.assertGreater(len(blocks), 1)
+        self.assertEqual(''.join(blocks), translate_html_to_typst(html))
+        
+        chunks = [html[i:i + 777] for i in range(0, len(html), 777)]
+        blocks = [block async for block in translate_html_to_typst_stream_async(chunks)]
+        self.assertEqual(''.join(blocks), translate_html_to_typst(html))
+    
+    async def test_stream_stopped_early(self):
+        """Test that closing the async stream early stops reading input."""
+        read = []
+        
+        def chunks():
+            for i in range(1000):
+                read.append(i)
+                yield f'<p>{i}</p>'
+        
+        stream = translate_html_to_typst_stream_async(chunks())
+        self.assertEqual(await stream.__anext__(), '0')
+        await stream.aclose()
+        await asyncio.sleep(0.05)
+        self.assertLess(len(read), 1000)
+    
+    async def test_stream_rejects_process_pool(self):
+        """Test that the stream refuses an executor it cannot keep state on."""
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            with self.assertRaises(TypeError):
+                await translate_html_to_typst_stream_async('<p>a</p>', executor=executor).__anext__()
+
+
+class TestTranslationServer(unittest.IsolatedAsyncioTestCase):
+    """Test the local translation server end to end over real sockets."""
+    
+    async def asyncSetUp(self):
+        self.servers = []
+        self.release = threading.Event()
+    
+    async def asyncTearDown(self):
+        self.release.set()
+        for server in self.servers:
+            await server.close()
+    
+    async def start(self, **kwargs):
+        path = kwargs.pop('path', None)
+        server = TranslationServer(**kwargs)
+        self.servers.append(server)
+        await server.start(path=path)
+        return server
+    
+    async def connect(self, server):
+        if isinstance(server.address, str):
+            return await asyncio.open_unix_connection(server.address)
+        return await asyncio.open_connection(*server.address[:2])
+    
+    async def request(self, connection, method, path, body=b''):
+        """Send one request on connection and return (status, body)."""
+        reader, writer = connection
+        writer.write(
+            f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+        return await self.response(reader)
+    
+    async def response(self, reader):
+        """Read one response and return (status, body)."""
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line == b'\r\n':
+                break
+            name, _, value = line.decode().partition(':')
+            headers[name.lower()] = value.strip()
+        self.headers = headers
+        return status, (await reader.readexactly(int(headers['content-length']))).decode()
+    
+    def blocking_batch(self, documents, cache=None, limits=None):
+        self.release.wait(5)
+        return [(True, 'late')]
+    
+    async def test_unix_socket_with_worker_processes(self):
+        """Test translation by a warm process pool over a Unix socket."""
+        socket_dir = tempfile.mkdtemp()
+        path = os.path.join(socket_dir, 'html2typst.sock')
+        try:
+            server = await self.start(workers=1, path=path)
+            connection = await self.connect(server)
+            html = '<p class="ql-align-center"><strong>bold</strong> &amp; more</p>'
+            # Several requests on one keep-alive connection
+            for _ in range(3):
+                self.assertEqual(await self.request(connection, 'POST', '/translate', html.encode()),
+                                 (200, translate_html_to_typst(html)))
+            connection[1].close()
+            await server.close()
+            self.assertFalse(os.path.exists(path))
+        finally:
+            os.rmdir(socket_dir)
+    
+    async def test_stats_and_errors(self):
+        """Test the stats endpoint and error statuses over TCP."""
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            server = await self.start(workers=2, executor=executor)
+            connection = await self.connect(server)
+            self.assertEqual(await self.request(connection, 'POST', '/translate', b'<p>a</p>'), (200, 'a'))
+            self.assertEqual((await self.request(connection, 'GET', '/translate'))[0], 405)
+            self.assertEqual((await self.request(connection, 'GET', '/missing'))[0], 404)
+            self.assertEqual((await self.request(connection, 'POST', '/translate', b'\xff'))[0], 400)
+            
+            status, body = await self.request(await self.connect(server), 'GET', '/stats')
+            stats = json.loads(body)
+            self.assertEqual(status, 200)
+            self.assertEqual(stats['translated'], 1)
+            self.assertEqual(stats['bad_requests'], 1)
+            self.assertEqual(stats['workers'], 2)
+            self.assertEqual(stats['active'], 0)
+            await server.close()
+    
+    async def test_backpressure_rejects_when_queue_full(self):
+        """Test that requests beyond queue_size are rejected at once with 503."""
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            server = await self.start(workers=1, queue_size=1, executor=executor)
+            with mock.patch('html2typst._translate_batch', side_effect=self.blocking_batch):
+                first = asyncio.ensure_future(self.request(await self.connect(server), 'POST', '/translate', b'<p>a</p>'))
+                await asyncio.sleep(0.05)
+                self.assertEqual((await self.request(await self.connect(server), 'POST', '/translate', b'<p>b</p>'))[0], 503)
+                self.release.set()
+                self.assertEqual(await first, (200, 'late'))
+            self.assertEqual(server.stats()['rejected'], 1)
+            await server.close()
+    
+    async def test_time_limit(self):
+        """Test that a request exceeding the time limit gets 504."""
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            server = await self.start(workers=1, timeout=0.05, executor=executor)
+            with mock.patch('html2typst._translate_batch', side_effect=self.blocking_batch):
+                status, _ = await self.request(await self.connect(server), 'POST', '/translate', b'<p>a</p>')
+                self.release.set()
+            self.assertEqual(status, 504)
+            self.assertEqual(server.stats()['timeouts'], 1)
+            await server.close()
+    
+    async def test_timed_out_request_keeps_its_place(self):
+        """Test that a timed out translation still counts against queue_size until it ends."""
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            server = await self.start(workers=1, queue_size=1, timeout=0.05, executor=executor)
+            with mock.patch('html2typst._translate_batch', side_effect=self.blocking_batch):
+                self.assertEqual((await self.request(await self.connect(server), 'POST', '/translate', b'<p>a</p>'))[0], 504)
+                self.assertEqual((await self.request(await self.connect(server), 'POST', '/translate', b'<p>b</p>'))[0], 503)
+                self.assertEqual((server.stats()['active'], server.stats()['abandoned']), (1, 1))
+                self.release.set()
+                for _ in range(100):
+                    if not server.stats()['active']:
+                        break
+                    await asyncio.sleep(0.01)
+            self.assertEqual((server.stats()['active'], server.stats()['abandoned']), (0, 0))
+            self.assertEqual(await self.request(await self.connect(server), 'POST', '/translate', b'<p>c</p>'), (200, 'c'))
+            await server.close()
+    
+    async def test_chunked_body(self):
+        """Test chunked request bodies, and that other transfer codings are refused."""
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            server = await self.start(workers=1, executor=executor)
+            reader, writer = connection = await self.connect(server)
+            writer.write(
+                b"POST /translate HTTP/1.1\r\nHost: localhost\r\nTransfer-Encoding: chunked\r\n\r\n"
+                b"5\r\n<p>ch\r\n7;ext=1\r\nunked</\r\n2\r\np>\r\n0\r\nX-Trailer: 1\r\n\r\n"
+            )
+            self.assertEqual(await self.response(reader), (200, 'chunked'))
+            # Nothing of the body is left to be read as a request
+            self.assertEqual(await self.request(connection, 'POST', '/translate', b'<p>next</p>'), (200, 'next'))
+            
+            reader, writer = await self.connect(server)
+            writer.write(b"POST /translate HTTP/1.1\r\nTransfer-Encoding: gzip\r\n\r\n\x1f\x8b")
+            self.assertEqual((await reader.readline()).split()[1], b'501')
+            await reader.read()  # Connection closed
+            await server.close()
+    
+    async def test_limits(self):
+        """Test that degraded responses name the budget that ran out."""
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            server = await self.start(workers=1, executor=executor, limits=Limits(nodes=2))
+            connection = await self.connect(server)
+            status, body = await self.request(connection, 'POST', '/translate', b'<p>a</p><p>b</p><p>c</p>')
+            self.assertEqual((status, body), (200, 'a\n\nb\n\nc'))
+            self.assertEqual(self.headers['x-translation-limit'], 'nodes')
+            await self.request(connection, 'POST', '/translate', b'<p>a</p>')
+            self.assertNotIn('x-translation-limit', self.headers)
+            self.assertEqual(server.stats()['degraded'], 1)
+            await server.close()
+
+
+class TestResultCache(unittest.TestCase):
+    """Test the in-memory translation result cache."""
+    
+    def test_hit_skips_translation(self):
+        """Test that a repeated input is served from the cache."""
+        cache = ResultCache()
+        html = '<p class="ql-align-center"><strong>Title</strong></p>'
+        expected = translate_html_to_typst(html)
+        self.assertEqual(translate_html_to_typst(html, cache=cache), expected)
+        with mock.patch.object(Translator, 'translate', side_effect=AssertionError('translated')):
+            self.assertEqual(translate_html_to_typst(html, cache=cache), expected)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+        
+        translator = Translator(cache=cache)
+        self.assertEqual(translator.translate(html), expected)
+        self.assertEqual(cache.stats()['hits'], 2)
+    
+    def test_whitespace_between_blocks_normalized(self):
+        """Test that documents differing in insignificant whitespace share an entry."""
+        cache = ResultCache()
+        translate_html_to_typst('<p>a</p><h2>b <em>c</em></h2><p>d</p>', cache=cache)
+        variant = '\n  <p>a</p>\n<h2>b <em>c</em></h2>\n\n<p>d</p>\n'
+        with mock.patch.object(Translator, 'translate', side_effect=AssertionError('translated')):
+            self.assertEqual(translate_html_to_typst(variant, cache=cache), 'a\n\n== b #emph[c]\n\nd')
+        # The variant itself is now cached under its own key too
+        self.assertEqual(cache.stats()['entries'], 2)
+        self.assertEqual(cache.stats()['hits'], 1)
+    
+    def test_normalization_never_changes_output(self):
+        """Test that normalization leaves whitespace alone where it is significant."""
+        unchanged = [
+            '<ul><li>a</li>\n<li>b</li></ul>',
+            '<blockquote><p>a</p>\n\n<p>b</p></blockquote>',
+            '<pre>x</pre>\n<p>b</p>',
+            '<p>a</p> \n<p>b</p>',
+            '<p><em>a</p>\n<p>b</p>',
+            '</p>\n<p>b</p>',
+            '<p>a < b</p>\n<p>c</p>',
+            '<p>a</p>\n<p><script>x</p>\n<p></script></p>',
+            '<p>a</p>\n<br>\n<p>b</p>',
+            '<p>unclosed <pre>code\n ',
+            '<p><span class=a/>x</p>\n<p>y</p>',
+        ]
+        for html in unchanged:
+            self.assertIs(ResultCache.normalize(html), html)
+        
+        normalized = [
+            ('\n<p>a</p>\n<p>b</p>\n', '<p>a</p><p>b</p>'),
+            ('<h1>t<br></h1>\n\n\n<p class="ql-align-right"><span style="color: red"><strong>x</strong></span></p>',
+             '<h1>t<br></h1><p class="ql-align-right"><span style="color: red"><strong>x</strong></span></p>'),
+            ('<P>a<img src="i.png"/></P>\n<p>b<ul><li>c</li></ul></p> ', '<P>a<img src="i.png"/></P><p>b<ul><li>c</li></ul></p>'),
+        ]
+        for html, expected in normalized:
+            self.assertEqual(ResultCache.normalize(html), expected)
+        for html in unchanged + [html for html, _ in normalized]:
+            self.assertEqual(translate_html_to_typst(ResultCache.normalize(html)), translate_html_to_typst(html))
+    
+    def test_lru_eviction_by_bytes(self):
+        """Test that the least recently used entries are evicted past max_bytes."""
+        entry = sys.getsizeof('x' * 100) + ResultCache.ENTRY_OVERHEAD
+        cache = ResultCache(max_bytes=2 * entry)
+        cache.put('<p>1</p>', 'x' * 100)
+        cache.put('<p>2</p>', 'y' * 100)
+        self.assertEqual(cache.get('<p>1</p>'), 'x' * 100)  # 1 is now most recent
+        cache.put('<p>3</p>', 'z' * 100)
+        self.assertIsNone(cache.get('<p>2</p>'))
+        self.assertEqual(cache.get('<p>1</p>'), 'x' * 100)
+        stats = cache.stats()
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['entries'], 2)
+        self.assertLessEqual(stats['bytes'], stats['max_bytes'])
+        
+        cache.put('<p>big</p>', 'w' * 1000)  # Larger than the whole cache
+        self.assertIsNone(cache.get('<p>big</p>'))
+    
+    def test_options_part_of_key(self):
+        """Test that the same input under different options has different entries."""
+        cache = ResultCache()
+        cache.put('<p>a</p>', 'plain')
+        cache.put('<p>a</p>', 'other', options=('budget', 10))
+        self.assertEqual(cache.get('<p>a</p>'), 'plain')
+        self.assertEqual(cache.get('<p>a</p>', options=('budget', 10)), 'other')
+    
+    def test_debug_bypasses_cache(self):
+        """Test that debug translations always run (and log) in full."""
+        cache = ResultCache()
+        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.log') as f:
+            log_path = f.name
+        try:
+            translate_html_to_typst('<p>a</p>', cache=cache)
+            self.assertEqual(translate_html_to_typst('<p>a</p>', debug=True, debug_log_path=log_path, cache=cache), 'a')
+            with open(log_path, 'r', encoding='utf-8') as f:
+                self.assertIn('Translation Completed', f.read())
+        finally:
+            os.unlink(log_path)
+        self.assertEqual(cache.stats()['hits'], 0)
+
+
+def use_disk_cache(path, worker):
+    """Store and read back entries in a DiskCache from another process."""
+    cache = DiskCache(path, max_bytes=20000)
+    for i in range(100):
+        html = f'<p>{worker} {i}</p>'
+        cache.put(html, f'out {worker} {i}')
+        if cache.get(html) not in (None, f'out {worker} {i}'):
+            return -1
+    return cache.stats()['errors']
+
+
+class TestDiskCache(unittest.TestCase):
+    """Test the persistent SQLite result cache."""
+    
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'cache.db')
+    
+    def tearDown(self):
+        for name in os.listdir(self.dir):
+            os.unlink(os.path.join(self.dir, name))
+        os.rmdir(self.dir)
+    
+    def test_persists_across_instances(self):
+        """Test that a result stored by one cache object is found by another."""
+        html = '<p class="ql-align-center"><strong>Title</strong></p>\n<p>body</p>'
+        expected = translate_html_to_typst(html)
+        cache = DiskCache(self.path)
+        self.assertEqual(translate_html_to_typst(html, cache=cache), expected)
+        cache.close()
+        
+        cache = DiskCache(self.path)
+        with mock.patch.object(Translator, 'translate', side_effect=AssertionError('translated')):
+            self.assertEqual(translate_html_to_typst(html, cache=cache), expected)
+            # Normalized lookups work as in ResultCache
+            self.assertEqual(translate_html_to_typst(html.replace('\n', ''), cache=cache), expected)
+        self.assertEqual(cache.stats()['hits'], 2)
+        self.assertEqual(cache.stats()['misses'], 0)
+        cache.close()
+    
+    def test_version_in_key(self):
+        """Test that outputs cached by another translator version are not returned."""
+        self.assertRegex(translator_version(), r'^[0-9a-f]{16}$')
+        self.assertEqual(DiskCache(self.path).version, translator_version())
+        DiskCache(self.path, version='old').put('<p>a</p>', 'stale')
+        self.assertIsNone(DiskCache(self.path, version='new').get('<p>a</p>'))
+        self.assertEqual(DiskCache(self.path, version='old').get('<p>a</p>'), 'stale')
+    
+    def test_entries_compressed(self):
+        """Test that outputs are stored compressed and read back intact."""
+        cache = DiskCache(self.path)
+        output = 'repeated text \u00e9 ' * 1000
+        cache.put('<p>x</p>', output)
+        cache.put('<p>y</p>', 'short \ud800')  # Stored as is, lone surrogate and all
+        self.assertEqual(cache.get('<p>x</p>'), output)  # Not yet written out
+        cache.flush()
+        with sqlite3.connect(self.path) as connection:
+            sizes = [size for (size,) in connection.execute('SELECT length(value) FROM entries')]
+        self.assertEqual(len(sizes), 2)
+        self.assertLess(min(sizes), 20)
+        self.assertLess(max(sizes), len(output) // 10)
+        cache.close()
+        cache = DiskCache(self.path)
+        self.assertEqual(cache.get('<p>x</p>'), output)
+        self.assertEqual(cache.get('<p>y</p>'), 'short \ud800')
+    
+    def test_lru_eviction(self):
+        """Test that the least recently used entries are evicted past max_bytes."""
+        cache = DiskCache(self.path, max_bytes=1000, normalize=False)
+        cache.WRITE_BATCH = 1
+        with mock.patch('html2typst.time.time', side_effect=range(0, 100000, 100)):
+            for i in range(5):
+                cache.put(f'<p>{i}</p>', f'output {i}')
+            self.assertEqual(cache.get('<p>0</p>'), 'output 0')  # Now most recent
+            for i in range(5, 14):
+                cache.put(f'<p>{i}</p>', f'output {i}')
+        stats = cache.stats()
+        self.assertGreater(stats['evictions'], 0)
+        self.assertLessEqual(stats['bytes'], 1000)
+        self.assertEqual(cache.get('<p>0</p>'), 'output 0')
+        self.assertIsNone(cache.get('<p>1</p>'))
+        self.assertEqual(cache.get('<p>13</p>'), 'output 13')
+        with sqlite3.connect(self.path) as connection:
+            (total,) = connection.execute('SELECT sum(size) FROM entries').fetchone()
+        self.assertEqual(total, stats['bytes'])
+    
+    def test_damaged_entry_is_a_miss(self):
+        """Test that cache errors never fail a translation."""
+        cache = DiskCache(self.path)
+        translate_html_to_typst('<p>a</p>', cache=cache)
+        cache.flush()
+        with sqlite3.connect(self.path) as connection:
+            connection.execute("UPDATE entries SET value = x'01'")
+        self.assertEqual(translate_html_to_typst('<p>a</p>', cache=cache), 'a')
+        self.assertEqual(cache.stats()['errors'], 1)
+    
+    def test_pickles_to_one_object_per_process(self):
+        """Test that unpickled caches share this process's connection."""
+        cache = DiskCache(self.path, max_bytes=12345)
+        first = pickle.loads(pickle.dumps(cache))
+        second = pickle.loads(pickle.dumps(cache))
+        self.assertIs(first, second)
+        self.assertEqual((first.path, first.max_bytes, first.version), (self.path, 12345, cache.version))
+        html2typst._disk_caches.clear()
+    
+    def test_concurrent_processes(self):
+        """Test many processes reading and writing one cache file at once."""
+        DiskCache(self.path)
+        with ProcessPoolExecutor(max_workers=4) as pool:
+            errors = list(pool.map(use_disk_cache, [self.path] * 4, range(4)))
+        self.assertEqual(errors, [0, 0, 0, 0])
+        self.assertLessEqual(DiskCache(self.path).stats()['bytes'], 20000)
+    
+    def test_translate_many_workers_share_cache(self):
+        """Test that translate_many workers fill and reuse a DiskCache."""
+        documents = [f'<p>Paragraph {i}</p>' for i in range(50)]
+        expected = [translate_html_to_typst(html) for html in documents]
+        cache = DiskCache(self.path)
+        self.assertEqual(list(translate_many(documents, workers=2, batch_chars=100, cache=cache)), expected)
+        self.assertEqual(cache.stats()['entries'], 50)
+        
+        with mock.patch('html2typst.parse_html', side_effect=AssertionError('translated')):
+            self.assertEqual(list(translate_many(documents, workers=1, cache=cache)), expected)
+        
+        with self.assertRaises(TypeError):
+            next(translate_many(documents, workers=2, cache=ResultCache()))
+
+
+class TestSubtreeCache(unittest.TestCase):
+    """Test memoization of rendered top-level blocks across documents."""
+    
+    BLOCKS = [
+        '<p class="ql-align-center"><strong>Standard terms</strong> apply to all customers &amp; partners, '
+        'see <a href="https://example.com/terms">the terms</a> for details.</p>',
+        '<ul><li>First clause of the shared template, repeated verbatim</li>'
+        '<li class="ql-indent-1"><em>Second</em> clause [with brackets]</li></ul>',
+        '<blockquote>Quoted boilerplate that appears in many documents\n\n\nwith blank lines</blockquote>',
+        '<h2>A heading that is long enough to be worth memoizing, ending in a bracket ]</h2>',
+    ]
+    
+    def test_output_unchanged(self):
+        """Test that memoized blocks render exactly as without the cache, in any context."""
+        cache = SubtreeCache()
+        translator = Translator(subtree_cache=cache)
+        plain = Translator()
+        separators = ['', '\n', 'text]', '(', '\n\n\n', '</b>', '<p>x</p>', '<br>']
+        for first in self.BLOCKS:
+            for separator in separators:
+                for second in self.BLOCKS:
+                    html = separator + first + separator + second + separator
+                    self.assertEqual(translator.translate(html), plain.translate(html), html)
+        self.assertGreater(cache.stats()['hit_rate'], 0.9)
+    
+    def test_repeated_block_not_rendered_again(self):
+        """Test that a block seen in an earlier document is copied from the cache."""
+        cache = SubtreeCache()
+        html = self.BLOCKS[0] + self.BLOCKS[1]
+        expected = translate_html_to_typst(html)
+        self.assertEqual(translate_html_to_typst(html, subtree_cache=cache), expected)
+        self.assertEqual(cache.stats()['entries'], 2)
+        with mock.patch.object(TypstRenderer, 'render_into', side_effect=AssertionError('rendered')):
+            self.assertEqual(translate_html_to_typst(html, subtree_cache=cache), expected)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 2))
+        self.assertEqual(stats['hit_rate'], 0.5)
+    
+    def test_not_memoized(self):
+        """Test inputs whose blocks are rendered directly."""
+        cache = SubtreeCache()
+        # Short blocks, and input outside the Quill dialect (no source spans)
+        for html in ('<p>short</p><p>blocks</p>', '<!-- c -->' + self.BLOCKS[0]):
+            self.assertEqual(translate_html_to_typst(html, subtree_cache=cache), translate_html_to_typst(html))
+        # Debug translations log every node
+        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.log') as f:
+            log_path = f.name
+        try:
+            translate_html_to_typst(self.BLOCKS[0], debug=True, debug_log_path=log_path, subtree_cache=cache)
+        finally:
+            os.unlink(log_path)
+        self.assertEqual(cache.stats()['entries'], 0)
+        self.assertEqual(cache.stats()['hit_rate'], 0.0)
+    
+    def test_memory_cap(self):
+        """Test that the cache stays within max_bytes by evicting old blocks."""
+        cache = SubtreeCache(max_bytes=4096)
+        translator = Translator(subtree_cache=cache)
+        for i in range(50):
+            html = f'<p>Paragraph {i} of a document that is long enough to be memoized by the renderer, {"x" * 80}</p>'
+            self.assertEqual(translator.translate(html), translate_html_to_typst(html))
+        stats = cache.stats()
+        self.assertGreater(stats['evictions'], 0)
+        self.assertLessEqual(stats['bytes'], 4096)
+    
+    def test_block_spans(self):
+        """Test that the scanner records the source of closed top-level elements."""
+        html = '<p>a<b>b</b></p>text<br><ul><li>x</li></ul><p>open'
+        parser = SimpleHTMLParser()
+        root, engine = parse_html(html, parser=parser)
+        self.assertEqual(engine, 'quill')
+        sources = [html[start:end] for start, end in
+                   (parser.block_spans[id(node)] for node in root.children if id(node) in parser.block_spans)]
+        self.assertEqual(sources, ['<p>a<b>b</b></p>', '<ul><li>x</li></ul>'])
+        parse_html('<!-- c --><p>a</p>', parser=parser)
+        self.assertEqual(parser.block_spans, {})
+
+
+class TestIncrementalTranslation(unittest.TestCase):
+    """Test re-translating edited documents from the previous translation."""
+    
+    DOCUMENT = ''.join(
+        f'<p>Paragraph {i} with <strong>bold</strong> and <a href="https://example.com/{i}">a link</a>]</p>'
+        f'<ul><li>item {i}</li></ul>\n'
+        for i in range(20)
+    )
+    
+    def assertTranslatesEdits(self, versions):
+        """Translate versions in turn, checking each against a fresh translation."""
+        state = None
+        for html in versions:
+            output, state = translate_html_to_typst_incremental(html, state)
+            self.assertEqual(output, translate_html_to_typst(html), html)
+        return state
+    
+    def test_edits(self):
+        """Test that edited documents translate exactly as fresh ones."""
+        doc = self.DOCUMENT
+        middle = doc.index('Paragraph 10')
+        block = doc.index('<p>Paragraph 10')
+        self.assertTranslatesEdits([
+            doc,
+            doc[:middle] + 'New ' + doc[middle:],                      # Inside a block
+            doc[:block] + '<h2>Inserted</h2>' + doc[block:],           # New block
+            doc[:block] + doc[doc.index('<p>Paragraph 11'):],          # Deleted blocks
+            doc[:block] + '(x)' + doc[block:],                         # Top-level text
+            '<h1>Title</h1>' + doc + '<p>end</p>',                     # Both ends
+            doc[:middle] + '</p><p>' + doc[middle:],                   # Split block
+            doc[:middle] + '<strong>' + doc[middle:],                  # Unclosed inline
+            doc[:block] + '<blockquote>' + doc[block:],                # Unclosed block
+            doc + '<p>trailing',                                       # Open at the end
+            doc + '<p>trailing text',
+            doc + '<p>trailing text</p>',
+            doc.replace('\n', '\n\n\n\n'),                            # Blank lines
+            doc[:block],
+            '',
+            doc,
+        ])
+    
+    def test_only_changed_blocks_rendered(self):
+        """Test that an edit renders only the blocks it touched."""
+        doc = self.DOCUMENT
+        middle = doc.index('Paragraph 10')
+        _, state = translate_html_to_typst_incremental(doc)
+        render_block = TypstRenderer.render_block
+        with mock.patch.object(TypstRenderer, 'render_block', autospec=True, side_effect=render_block) as rendered:
+            edited = doc[:middle] + 'New ' + doc[middle:]
+            output, state = translate_html_to_typst_incremental(edited, state)
+        self.assertEqual(output, translate_html_to_typst(edited))
+        self.assertEqual(rendered.call_count, 1)
+    
+    def test_unchanged_and_earlier_states(self):
+        """Test that states are not modified and can be reused."""
+        doc = self.DOCUMENT
+        output, state = translate_html_to_typst_incremental(doc)
+        self.assertEqual(translate_html_to_typst_incremental(doc, state), (output, state))
+        edited = doc.replace('Paragraph 3 ', 'Changed 3 ')
+        edited_output, _ = translate_html_to_typst_incremental(edited, state)
+        # Undo: the state of the original document still describes it
+        self.assertEqual(translate_html_to_typst_incremental(doc, state)[0], output)
+        self.assertEqual(translate_html_to_typst_incremental(edited, state)[0], edited_output)
+    
+    def test_outside_dialect(self):
+        """Test documents that have to be translated whole."""
+        doc = self.DOCUMENT
+        self.assertTranslatesEdits([doc, doc + '<!-- comment -->', doc + '<!-- comment --><p>x</p>', doc])
+        # An edit that leaves the dialect is found as the changed blocks are parsed
+        block = doc.index('<p>Paragraph 10')
+        self.assertTranslatesEdits([doc, doc[:block] + '<table>' + doc[block:]])
+
+
+def random_delta(rng):
+    """Return a random Delta document using every mapped format."""
+    texts = ['plain', ' spaced  out ', '#hash', '[brackets](paren)', '*star*', '_under_', 'back\\slash',
+             '$5 & <tags>', '`tick`', '= eq', '- dash', '+ plus', 'café', '\u00a0nbsp', 'a\nb', '\n', '\n\n']
+    inline = [{}, {'bold': True}, {'italic': True}, {'underline': True}, {'strike': True}, {'code': True},
+              {'script': 'super'}, {'script': 'sub'}, {'link': 'https://example.com/a?b=1&c=2'}, {'link': 'https://x.org'},
+              {'bold': True, 'italic': True}, {'bold': True, 'link': 'https://x.org'}, {'color': '#e60000'}]
+    lines = [{}, {'header': 1}, {'header': 3}, {'list': 'ordered'}, {'list': 'bullet'}, {'list': 'checked'},
+             {'list': 'unchecked'}, {'indent': 2}, {'align': 'center'}, {'align': 'right'}, {'align': 'justify'},
+             {'list': 'bullet', 'indent': 1}, {'header': 2, 'align': 'center'}, {'blockquote': True},
+             {'blockquote': True, 'align': 'center'}, {'code-block': True}, {'code-block': True}]
+    ops = []
+    for _ in range(rng.randint(0, 12)):
+        for _ in range(rng.randint(0, 4)):
+            if rng.random() < 0.05:
+                ops.append({'insert': {'image': 'picture.png'}, 'attributes': rng.choice(inline)})
+            else:
+                ops.append({'insert': rng.choice(texts), 'attributes': rng.choice(inline)})
+        ops.append({'insert': '\n', 'attributes': rng.choice(lines)})
+    return ops
+
+
+class TestQuillDelta(unittest.TestCase):
+    """Test translating Quill Delta documents directly."""
+    
+    DELTA = {'ops': [
+        {'insert': 'Title'}, {'insert': '\n', 'attributes': {'header': 1}},
+        {'insert': 'Some '}, {'insert': 'bold', 'attributes': {'bold': True}},
+        {'insert': ' and '}, {'insert': 'linked', 'attributes': {'bold': True, 'link': 'https://example.com'}},
+        {'insert': ' text.\nFirst'}, {'insert': '\n', 'attributes': {'list': 'ordered'}},
+        {'insert': 'Second'}, {'insert': '\n', 'attributes': {'list': 'ordered', 'indent': 1}},
+        {'insert': 'Centered'}, {'insert': '\n\n', 'attributes': {'align': 'center'}},
+    ]}
+    
+    def assertMatchesHTMLPath(self, delta):
+        """Check the Delta path against the HTML Quill renders for delta."""
+        html = delta_to_html(delta['ops'])
+        self.assertEqual(dump_tree(parse_delta(delta)), dump_tree(parse_html(html)[0]), html)
+        self.assertEqual(translate_delta_to_typst(delta), translate_html_to_typst(html), html)
+    
+    def test_formats(self):
+        """Test that each mapped format renders as its HTML does."""
+        self.assertMatchesHTMLPath(self.DELTA)
+        output = translate_delta_to_typst(self.DELTA)
+        self.assertIn('= Title', output)
+        self.assertIn('#link("https://example.com")[#strong[linked]]', output)
+        self.assertIn('+ First\n+ Second', output)
+        self.assertIn('#align(center)[Centered]', output)
+    
+    def test_random_documents(self):
+        """Test the Delta and HTML paths against each other on random documents."""
+        rng = random.Random(24)
+        for _ in range(300):
+            self.assertMatchesHTMLPath({'ops': random_delta(rng)})
+    
+    def test_block_formats(self):
+        """Test blockquote and code-block lines as Quill renders them."""
+        ops = [
+            {'insert': 'quote'}, {'insert': '\n', 'attributes': {'blockquote': True}},
+            {'insert': 'x = 1'}, {'insert': '\n', 'attributes': {'code-block': True}},
+            {'insert': '\n', 'attributes': {'code-block': True}},
+            {'insert': 'y', 'attributes': {'bold': True}}, {'insert': ' < 2'},
+            {'insert': '\n', 'attributes': {'code-block': True}},
+            {'insert': 'after'}, {'insert': '\n'},
+        ]
+        html = delta_to_html(ops)
+        self.assertEqual(html, '<blockquote>quote</blockquote>'
+                               '<pre class="ql-syntax" spellcheck="false">x = 1\n\ny &lt; 2\n</pre><p>after</p>')
+        self.assertMatchesHTMLPath({'ops': ops})
+        self.assertEqual(translate_delta_to_typst(ops), translate_html_to_typst(html))
+        self.assertTrue(translate_delta_to_typst(ops).startswith('> quote\n\n```'))
+    
+    def test_input_forms(self):
+        """Test Delta objects, op lists and JSON strings."""
+        expected = translate_delta_to_typst(self.DELTA)
+        self.assertEqual(translate_delta_to_typst(self.DELTA['ops']), expected)
+        self.assertEqual(translate_delta_to_typst(json.dumps(self.DELTA)), expected)
+        self.assertEqual(Translator().translate_delta(json.dumps(self.DELTA).encode()), expected)
+        self.assertEqual(translate_delta_to_typst({'ops': []}), '')
+        with self.assertRaises(ValueError):
+            translate_delta_to_typst('{"ops": [')
+        with self.assertRaises(TypeError):
+            translate_delta_to_typst({'ops': 'text'})
+    
+    def test_text_kept(self):
+        """Test that unmapped formats, embeds and ops lose no text."""
+        ops = [
+            {'insert': 'colored', 'attributes': {'color': '#e60000', 'font': 'serif'}},
+            {'insert': {'video': 'https://example.com/v'}},
+            {'retain': 3}, {'delete': 1}, 'junk',
+            {'insert': ' quoted'}, {'insert': '\n', 'attributes': {'blockquote': True, 'header': 9}},
+            {'insert': 'no final newline', 'attributes': {'link': 42}},
+        ]
+        self.assertEqual(translate_delta_to_typst(ops), '> colored quoted\n\nno final newline')
+    
+    def test_debug(self):
+        """Test that debug mode logs without changing the output."""
+        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.log') as f:
+            log_path = f.name
+        try:
+            output = translate_delta_to_typst(self.DELTA, debug=True, debug_log_path=log_path)
+            with open(log_path) as f:
+                log = f.read()
+        finally:
+            os.unlink(log_path)
+        self.assertEqual(output, translate_delta_to_typst(self.DELTA))
+        self.assertIn('Quill Delta to Typst Translation Completed', log)
+
+
+class TestLimits(unittest.TestCase):
+    """Test translation within resource budgets."""
+    
+    DOC = ''.join(f'<p>para {i} <strong>bold</strong> &amp; <em>more</em></p>' for i in range(50))
+    
+    def words(self, text):
+        """Return the words of text, without Typst markup."""
+        for markup in ('#strong[', '#emph[', ']', '\\'):
+            text = text.replace(markup, ' ')
+        return text.split()
+    
+    def test_each_budget(self):
+        """Test that each budget degrades the output and is named in it."""
+        expected = self.words(translate_html_to_typst(self.DOC))
+        for name, value in [('nodes', 20), ('depth', 1), ('seconds', 0)]:
+            with self.subTest(name):
+                output = translate_html_to_typst(self.DOC, limits=Limits(**{name: value}))
+                self.assertIsInstance(output, DegradedOutput)
+                self.assertEqual(output.limit, name)
+                # The rest of the input follows as plain text
+                self.assertEqual(self.words(output), expected)
+                self.assertNotIn('<', output)
+    
+    def test_input_budget(self):
+        """Test that input past input_chars is dropped, cut before a tag."""
+        output = translate_html_to_typst(self.DOC, limits=Limits(input_chars=300))
+        self.assertEqual(output.limit, 'input_chars')
+        self.assertEqual(output, translate_html_to_typst(self.DOC[:self.DOC.rindex('<', 0, 301)]))
+    
+    def test_input_budget_within_text(self):
+        """Test that a budget holding no complete tag cuts the text, not everything."""
+        for html in ['<p>' + 'word ' * 20000 + '</p>', 'word ' * 20000, '<p>' + 'a &amp; ' * 2000 + '</p>']:
+            output = translate_html_to_typst(html, limits=Limits(input_chars=1000))
+            self.assertEqual(output.limit, 'input_chars')
+            self.assertGreater(len(output), 400)
+            self.assertTrue(translate_html_to_typst(html).startswith(output.rstrip(' &')))
+    
+    def test_large_input_bounded(self):
+        """Test that the plain text remainder stays within the time and input budgets."""
+        html = '<p><strong>a</strong> b</p>' * 800000
+        start = time.perf_counter()
+        output = translate_html_to_typst(html, limits=Limits(nodes=10, seconds=0.05))
+        elapsed = time.perf_counter() - start
+        self.assertEqual(output.limit, 'seconds')
+        # Converting all of the remainder takes seconds
+        self.assertLess(elapsed, 1.0)
+        self.assertLess(len(output), len(html) // 10)
+        output = translate_html_to_typst(html, limits=Limits(input_chars=1000, nodes=10))
+        self.assertEqual(output.limit, 'nodes')
+        self.assertLess(len(output), 1000)
+    
+    def test_output_budget(self):
+        """Test that output stops shortly after its budget, at an element."""
+        full = translate_html_to_typst(self.DOC)
+        for budget in (0, 10, 200, 1000):
+            output = translate_html_to_typst(self.DOC, limits=Limits(output_chars=budget))
+            self.assertEqual(output.limit, 'output_chars')
+            self.assertTrue(full.startswith(output.rstrip(']')))
+            self.assertLess(len(output), budget + 50)
+    
+    def test_within_budgets(self):
+        """Test that output within every budget is unchanged and not degraded."""
+        limits = Limits(len(self.DOC), 1000, 10, 10000, 60.0)
+        output = translate_html_to_typst(self.DOC, limits=limits)
+        self.assertNotIsInstance(output, DegradedOutput)
+        self.assertEqual(output, translate_html_to_typst(self.DOC))
+    
+    def test_deep_nesting(self):
+        """Test that the depth budget bounds adversarial nesting."""
+        html = '<span>' * 20000 + 'deep' + '</span>' * 20000
+        output = translate_html_to_typst(html, limits=Limits(depth=50))
+        self.assertEqual((output, output.limit), ('deep', 'depth'))
+    
+    def test_html_parser_fallback(self):
+        """Test budgets on input outside the Quill dialect."""
+        html = '<!-- note --><p>a</p><p>b <em>c</em></p><p>d</p>'
+        self.assertEqual(parse_html(html)[1], 'html.parser')
+        output = translate_html_to_typst(html, limits=Limits(nodes=2))
+        self.assertEqual((output, output.limit), ('a\n\nb \n\nc\n\nd', 'nodes'))
+    
+    def test_cache(self):
+        """Test that limits are part of cache keys and degraded output is not cached."""
+        cache = ResultCache(1 << 20)
+        limits = Limits(nodes=5)
+        self.assertEqual(translate_html_to_typst(self.DOC, cache=cache, limits=limits).limit, 'nodes')
+        self.assertEqual(cache.stats()['entries'], 0)
+        translator = Translator(cache=cache, limits=Limits(nodes=1000))
+        self.assertEqual(translator.translate(self.DOC), translate_html_to_typst(self.DOC))
+        self.assertEqual(cache.stats()['entries'], 1)
+        self.assertIsInstance(translate_html_to_typst(self.DOC, cache=cache, limits=limits), DegradedOutput)
+    
+    def test_pickle(self):
+        """Test that DegradedOutput keeps its limit through pickling."""
+        output = pickle.loads(pickle.dumps(DegradedOutput('text', 'nodes')))
+        self.assertEqual((output, output.limit), ('text', 'nodes'))
+    
+    def test_translate_many(self):
+        """Test that translate_many applies limits in workers."""
+        documents = [self.DOC, '<p>a</p>']
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            outputs = list(translate_many(documents, executor=executor, limits=Limits(nodes=5)))
+        self.assertEqual(outputs[0].limit, 'nodes')
+        self.assertEqual(outputs[1], 'a')
+        self.assertEqual(outputs, list(translate_many(documents, workers=1, limits=Limits(nodes=5))))
+
+
 if __name__ == '__main__':
     unittest.main()